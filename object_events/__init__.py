@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
 __version__ = '1.2'
+
+default_app_config = 'object_events.apps.ObjectEventsConfig'
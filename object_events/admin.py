@@ -1,7 +1,12 @@
 """Admin classes for the ``object_events`` app."""
 from django.contrib import admin
 
-from .models import ObjectEvent, ObjectEventType
+from .models import (
+    ObjectEvent,
+    ObjectEventSubscription,
+    ObjectEventType,
+    ObjectEventUserState,
+)
 
 
 class ObjectEventTypeAdmin(admin.ModelAdmin):
@@ -12,11 +17,17 @@ class ObjectEventAdmin(admin.ModelAdmin):
     list_display = [
         'user_email', 'content_object', 'type_title', 'creation_date', ]
 
+    def get_queryset(self, request):
+        return super(ObjectEventAdmin, self).get_queryset(
+            request).with_related()
+
     def content_object(self, obj):
         return obj.content_object
     content_object.short_description = 'Content object'
 
     def user_email(self, obj):
+        if obj.user is None:
+            return obj.get_audience_display()
         return obj.user.email
     user_email.short_description = 'User'
 
@@ -25,5 +36,17 @@ class ObjectEventAdmin(admin.ModelAdmin):
     type_title.short_description = 'Type'
 
 
+class ObjectEventUserStateAdmin(admin.ModelAdmin):
+    list_display = ['user', 'unread_count', ]
+    raw_id_fields = ['user', ]
+
+
+class ObjectEventSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'content_type', 'object_id', 'creation_date', ]
+    raw_id_fields = ['user', ]
+
+
 admin.site.register(ObjectEvent, ObjectEventAdmin)
 admin.site.register(ObjectEventType, ObjectEventTypeAdmin)
+admin.site.register(ObjectEventUserState, ObjectEventUserStateAdmin)
+admin.site.register(ObjectEventSubscription, ObjectEventSubscriptionAdmin)
@@ -12,3 +12,59 @@ def get_user_aggregation_class():
 
 USER_AGGREGATION_CLASS = lambda: get_user_aggregation_class()
 PAGINATION_ITEMS = getattr(settings, 'OBJECT_EVENTS_PAGINATION_ITEMS', 30)
+BULK_BATCH_SIZE = getattr(settings, 'OBJECT_EVENTS_BULK_BATCH_SIZE', 500)
+WARM_EVENT_TYPE_CACHE = getattr(
+    settings, 'OBJECT_EVENTS_WARM_EVENT_TYPE_CACHE', True)
+DIGEST_CHUNK_SIZE = getattr(settings, 'OBJECT_EVENTS_DIGEST_CHUNK_SIZE', 1000)
+DIGEST_RETRIES = getattr(settings, 'OBJECT_EVENTS_DIGEST_RETRIES', 1)
+CLAIM_TIMEOUT = getattr(settings, 'OBJECT_EVENTS_CLAIM_TIMEOUT', 3600)
+CURSOR_PAGINATION = getattr(
+    settings, 'OBJECT_EVENTS_CURSOR_PAGINATION', False)
+RETENTION_POLICIES = getattr(
+    settings, 'OBJECT_EVENTS_RETENTION_POLICIES', {})
+WRITE_BEHIND = getattr(settings, 'OBJECT_EVENTS_WRITE_BEHIND', False)
+WRITE_BEHIND_QUEUE_SIZE = getattr(
+    settings, 'OBJECT_EVENTS_WRITE_BEHIND_QUEUE_SIZE', 10000)
+WRITE_BEHIND_INTERVAL = getattr(
+    settings, 'OBJECT_EVENTS_WRITE_BEHIND_INTERVAL', 500)
+WRITE_BEHIND_FLUSH_SIZE = getattr(
+    settings, 'OBJECT_EVENTS_WRITE_BEHIND_FLUSH_SIZE', 500)
+WRITE_BEHIND_BLOCK_TIMEOUT = getattr(
+    settings, 'OBJECT_EVENTS_WRITE_BEHIND_BLOCK_TIMEOUT', 0)
+COALESCE_WINDOWS = getattr(settings, 'OBJECT_EVENTS_COALESCE_WINDOWS', {})
+NOTIFICATIONS_CACHE = getattr(
+    settings, 'OBJECT_EVENTS_NOTIFICATIONS_CACHE', None)
+NOTIFICATIONS_CACHE_TIMEOUT = getattr(
+    settings, 'OBJECT_EVENTS_NOTIFICATIONS_CACHE_TIMEOUT', 300)
+BROKER = getattr(
+    settings, 'OBJECT_EVENTS_BROKER',
+    'object_events.brokers.LocalMemoryBroker')
+STREAMING = getattr(settings, 'OBJECT_EVENTS_STREAMING', False)
+STREAM_TIMEOUT = getattr(settings, 'OBJECT_EVENTS_STREAM_TIMEOUT', 300)
+STREAM_HEARTBEAT = getattr(settings, 'OBJECT_EVENTS_STREAM_HEARTBEAT', 15)
+STORAGE = getattr(
+    settings, 'OBJECT_EVENTS_STORAGE', 'object_events.storage.ModelStorage')
+LOOKBACK_DAYS = getattr(settings, 'OBJECT_EVENTS_LOOKBACK_DAYS', None)
+PARTITION_PREMAKE = getattr(settings, 'OBJECT_EVENTS_PARTITION_PREMAKE', 3)
+PARTITION_RETENTION = getattr(
+    settings, 'OBJECT_EVENTS_PARTITION_RETENTION', None)
+METRICS_SINK = getattr(settings, 'OBJECT_EVENTS_METRICS_SINK', None)
+STATSD_HOST = getattr(settings, 'OBJECT_EVENTS_STATSD_HOST', 'localhost')
+STATSD_PORT = getattr(settings, 'OBJECT_EVENTS_STATSD_PORT', 8125)
+STATSD_PREFIX = getattr(
+    settings, 'OBJECT_EVENTS_STATSD_PREFIX', 'object_events')
+EMAIL_BACKEND = getattr(
+    settings, 'OBJECT_EVENTS_EMAIL_BACKEND', 'mailer.backend.DbBackend')
+EMAIL_BATCH_SIZE = getattr(settings, 'OBJECT_EVENTS_EMAIL_BATCH_SIZE', 100)
+MAILER_SCHEDULE = getattr(settings, 'OBJECT_EVENTS_MAILER_SCHEDULE', {
+    'realtime': True,
+    'daily': {'hour': 0},
+    'weekly': {'weekday': 6, 'hour': 15},
+    'monthly': {'day': 1, 'hour': 17},
+})
+MAILER_POLL_INTERVAL = getattr(
+    settings, 'OBJECT_EVENTS_MAILER_POLL_INTERVAL', 10)
+MAILER_LOCK_CACHE = getattr(
+    settings, 'OBJECT_EVENTS_MAILER_LOCK_CACHE', 'default')
+MAILER_LOCK_TIMEOUT = getattr(
+    settings, 'OBJECT_EVENTS_MAILER_LOCK_TIMEOUT', 60)
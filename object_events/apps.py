@@ -0,0 +1,7 @@
+"""App configuration for the ``object_events`` app."""
+from django.apps import AppConfig
+
+
+class ObjectEventsConfig(AppConfig):
+    name = 'object_events'
+    verbose_name = 'Object Events'
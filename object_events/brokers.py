@@ -0,0 +1,178 @@
+"""
+Brokers, that tell the notification streams of the users about changes.
+
+Whenever events of a user are created or marked, a message is published to
+the channel of the user. Audience events are published to all channels. The
+messages are small dicts like ``{'type': 'changed'}``, the stream loads the
+actual events from the database.
+
+The broker is set by ``OBJECT_EVENTS_BROKER``. ``LocalMemoryBroker`` only
+reaches the streams of the current process, so deployments with several
+processes need a broker backed by a shared pub/sub service, e.g. redis.
+Clients are only told to use the stream, if ``OBJECT_EVENTS_STREAMING`` is
+set and the broker is shared. Otherwise they poll.
+
+"""
+from threading import Lock
+
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+from django.utils.six.moves import queue
+
+from . import app_settings
+
+_broker = None
+_broker_lock = Lock()
+
+
+class BaseSubscription(object):
+    """The subscription of one stream to the channel of a user."""
+
+    def get(self, timeout):
+        """
+        Returns the next message or ``None``, if there was none in time.
+
+        :param timeout: Seconds to wait for a message.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Ends the subscription."""
+        raise NotImplementedError
+
+
+class BaseBroker(object):
+    """
+    Interface for the brokers. Make sure to inherit it.
+
+    :shared: ``True``, if the messages reach the streams of all processes.
+
+    """
+    shared = True
+
+    def publish(self, user_pks, message):
+        """
+        Publishes the message to the channels of the given users.
+
+        :param user_pks: Iterable of user pks or ``None`` for all channels.
+
+        """
+        raise NotImplementedError
+
+    def subscribe(self, user_pk):
+        """Returns a ``BaseSubscription`` to the channel of the user."""
+        raise NotImplementedError
+
+
+class LocalMemorySubscription(BaseSubscription):
+    """Subscription of the ``LocalMemoryBroker``."""
+
+    def __init__(self, broker, user_pk, maxsize):
+        self.broker = broker
+        self.user_pk = user_pk
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # The stream is behind anyway and will load all changes with the
+            # messages that are still waiting.
+            pass
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalMemoryBroker(BaseBroker):
+    """
+    Broker for the streams of the current process.
+
+    :param maxsize: Amount of messages a subscription keeps at most.
+
+    """
+    shared = False
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.lock = Lock()
+        self.subscriptions = {}
+
+    def publish(self, user_pks, message):
+        with self.lock:
+            if user_pks is None:
+                subscriptions = [
+                    subscription for subscriptions in (
+                        self.subscriptions.values())
+                    for subscription in subscriptions]
+            else:
+                subscriptions = [
+                    subscription for user_pk in set(user_pks)
+                    for subscription in self.subscriptions.get(user_pk, ())]
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def subscribe(self, user_pk):
+        subscription = LocalMemorySubscription(self, user_pk, self.maxsize)
+        with self.lock:
+            self.subscriptions.setdefault(user_pk, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_pk, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.user_pk, None)
+
+
+def get_broker():
+    """Returns the broker of this process."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(app_settings.BROKER)()
+            if not isinstance(_broker, BaseBroker):
+                raise TypeError('Your broker must inherit BaseBroker.')
+        return _broker
+
+
+def is_streaming_enabled():
+    """
+    Returns ``True``, if the clients should use the stream instead of polling.
+
+    Needs ``OBJECT_EVENTS_STREAMING`` and a shared broker. With a broker of
+    one process most changes would never reach the stream of the client.
+
+    """
+    return app_settings.STREAMING and get_broker().shared
+
+
+def publish_change(user_pks=(), audience=False):
+    """
+    Tells the streams of the given users, that their notifications changed.
+
+    :param audience: Tells all streams, if ``True``.
+
+    Inside of a transaction the message is published after the commit, so
+    that the streams can load the changes.
+
+    """
+    user_pks = None if audience else list(user_pks)
+    if user_pks == []:
+        return
+
+    def publish():
+        get_broker().publish(user_pks, {'type': 'changed'})
+
+    if connection.in_atomic_block:
+        transaction.on_commit(publish)
+    else:
+        publish()
@@ -0,0 +1,137 @@
+"""
+Versioned per-user cache for the ``render_notifications`` template tag.
+
+Every user has a version in the cache, which is bumped whenever the
+notifications of the user change. Audience events share one version for all
+users. A cached fragment stores the versions it was rendered with and is only
+used while they are still current, so a page view costs a single
+``get_many`` call and no database queries.
+
+The cache is disabled, unless ``OBJECT_EVENTS_NOTIFICATIONS_CACHE`` names a
+cache alias.
+
+"""
+import time
+from hashlib import md5
+
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.utils.encoding import force_bytes
+
+from . import app_settings
+
+#: Rendered in place of request specific values, which must not be cached.
+CSRF_TOKEN_PLACEHOLDER = '__object_events_csrf_token__'
+NEXT_URL_PLACEHOLDER = '__object_events_next_url__'
+
+AUDIENCE_VERSION_KEY = 'object_events:version:audience'
+
+
+def get_cache():
+    """Returns the configured cache or ``None``, if caching is disabled."""
+    if not app_settings.NOTIFICATIONS_CACHE:
+        return None
+    return caches[app_settings.NOTIFICATIONS_CACHE]
+
+
+def _get_version_key(user_pk):
+    return 'object_events:version:{0}'.format(user_pk)
+
+
+def _get_fragment_key(user_pk, name):
+    return 'object_events:notifications:{0}:{1}'.format(
+        user_pk, md5(force_bytes(name)).hexdigest())
+
+
+def _new_version():
+    # Based on the time, so that a version key, that got evicted, doesn't
+    # start over and match old fragments.
+    return int(time.time() * 1000)
+
+
+def _bump(keys):
+    cache = get_cache()
+    if cache is None:
+        return
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def bump_versions(user_pks=(), audience=False):
+    """
+    Invalidates the cached fragments of the given users.
+
+    :param audience: Invalidates the fragments of all users, if ``True``.
+
+    The versions are bumped right away and, inside of a transaction, once
+    more after the commit, so that a fragment rendered from the uncommitted
+    state doesn't survive.
+
+    """
+    keys = [_get_version_key(user_pk) for user_pk in set(user_pks)]
+    if audience:
+        keys.append(AUDIENCE_VERSION_KEY)
+    if not keys or get_cache() is None:
+        return
+    _bump(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def get_versions(user_pk):
+    """
+    Returns the current ``(user, audience)`` versions of the user.
+
+    Missing versions are initialized. Returns ``None``, if caching is
+    disabled.
+
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    keys = [_get_version_key(user_pk), AUDIENCE_VERSION_KEY]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def get_fragment(user_pk, name):
+    """
+    Returns the cached fragment of the user or ``None``.
+
+    :param name: Identifies the fragment, e.g. the template and its arguments.
+
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    fragment_key = _get_fragment_key(user_pk, name)
+    keys = [_get_version_key(user_pk), AUDIENCE_VERSION_KEY, fragment_key]
+    values = cache.get_many(keys)
+    if fragment_key not in values:
+        return None
+    versions, html = values[fragment_key]
+    if versions != (values.get(keys[0]), values.get(keys[1])):
+        return None
+    return html
+
+
+def set_fragment(user_pk, name, versions, html):
+    """
+    Caches a fragment, that was rendered with the given versions.
+
+    Get the versions with ``get_versions`` before reading the data of the
+    fragment.
+
+    """
+    cache = get_cache()
+    if cache is None or versions is None:
+        return
+    cache.set(_get_fragment_key(user_pk, name), (versions, html),
+              app_settings.NOTIFICATIONS_CACHE_TIMEOUT)
@@ -0,0 +1,167 @@
+"""
+Rendering and sending of the digests of the ``send_event_emails`` command.
+
+``DigestMailer`` loads the subject and body templates once and renders every
+digest from ``DigestItem`` objects, which only hold strings, so that the
+templates can't trigger queries. The messages are queued in batches and sent
+one by one through one connection of ``OBJECT_EVENTS_EMAIL_BACKEND``.
+
+"""
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+from django_libs.utils import html_to_plain_text
+
+from . import app_settings, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DigestItem(object):
+    """
+    One event of a digest.
+
+    Renders as the text of the event, so ``{{ object_event }}`` keeps working
+    in existing templates.
+
+    """
+    def __init__(self, event):
+        self.pk = event.pk
+        self.title = u'{0}'.format(event.event_type.title)
+        self.text = u'{0}'.format(event)
+        self.additional_text = event.additional_text
+        self.creation_date = event.creation_date
+        self.count = event.coalesced_count
+        get_url = getattr(event.content_object, 'get_absolute_url', None)
+        self.url = get_url() if get_url else ''
+
+    def __unicode__(self):
+        return self.text
+
+    def __str__(self):
+        return self.text
+
+
+def get_event_types(events):
+    """
+    Returns the ``DigestItem`` objects of the events per event type title.
+
+    The types and items keep the order of the events.
+
+    """
+    event_types = OrderedDict()
+    for event in events:
+        item = DigestItem(event)
+        event_types.setdefault(item.title, []).append(item)
+    return event_types
+
+
+class DigestMailer(object):
+    """
+    Renders digests and sends them in batches through one connection.
+
+    :param batch_size: Amount of messages that are queued before they are
+      sent.
+    :param retries: How often a message is sent again through a new
+      connection, if sending fails.
+    :param backend: Dotted path to the email backend.
+    :param tags: Tags of the ``digest.send`` timing of every batch.
+
+    Call ``flush`` after the last digest. Every queued message has a
+    callback, which is called with ``True`` once the message was sent or with
+    ``False`` if it failed for good.
+
+    """
+    def __init__(self, batch_size=None, retries=1, backend=None,
+                 subject_template='object_events/email/subject.html',
+                 body_template='object_events/email/body.html', tags=None):
+        self.batch_size = max(batch_size or app_settings.EMAIL_BATCH_SIZE, 1)
+        self.retries = retries
+        self.backend = backend or app_settings.EMAIL_BACKEND
+        self.subject_template = get_template(subject_template)
+        self.body_template = get_template(body_template)
+        self.tags = tags
+        self.connection = None
+        self.pending = []
+
+    def render(self, email, context):
+        """Returns the message with the rendered digest for the address."""
+        subject = u''.join(
+            self.subject_template.render(context).splitlines())
+        html = self.body_template.render(context)
+        message = EmailMultiAlternatives(
+            subject, html_to_plain_text(html), settings.FROM_EMAIL, [email])
+        message.attach_alternative(html, 'text/html')
+        return message
+
+    def send(self, message, callback=None):
+        """Queues the message and sends the batch, once it is full."""
+        self.pending.append((message, callback))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection(self.backend)
+            self.connection.open()
+
+    def close(self):
+        """Closes the connection. The next message opens a new one."""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                logger.debug('Could not close the connection.', exc_info=True)
+            self.connection = None
+
+    def send_message(self, message):
+        """
+        Sends one message through the connection.
+
+        If sending fails, the message is sent again through a new connection.
+
+        :returns: ``True``, if the message was sent.
+
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                self.open()
+                self.connection.send_messages([message])
+            except Exception:
+                logger.warning('Could not send the digest to %s.',
+                               u', '.join(message.to), exc_info=True)
+                self.close()
+            else:
+                return True
+        return False
+
+    def flush(self):
+        """
+        Sends the queued messages.
+
+        The messages are sent one by one through the same connection, since
+        backends like SMTP send them one at a time anyway and only return the
+        amount of sent messages, but not which ones were sent. A failed
+        message doesn't affect the others: they are sent through a new
+        connection and every callback gets the result of its own message.
+
+        :returns: ``True``, if all messages were sent.
+
+        """
+        batch, self.pending = self.pending, []
+        with metrics.timer('digest.send', self.tags):
+            results = [
+                self.send_message(message) for message, callback in batch]
+        for (message, callback), sent in zip(batch, results):
+            if callback is None:
+                continue
+            try:
+                callback(sent)
+            except Exception:
+                logger.exception('The callback of the digest to %s failed.',
+                                 u', '.join(message.to))
+        return all(results)
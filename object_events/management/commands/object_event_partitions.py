@@ -0,0 +1,102 @@
+"""
+Custom admin command to manage the monthly partitions of the event table.
+
+Needs PostgreSQL 11 or newer. Run it once with ``--setup`` to partition the
+table, then e.g. once a day to create the partitions of the next months
+ahead of time and to drop the partitions, that are older than
+``OBJECT_EVENTS_PARTITION_RETENTION`` months.
+
+Dropping a partition deletes all of its events, no matter if they have been
+read or sent. The unread counters are rebuilt afterwards.
+
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ...models import ObjectEventUserState
+from ...partitions import (
+    add_months,
+    get_bound,
+    get_create_statement,
+    get_drop_statements,
+    get_month,
+    get_partition_name,
+    get_partitions,
+    get_setup_statements,
+    is_partitioned,
+    supports_partitioning,
+)
+from ... import app_settings
+
+
+class Command(BaseCommand):
+    """Class for the object_event_partitions admin command."""
+    help = 'Creates and drops the monthly partitions of the event table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--setup', action='store_true', dest='setup', default=False,
+            help='Partition the event table, if it is not partitioned yet.')
+        parser.add_argument(
+            '--premake', type=int, dest='premake',
+            default=app_settings.PARTITION_PREMAKE,
+            help='Amount of future months to create partitions for.')
+        parser.add_argument(
+            '--drop-older-than', type=int, dest='retention',
+            default=app_settings.PARTITION_RETENTION,
+            help='Drop the partitions, that end more than this amount of'
+                 ' months before the current month.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only print the SQL statements.')
+
+    def execute_sql(self, cursor, statements):
+        for statement in statements:
+            if self.dry_run:
+                self.stdout.write('{0};'.format(statement))
+            else:
+                cursor.execute(statement)
+
+    def handle(self, **options):
+        """Handles the object_event_partitions admin command."""
+        if not supports_partitioning(connection):
+            raise CommandError(
+                'Partitioning the events needs PostgreSQL 11 or newer.')
+        self.dry_run = options.get('dry_run')
+        this_month = get_month(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                if not options.get('setup'):
+                    raise CommandError(
+                        'The event table is not partitioned. Run the command'
+                        ' with --setup first.')
+                self.execute_sql(cursor, get_setup_statements(
+                    cursor, connection, add_months(this_month, 1)))
+                if self.dry_run:
+                    return
+                self.stdout.write('Partitioned the event table.')
+            partitions = get_partitions(cursor)
+            covered_until = max([
+                bound for name, bound in partitions if bound is not None
+            ] or [get_bound(this_month)])
+            for i in range(max(options.get('premake') or 0, 0) + 1):
+                month = add_months(this_month, i)
+                if get_bound(month) < covered_until:
+                    continue
+                self.execute_sql(
+                    cursor, [get_create_statement(connection, month)])
+                self.stdout.write(
+                    'Created {0}.'.format(get_partition_name(month)))
+            if options.get('retention') is None:
+                return
+            cutoff = get_bound(add_months(this_month, -options['retention']))
+            dropped = 0
+            for name, bound in partitions:
+                if bound is not None and bound <= cutoff:
+                    self.execute_sql(
+                        cursor, get_drop_statements(connection, name))
+                    self.stdout.write('Dropped {0}.'.format(name))
+                    dropped += 1
+            if dropped and not self.dry_run:
+                ObjectEventUserState.objects.rebuild()
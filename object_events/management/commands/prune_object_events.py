@@ -0,0 +1,183 @@
+"""
+Custom admin command to delete old events.
+
+Only events that have been read by the user and sent via email are deleted.
+How long they are kept depends on their type and is defined in the
+``OBJECT_EVENTS_RETENTION_POLICIES`` setting, e.g.::
+
+    OBJECT_EVENTS_RETENTION_POLICIES = {
+        'comment': 30,
+        '*': 365,
+    }
+
+would keep ``comment`` events for 30 days and all other events for a year.
+
+The events are deleted in small chunks in the order of their pk, so that the
+command can run against a live database and every chunk continues after the
+last one. Optionally they are archived to the ``ObjectEventArchive`` table or
+to a gzipped JSON lines file. The file is written once the deletion of the
+chunk has been committed.
+
+Audience events expire by age only, even if they are unread, so the unread
+counters are rebuilt after audience events have been deleted.
+
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+from ...models import (
+    ObjectEvent,
+    ObjectEventArchive,
+    ObjectEventType,
+    ObjectEventUserState,
+)
+from ... import app_settings
+
+ARCHIVE_FIELDS = [
+    'pk', 'user_id', 'event_type__title', 'creation_date', 'content_type_id',
+    'object_id', 'event_content_type_id', 'event_object_id',
+    'additional_text',
+]
+
+
+class Command(BaseCommand):
+    """Class for the prune_object_events admin command."""
+    help = 'Deletes read and sent events that exceeded their retention time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, dest='days', default=None,
+            help='Retention time in days for all types without a policy.'
+                 ' Overrides the "*" policy.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size', default=1000,
+            help='Amount of events to delete per query.')
+        parser.add_argument(
+            '--sleep', type=float, dest='sleep', default=0,
+            help='Seconds to wait between two chunks.')
+        parser.add_argument(
+            '--archive-table', action='store_true', dest='archive_table',
+            default=False,
+            help='Copy the events to the ObjectEventArchive table first.')
+        parser.add_argument(
+            '--archive-file', dest='archive_file', default=None,
+            help='Append the events to this gzipped JSON lines file first.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only count the events that would be deleted.')
+
+    def get_queryset(self, policies):
+        """Returns all events that exceeded their retention time."""
+        policies = dict(policies)
+        default_days = policies.pop('*', None)
+        event_types = dict(ObjectEventType.objects.filter(
+            title__in=policies.keys()).values_list('title', 'pk'))
+        expired = Q(pk__in=[])
+        for title, days in policies.items():
+            if title in event_types:
+                expired |= Q(event_type=event_types[title],
+                             creation_date__lt=self.now - timedelta(days))
+        if default_days is not None:
+            expired |= (
+                ~Q(event_type__in=event_types.values()) &
+                Q(creation_date__lt=self.now - timedelta(default_days)))
+        # Audience events have no per-user flags, they expire by age only.
+        return ObjectEvent.objects.filter(expired).filter(
+            Q(email_sent=True) & (
+                Q(read_by_user=True) |
+                Q(creation_date__lte=F(
+                    'user__object_event_state__last_read_at'))) |
+            ~Q(audience=''))
+
+    def archive(self, pks, archive_table, archive_file):
+        """
+        Copies the events with the given pks to the archive(s).
+
+        The rows are appended to the file after the current transaction has
+        been committed, so a rolled back chunk doesn't end up in the file.
+
+        """
+        rows = list(ObjectEvent.objects.filter(pk__in=pks).values(
+            *ARCHIVE_FIELDS))
+        if archive_table:
+            ObjectEventArchive.objects.bulk_create([ObjectEventArchive(
+                event_id=row['pk'],
+                user_id=row['user_id'],
+                event_type=row['event_type__title'],
+                creation_date=row['creation_date'],
+                content_type_id=row['content_type_id'],
+                object_id=row['object_id'],
+                event_content_type_id=row['event_content_type_id'],
+                event_object_id=row['event_object_id'],
+                additional_text=row['additional_text'],
+            ) for row in rows])
+        if archive_file:
+            transaction.on_commit(
+                lambda: self.write_archive_file(archive_file, rows))
+
+    def write_archive_file(self, archive_file, rows):
+        """Appends the rows to the gzipped JSON lines file."""
+        with gzip.open(archive_file, 'ab') as f:
+            for row in rows:
+                f.write(force_bytes(json.dumps(
+                    row, cls=DjangoJSONEncoder, sort_keys=True) + '\n'))
+
+    def handle(self, **options):
+        """Handles the prune_object_events admin command."""
+        self.now = timezone.now()
+        policies = dict(app_settings.RETENTION_POLICIES)
+        if options.get('days') is not None:
+            policies['*'] = options['days']
+        if not policies:
+            raise CommandError(
+                'Please define OBJECT_EVENTS_RETENTION_POLICIES or provide'
+                ' --days.')
+        queryset = self.get_queryset(policies)
+        if options.get('dry_run'):
+            self.stdout.write(
+                '{0} events would be deleted.'.format(queryset.count()))
+            return
+        chunk_size = options.get('chunk_size') or 1000
+        deleted = 0
+        deleted_audience_events = False
+        last_pk = None
+        while True:
+            # The keyset cursor skips the rows of the previous chunks instead
+            # of scanning over them again.
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            rows = list(chunk.order_by('pk').values_list(
+                'pk', 'audience')[:chunk_size])
+            if not rows:
+                break
+            pks = [pk for pk, audience in rows]
+            last_pk = pks[-1]
+            deleted_audience_events = deleted_audience_events or any(
+                audience for pk, audience in rows)
+            with transaction.atomic():
+                if options.get('archive_table') or options.get(
+                        'archive_file'):
+                    self.archive(pks, options.get('archive_table'),
+                                 options.get('archive_file'))
+                ObjectEvent.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            self.stdout.write('Deleted {0} events.'.format(deleted))
+            if options.get('sleep'):
+                time.sleep(options['sleep'])
+        if deleted_audience_events:
+            # Audience events are deleted, even if they are unread, and they
+            # are part of the unread counts of their whole audience.
+            ObjectEventUserState.objects.rebuild()
+        self.stdout.write(
+            'The command took {0} seconds to finish. Deleted {1}'
+            ' events.'.format((timezone.now() - self.now).seconds, deleted))
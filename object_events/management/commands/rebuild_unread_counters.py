@@ -0,0 +1,22 @@
+"""
+Custom admin command to recount the unread events of all users.
+
+The unread counters are kept up to date by the app itself. Run this command if
+you changed events in any other way, e.g. via the admin or via queryset
+updates.
+
+"""
+from django.core.management.base import BaseCommand
+
+from ...models import ObjectEventUserState
+
+
+class Command(BaseCommand):
+    """Class for the rebuild_unread_counters admin command."""
+    help = 'Recounts the unread events of all users.'
+
+    def handle(self, **options):
+        """Handles the rebuild_unread_counters admin command."""
+        changed = ObjectEventUserState.objects.rebuild()
+        self.stdout.write(
+            'Updated the unread counters of {0} users.'.format(changed))
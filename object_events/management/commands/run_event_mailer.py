@@ -0,0 +1,225 @@
+"""
+Custom admin command to send the digests of all intervals on a schedule.
+
+Instead of a cronjob per interval this command keeps running and calls
+``send_event_emails`` in the same process, whenever an interval is due. The
+schedule of every interval is defined in the ``OBJECT_EVENTS_MAILER_SCHEDULE``
+setting, e.g.::
+
+    OBJECT_EVENTS_MAILER_SCHEDULE = {
+        'realtime': True,
+        'daily': {'hour': 0},
+        'weekly': {'weekday': 6, 'hour': 15},
+        'monthly': {'day': 1, 'hour': 17},
+    }
+
+Realtime digests are sent, whenever the newest event changed since the last
+successful run. Polling costs one query every ``--poll-interval`` seconds.
+
+Only one scheduler may run per deployment. It holds a lock in the cache set in
+``OBJECT_EVENTS_MAILER_LOCK_CACHE`` and refreshes it in the background. The
+cache must be shared between the processes, so the local memory and the dummy
+cache are refused. If the lock is lost, the command stops after the current
+run and fails. It stops after the current run on SIGTERM or SIGINT as well.
+
+"""
+import os
+import signal
+import socket
+import time
+from calendar import monthrange
+from datetime import timedelta
+from threading import Event, Thread
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from ...storage import get_storage
+from ... import app_settings
+
+LOCK_KEY = 'object_events:run_event_mailer'
+
+#: The scheduled intervals in the order they run, if several are due.
+INTERVALS = ('daily', 'weekly', 'monthly')
+
+
+def _matches(schedule, day):
+    if schedule.get('weekday') not in (None, day.weekday()):
+        return False
+    if schedule.get('day') is None:
+        return True
+    return min(schedule['day'], monthrange(day.year, day.month)[1]) == day.day
+
+
+def get_next_run(schedule, after):
+    """
+    Returns the first time after ``after``, that matches the schedule.
+
+    :param schedule: Dict with the ``hour`` and ``minute`` (both default to 0)
+      and optionally the ``weekday`` (0 is monday) or the ``day`` of the
+      month. Days after the end of a month match its last day.
+    :param after: A datetime, aware if ``USE_TZ`` is set. The schedule is
+      matched against the local time.
+
+    """
+    aware = timezone.is_aware(after)
+    if aware:
+        after = timezone.make_naive(after)
+    day = after.replace(
+        hour=schedule.get('hour', 0), minute=schedule.get('minute', 0),
+        second=0, microsecond=0)
+    # A monthly run is at most 31 days away.
+    for i in range(33):
+        if day > after and _matches(schedule, day):
+            return timezone.make_aware(day) if aware else day
+        day += timedelta(days=1)
+    raise ValueError('The schedule {0} never matches.'.format(schedule))
+
+
+class Command(BaseCommand):
+    """Class for the run_event_mailer admin command."""
+    help = 'Sends the digests of all intervals on their schedule.'
+    lock_lost = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, dest='poll_interval',
+            default=app_settings.MAILER_POLL_INTERVAL,
+            help='Seconds between two polls for new realtime events.')
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=1,
+            help='Amount of threads that send the digests concurrently.')
+
+    def get_cache(self):
+        return caches[app_settings.MAILER_LOCK_CACHE]
+
+    def acquire_lock(self):
+        """Takes the lock of the deployment or raises ``CommandError``."""
+        cache = self.get_cache()
+        if isinstance(cache, (DummyCache, LocMemCache)):
+            raise CommandError(
+                'The cache {0} of OBJECT_EVENTS_MAILER_LOCK_CACHE is not'
+                ' shared between the processes.'.format(
+                    app_settings.MAILER_LOCK_CACHE))
+        self.lock_token = '{0}:{1}:{2}'.format(
+            socket.gethostname(), os.getpid(), time.time())
+        if not cache.add(
+                LOCK_KEY, self.lock_token, app_settings.MAILER_LOCK_TIMEOUT):
+            raise CommandError(
+                'Another run_event_mailer holds the lock {0}.'.format(
+                    LOCK_KEY))
+
+    def heartbeat(self):
+        """
+        Refreshes the lock, if it is still held by this scheduler.
+
+        An expired lock is never taken again, since another scheduler may have
+        run in the meantime. The lock is refreshed with two thirds of its
+        timeout left, so it can't expire between the check and the refresh.
+        If another scheduler took it anyway, the lock is read again after the
+        refresh and at least one of both schedulers notices the loss.
+
+        :returns: ``False``, if the lock has been lost.
+
+        """
+        cache = self.get_cache()
+        if cache.get(LOCK_KEY) != self.lock_token:
+            return False
+        cache.set(LOCK_KEY, self.lock_token, app_settings.MAILER_LOCK_TIMEOUT)
+        return cache.get(LOCK_KEY) == self.lock_token
+
+    def release_lock(self):
+        cache = self.get_cache()
+        if cache.get(LOCK_KEY) == self.lock_token:
+            cache.delete(LOCK_KEY)
+
+    def keep_lock(self):
+        """Refreshes the lock until the scheduler stops."""
+        while not self.stopped.wait(app_settings.MAILER_LOCK_TIMEOUT / 3.0):
+            if not self.heartbeat():
+                self.stderr.write('Lost the lock {0}.'.format(LOCK_KEY))
+                self.lock_lost = True
+                self.stop()
+
+    def stop(self, signum=None, frame=None):
+        """Stops the scheduler after the current run."""
+        self.stopped.set()
+
+    def send(self, interval):
+        """
+        Sends the digests of the interval, unless the lock has been lost.
+
+        :returns: ``True``, if the run succeeded.
+
+        """
+        if self.lock_lost:
+            return False
+        try:
+            call_command('send_event_emails', interval, stdout=self.stdout,
+                         **self.send_options)
+        except Exception as ex:
+            # One failed run must not stop the scheduler.
+            self.stderr.write('Could not send the {0} digests: {1}'.format(
+                interval, ex))
+            return False
+        return True
+
+    def tick(self, now):
+        """Sends the digests of the due intervals and the realtime digests."""
+        for interval in INTERVALS:
+            if interval in self.next_runs and now >= self.next_runs[interval]:
+                self.next_runs[interval] = get_next_run(
+                    app_settings.MAILER_SCHEDULE[interval], now)
+                self.send(interval)
+        if not app_settings.MAILER_SCHEDULE.get('realtime'):
+            return
+        latest_pk = get_storage().get_latest_pk()
+        if latest_pk is not None and latest_pk != self.last_pk:
+            # Events created during the run trigger the next one and a failed
+            # run is repeated with the next poll.
+            if self.send('realtime'):
+                self.last_pk = latest_pk
+
+    def run(self):
+        """Runs the scheduler until ``stop`` is called."""
+        while not self.stopped.is_set():
+            connection.close_if_unusable_or_obsolete()
+            self.tick(timezone.now())
+            self.stopped.wait(self.poll_interval)
+
+    def handle(self, **options):
+        """Handles the run_event_mailer admin command."""
+        self.poll_interval = max(
+            options.get('poll_interval') or app_settings.MAILER_POLL_INTERVAL,
+            0.1)
+        self.send_options = {'workers': options.get('workers') or 1}
+        self.stopped = Event()
+        self.last_pk = None
+        now = timezone.now()
+        self.next_runs = dict(
+            (interval, get_next_run(app_settings.MAILER_SCHEDULE[interval],
+                                    now))
+            for interval in INTERVALS
+            if app_settings.MAILER_SCHEDULE.get(interval))
+        self.acquire_lock()
+        handlers = dict(
+            (signum, signal.signal(signum, self.stop))
+            for signum in (signal.SIGTERM, signal.SIGINT))
+        heartbeat = Thread(target=self.keep_lock)
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            self.run()
+        finally:
+            self.stop()
+            heartbeat.join()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.release_lock()
+        if self.lock_lost:
+            raise CommandError('Lost the lock {0}.'.format(LOCK_KEY))
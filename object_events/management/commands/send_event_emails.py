@@ -10,52 +10,210 @@ Options:
 
 The command always iterates over all events that have email_sent=False, but if
 your app allows users to change their notification interval in their
-UserProfile providing this parameter will call a different method on your
-UserAggregation class implementation and therefore will include only a subset
-of events (only for certain users).
+UserProfile providing this parameter will only include the events of the
+recipients, that your UserAggregation class returns for this interval. The
+recipients are loaded with one query and carry the email address and the
+language of every user.
+
+To run the command on several nodes at the same time either give each node its
+own ``--shard K/N`` or let all of them ``--claim`` the events they send.
+
+Audience events are added to the digests of all users they are meant for,
+with one lookup per chunk of digests. The newest audience event sent to a user
+is remembered in the user's ``ObjectEventUserState``. With ``--claim`` the
+audience events of a user are claimed in that state, so that only one node
+sends them, also to users without own events.
+
 
 """
-from django.conf import settings
+import os
+import socket
+from itertools import chain, groupby
+from threading import Lock, Thread, local
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.utils import timezone
-from django.utils.translation import activate
+from django.utils.six.moves import queue
+from django.utils.translation import activate, deactivate
 
 from django_libs.loaders import load_member_from_setting
-from django_libs.utils_email import send_email
 
-from ...models import ObjectEvent, UserAggregationBase
-from ... import app_settings
+from ...digests import DigestMailer, get_event_types
+from ...models import UserAggregationBase
+from ...storage import get_storage
+from ... import app_settings, metrics
 
 
 class Command(BaseCommand):
     """Class for the send_event_emails admin command."""
+    help = 'Sends a digest of all unsent events to the users of an interval.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'interval', nargs='?', default='',
+            help='One of realtime, daily, weekly or monthly.')
+        parser.add_argument(
+            '--chunk-size', type=int, dest='chunk_size',
+            default=app_settings.DIGEST_CHUNK_SIZE,
+            help='Amount of events to fetch from the database per query.')
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=1,
+            help='Amount of threads that send the digests concurrently.')
+        parser.add_argument(
+            '--retries', type=int, dest='retries',
+            default=app_settings.DIGEST_RETRIES,
+            help='How often to retry sending a digest that failed.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size',
+            default=app_settings.EMAIL_BATCH_SIZE,
+            help='Amount of emails to queue before they are sent.')
+        parser.add_argument(
+            '--shard', dest='shard', default='',
+            help='Only send the digests of the users with pk modulo N == K,'
+                 ' given as K/N.')
+        parser.add_argument(
+            '--claim', action='store_true', dest='claim', default=False,
+            help='Claim events before sending them, so that several nodes'
+                 ' can send the digests of the same interval in parallel.'
+                 ' The users of about --chunk-size events are claimed at'
+                 ' once, the audience events per user.')
+        parser.add_argument(
+            '--claim-timeout', type=int, dest='claim_timeout',
+            default=app_settings.CLAIM_TIMEOUT,
+            help='Seconds after which claims of other nodes are considered'
+                 ' stale and their events can be claimed again.')
+
+    def get_mailer(self):
+        """Returns the ``DigestMailer`` of the current thread."""
+        mailer = getattr(self.local, 'mailer', None)
+        if mailer is None:
+            mailer = self.local.mailer = DigestMailer(
+                self.batch_size, self.retries, tags=self.tags)
+        return mailer
+
     def send_mail_to_user(self, email_context, to):
         """
-        Function to send the digest to the user.
+        Function to render the digest for the recipient.
+
+        The digests are sent grouped by language, so the language of the
+        thread only changes between the groups.
+
+        :param email_context: The ``DigestItem`` objects per event type.
+        :param to: The ``Recipient`` of the digest, see
+          ``object_events.models.UserAggregationBase.get_recipients``.
+        :returns: The message or ``None``, if the recipient has no email
+          address.
+
+        """
+        if to.language and to.language != getattr(
+                self.local, 'language', None):
+            activate(to.language)
+            self.local.language = to.language
+        if to.email:
+            with metrics.timer('digest.render', self.tags):
+                return self.get_mailer().render(
+                    to.email, {'event_types': email_context})
 
-        First we check the preffered email of the User instance. You can
-        add this function in your defined User Profile. Therefore check
-        Django's AUTH_PROFILE_MODULE setting. If you haven't defined this
-        function or defined a Profile module the email of the User instance is
-        used.
+    def get_digests(self, users, chunk_size, claim=False, claim_timeout=None):
+        """
+        Yields a ``(user, events)`` tuple per digest to send.
+
+        The digests are loaded by the storage backend, see
+        ``object_events.storage.BaseStorage.get_digests``.
 
         """
-        email = to.email
-        if hasattr(to, 'get_profile'):
-            if hasattr(to.get_profile(), 'language'):
-                activate(to.get_profile().language)
-            if hasattr(to.get_profile(), 'get_preferred_email'):
-                email = to.get_profile().get_preferred_email()
-        if email:
-            send_email(
-                None,
-                {'event_types': email_context},
-                'object_events/email/subject.html',
-                'object_events/email/body.html',
-                settings.FROM_EMAIL,
-                [email],
-            )
-            self.sent_emails += 1
+        return get_storage().get_digests(
+            users, chunk_size, self.claim_token if claim else None,
+            claim_timeout)
+
+    def send_digest(self, user, object_events):
+        """
+        Renders one digest and queues it for sending.
+
+        Its events are flagged as sent, once the batch of the digest has been
+        sent.
+
+        """
+        message = self.send_mail_to_user(
+            get_event_types(object_events), self.recipients[user.pk])
+        if message is None:
+            self.digest_sent(user, object_events, True, emailed=False)
+            return
+        self.get_mailer().send(message, lambda sent: self.digest_sent(
+            user, object_events, sent))
+
+    def digest_sent(self, user, object_events, sent, emailed=True):
+        """Flags the events of a digest as sent or counts it as failed."""
+        if not sent:
+            with self.lock:
+                self.failed_digests += 1
+            metrics.incr('digest.failed', tags=self.tags)
+            self.stderr.write(
+                'Could not send the digest to user {0}.'.format(user.pk))
+            return
+        get_storage().mark_sent(user, object_events)
+        with self.lock:
+            self.sent_events += len(object_events)
+            if emailed:
+                self.sent_emails += 1
+        metrics.incr('digest.sent', tags=self.tags)
+        metrics.incr('digest.events', len(object_events), tags=self.tags)
+
+    def deliver_digest(self, user, object_events):
+        """
+        Renders a digest and retries it, if rendering fails.
+
+        A digest that still fails after all retries, or whose batch can't be
+        sent, is counted as failed and its events are not flagged as sent, so
+        they will be part of the next run.
+
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                self.send_digest(user, object_events)
+            except Exception as ex:
+                error = ex
+                if attempt < self.retries:
+                    with self.lock:
+                        self.retried_digests += 1
+                    metrics.incr('digest.retried', tags=self.tags)
+            else:
+                return True
+        with self.lock:
+            self.failed_digests += 1
+        metrics.incr('digest.failed', tags=self.tags)
+        self.stderr.write('Could not send the digest to user {0}: {1}'.format(
+            user.pk, error))
+        return False
+
+    def flush(self):
+        """
+        Sends the remaining digests of the current thread and resets its
+        language.
+
+        """
+        mailer = getattr(self.local, 'mailer', None)
+        if mailer is not None:
+            mailer.flush()
+            mailer.close()
+            self.local.mailer = None
+        if getattr(self.local, 'language', None):
+            deactivate()
+            self.local.language = None
+
+    def work(self, digests):
+        """Delivers digests from the queue until it receives ``None``."""
+        try:
+            while True:
+                digest = digests.get()
+                if digest is None:
+                    return
+                self.deliver_digest(*digest)
+        finally:
+            self.flush()
+            # Every thread uses its own database connection.
+            connections.close_all()
 
     def handle(self, interval='', **options):
         """Handles the send_event_emails admin command."""
@@ -70,36 +228,90 @@ class Command(BaseCommand):
             raise CommandError(
                 'Your user aggregation class must inherit UserAggregationBase')
         # Check interval argument and functions in the aggregation class.
-        users = getattr(aggregation, 'get_users')(interval)
-        if not users:
-            print('No users to send a {0} email.'.format(interval))
-            return
-        # Get all events , which hasn't been sent yet.
-        object_events = ObjectEvent.objects.filter(
-            email_sent=False, user__pk__in=users).order_by('user__pk')
-        if not object_events:
-            print('No events to send.')
+        recipients = aggregation.get_recipients(interval)
+        if not recipients:
+            self.stdout.write('No users to send a {0} email.'.format(interval))
             return
-        email_context = {}
-        current_user = None
+        if options.get('shard'):
+            try:
+                shard, shards = [
+                    int(part) for part in options['shard'].split('/')]
+                if not 0 <= shard < shards:
+                    raise ValueError
+            except ValueError:
+                raise CommandError(
+                    'Please provide the shard as K/N with 0 <= K < N.')
+            recipients = [
+                recipient for recipient in recipients
+                if recipient.pk % shards == shard]
+            if not recipients:
+                self.stdout.write(
+                    'No users to send a {0} email in this shard.'.format(
+                        interval))
+                return
+        chunk_size = (options.get('chunk_size') or
+                      app_settings.DIGEST_CHUNK_SIZE)
+        self.claim_token = '{0}:{1}:{2}'.format(
+            socket.gethostname(), os.getpid(), start_of_command.isoformat())
+        workers = max(options.get('workers') or 1, 1)
+        self.retries = options.get('retries') or 0
+        self.batch_size = (options.get('batch_size') or
+                           app_settings.EMAIL_BATCH_SIZE)
+        self.local = local()
+        self.lock = Lock()
         self.sent_emails = 0
-        for object_event in object_events:
-            if current_user != object_event.user and email_context:
-                self.send_mail_to_user(email_context, current_user)
-                email_context = {}
-            current_user = object_event.user
-            if email_context.get(object_event.event_type.title):
-                email_context[object_event.event_type.title].append(
-                    object_event)
-            else:
-                email_context.update({'{0}'.format(
-                    object_event.event_type.title): [object_event]})
-            object_event.email_sent = True
-            object_event.save()
-        # Send email even for the last user in the queryset, who cannot have
-        # a follower
-        if email_context:
-            self.send_mail_to_user(email_context, current_user)
-        print('The command took {0} seconds to finish. Sent {1} emails for {2}'
-              ' events.'.format((timezone.now() - start_of_command).seconds,
-                                self.sent_emails, object_events.count()))
+        self.sent_events = 0
+        self.failed_digests = 0
+        self.retried_digests = 0
+        self.tags = {'interval': interval}
+        self.recipients = dict(
+            (recipient.pk, recipient) for recipient in recipients)
+        digests = queue.Queue(maxsize=workers * 2)
+        threads = []
+        if workers > 1:
+            for i in range(workers):
+                thread = Thread(target=self.work, args=(digests, ))
+                thread.start()
+                threads.append(thread)
+        # Get all events, which haven't been sent yet, grouped by user and
+        # the users grouped by language.
+        languages = [
+            [recipient.pk for recipient in group]
+            for language, group in groupby(sorted(
+                recipients, key=lambda r: (r.language or '', r.pk)),
+                lambda r: r.language or '')]
+        pending = chain.from_iterable(
+            self.get_digests(
+                users, chunk_size, options.get('claim'),
+                options.get('claim_timeout') or app_settings.CLAIM_TIMEOUT)
+            for users in languages)
+        try:
+            while True:
+                with metrics.timer('digest.build', self.tags):
+                    digest = next(pending, None)
+                if digest is None:
+                    break
+                if threads:
+                    metrics.gauge('digest.queue_depth', digests.qsize(),
+                                  tags=self.tags)
+                    digests.put(digest)
+                else:
+                    self.deliver_digest(*digest)
+            self.flush()
+        finally:
+            for thread in threads:
+                digests.put(None)
+            for thread in threads:
+                thread.join()
+        metrics.timing('digest.run', round(
+            (timezone.now() - start_of_command).total_seconds() * 1000, 3),
+            tags=self.tags)
+        if not self.sent_events and not self.failed_digests:
+            self.stdout.write('No events to send.')
+            return
+        self.stdout.write(
+            'The command took {0} seconds to finish. Sent {1} emails for {2}'
+            ' events. {3} digests failed, {4} were retried.'.format(
+                (timezone.now() - start_of_command).seconds,
+                self.sent_emails, self.sent_events, self.failed_digests,
+                self.retried_digests))
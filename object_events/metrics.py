@@ -0,0 +1,186 @@
+"""
+Metrics of the hot paths of the ``object_events`` app.
+
+The app records counters (e.g. created events per type), timings (e.g. the
+render time of the notifications) and gauges (e.g. queue depths). Every
+metric is sent with the ``metric_recorded`` signal and passed to the sink set
+in ``OBJECT_EVENTS_METRICS_SINK``. Without a sink and without receivers
+recording a metric costs nearly nothing.
+
+The names of all metrics are listed in the README. ``MemorySink`` collects
+them for tests, ``LoggingSink`` logs them and ``StatsdSink`` sends them to a
+statsd server via UDP.
+
+"""
+import logging
+import socket
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from . import app_settings
+
+logger = logging.getLogger(__name__)
+
+_sink = None
+_sink_lock = Lock()
+
+#: Sent for every metric with ``kind`` (``counter``, ``timing`` or
+#: ``gauge``), ``name``, ``value`` and ``tags``.
+metric_recorded = Signal(providing_args=['kind', 'name', 'value', 'tags'])
+
+
+class BaseSink(object):
+    """Interface for the sinks. Make sure to inherit it."""
+
+    def record(self, kind, name, value, tags):
+        """
+        Records one metric.
+
+        :param kind: ``counter``, ``timing`` (in milliseconds) or ``gauge``.
+        :param tags: Dict of strings, e.g. ``{'type': 'comment'}``.
+
+        """
+        raise NotImplementedError
+
+
+class MemorySink(BaseSink):
+    """
+    Collects the metrics in memory, e.g. for tests.
+
+    ``counters`` and ``gauges`` map ``(name, tags)`` to the sum or the last
+    value, ``timings`` to the list of all values.
+
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters = {}
+            self.timings = {}
+            self.gauges = {}
+
+    def record(self, kind, name, value, tags):
+        key = (name, tuple(sorted(tags.items())))
+        with self.lock:
+            if kind == 'counter':
+                self.counters[key] = self.counters.get(key, 0) + value
+            elif kind == 'timing':
+                self.timings.setdefault(key, []).append(value)
+            else:
+                self.gauges[key] = value
+
+    def get_counter(self, name, **tags):
+        """Returns the sum of a counter with exactly the given tags."""
+        return self.counters.get((name, tuple(sorted(tags.items()))), 0)
+
+    def get_timings(self, name, **tags):
+        """Returns the values of a timing with exactly the given tags."""
+        return self.timings.get((name, tuple(sorted(tags.items()))), [])
+
+
+class LoggingSink(BaseSink):
+    """Logs the metrics to the ``object_events.metrics`` logger."""
+
+    def record(self, kind, name, value, tags):
+        logger.info('%s %s=%s %s', kind, name, value, ','.join(
+            '{0}:{1}'.format(key, tags[key]) for key in sorted(tags)))
+
+
+class StatsdSink(BaseSink):
+    """
+    Sends the metrics to a statsd server via UDP.
+
+    The tags are appended to the name, e.g. ``object_events.events.created``
+    with ``{'type': 'comment'}`` is sent as
+    ``object_events.events.created.type_comment``.
+
+    Configured by ``OBJECT_EVENTS_STATSD_HOST``, ``OBJECT_EVENTS_STATSD_PORT``
+    and ``OBJECT_EVENTS_STATSD_PREFIX``.
+
+    """
+    types = {'counter': 'c', 'timing': 'ms', 'gauge': 'g'}
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or app_settings.STATSD_HOST,
+                        port or app_settings.STATSD_PORT)
+        self.prefix = app_settings.STATSD_PREFIX if prefix is None else prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, kind, name, value, tags):
+        parts = [self.prefix, name] + [
+            '{0}_{1}'.format(key, tags[key]) for key in sorted(tags)]
+        return '{0}:{1}|{2}'.format(
+            '.'.join(part for part in parts if part).replace(' ', '_'),
+            value, self.types[kind])
+
+    def record(self, kind, name, value, tags):
+        try:
+            self.socket.sendto(
+                self.format(kind, name, value, tags).encode('utf-8'),
+                self.address)
+        except (socket.error, UnicodeError):
+            # Metrics must never break the request.
+            logger.debug('Could not send the metric %s.', name, exc_info=True)
+
+
+def get_sink():
+    """Returns the sink of this process or ``None``, if there is none."""
+    global _sink
+    if not app_settings.METRICS_SINK:
+        return None
+    with _sink_lock:
+        if _sink is None:
+            _sink = import_string(app_settings.METRICS_SINK)()
+            if not isinstance(_sink, BaseSink):
+                raise TypeError('Your metrics sink must inherit BaseSink.')
+        return _sink
+
+
+def record(kind, name, value, tags=None):
+    """Passes a metric to the signal receivers and the sink."""
+    sink = get_sink()
+    if sink is None and not metric_recorded.has_listeners():
+        return
+    tags = dict((key, u'{0}'.format(value)) for key, value in (
+        tags or {}).items())
+    metric_recorded.send(
+        sender=None, kind=kind, name=name, value=value, tags=tags)
+    if sink is not None:
+        sink.record(kind, name, value, tags)
+
+
+def incr(name, value=1, tags=None):
+    """Increments a counter."""
+    record('counter', name, value, tags)
+
+
+def gauge(name, value, tags=None):
+    """Sets a gauge, e.g. the depth of a queue."""
+    record('gauge', name, value, tags)
+
+
+def timing(name, ms, tags=None):
+    """Records a duration in milliseconds."""
+    record('timing', name, ms, tags)
+
+
+@contextmanager
+def timer(name, tags=None):
+    """
+    Records the duration of the ``with`` block in milliseconds.
+
+    Yields the tags, so that they can be completed inside the block.
+
+    """
+    tags = dict(tags or {})
+    start = time.time()
+    try:
+        yield tags
+    finally:
+        timing(name, round((time.time() - start) * 1000, 3), tags)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 06:47
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('object_events', '0002_objectevent_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectEventUserState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='Unread events')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='object_event_state', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 06:47
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Partial indexes for the queries that only look at a small part of the table.
+# Only PostgreSQL and SQLite support them, other backends have to live with the
+# composite indexes.
+PARTIAL_INDEXES = [
+    ('object_events_objectevent_unsent', '(user_id, id)', 'email_sent'),
+    ('object_events_objectevent_unread', '(user_id, creation_date)',
+     'read_by_user'),
+]
+FALSE = {'postgresql': 'false', 'sqlite': '0'}
+
+
+def create_partial_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in FALSE:
+        return
+    for name, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX {0} ON object_events_objectevent {1}'
+            ' WHERE {2} = {3}'.format(name, columns, condition, FALSE[vendor]))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in FALSE:
+        return
+    for name, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('object_events', '0003_objecteventuserstate'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='objectevent',
+            index_together=set([('email_sent', 'user'), ('user', 'read_by_user'), ('user', 'creation_date')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 06:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('object_events', '0004_objectevent_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectEventArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.PositiveIntegerField(unique=True, verbose_name='Event ID')),
+                ('user_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='User ID')),
+                ('event_type', models.CharField(max_length=256, verbose_name='Type')),
+                ('creation_date', models.DateTimeField(verbose_name='Creation date')),
+                ('content_type_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('event_content_type_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('event_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('additional_text', models.CharField(blank=True, max_length=128, verbose_name='Additional text')),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 06:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('object_events', '0005_objecteventarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objectevent',
+            name='coalesced_count',
+            field=models.PositiveIntegerField(default=1, verbose_name='Coalesced events'),
+        ),
+        migrations.AddField(
+            model_name='objectevent',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last seen'),
+        ),
+    ]
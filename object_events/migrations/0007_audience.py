@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 06:58
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('auth', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('object_events', '0006_objectevent_coalesced_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectEventReadMarker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ObjectEventSubscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('creation_date', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='object_event_subscriptions', to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='object_event_subscriptions', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='objectevent',
+            name='audience',
+            field=models.CharField(blank=True, choices=[(b'', 'user'), (b'all', 'all users'), (b'group', 'group'), (b'followers', 'followers')], db_index=True, max_length=16, verbose_name='Audience'),
+        ),
+        migrations.AddField(
+            model_name='objectevent',
+            name='audience_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='object_events', to='auth.Group', verbose_name='Audience group'),
+        ),
+        migrations.AddField(
+            model_name='objecteventuserstate',
+            name='audience_emailed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Audience events emailed until'),
+        ),
+        migrations.AddField(
+            model_name='objecteventreadmarker',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='object_events.ObjectEvent', verbose_name='Event'),
+        ),
+        migrations.AddField(
+            model_name='objecteventreadmarker',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='object_event_read_markers', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='objecteventsubscription',
+            unique_together=set([('user', 'content_type', 'object_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='objecteventsubscription',
+            index_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='objecteventreadmarker',
+            unique_together=set([('user', 'event')]),
+        ),
+    ]
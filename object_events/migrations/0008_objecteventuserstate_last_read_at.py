@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 07:01
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_watermarks(apps, schema_editor):
+    """
+    Moves the watermark of every user right before the oldest unread event.
+
+    Everything older has been read, so the existing ``read_by_user`` flags
+    keep their meaning. Users without unread events get the date of their
+    newest event.
+
+    """
+    ObjectEvent = apps.get_model('object_events', 'ObjectEvent')
+    ObjectEventUserState = apps.get_model(
+        'object_events', 'ObjectEventUserState')
+    events = ObjectEvent.objects.filter(user__isnull=False).order_by()
+    unread = events.filter(read_by_user=False)
+    newest = dict(events.values_list('user').annotate(
+        models.Max('creation_date')))
+    oldest_unread = dict(unread.values_list('user').annotate(
+        models.Min('creation_date')))
+    unread_counts = dict(unread.values_list('user').annotate(
+        models.Count('pk')))
+    for user_pk, last_read_at in newest.items():
+        if user_pk in oldest_unread:
+            last_read_at = oldest_unread[user_pk] - timedelta(microseconds=1)
+        if not ObjectEventUserState.objects.filter(user_id=user_pk).update(
+                last_read_at=last_read_at):
+            ObjectEventUserState.objects.create(
+                user_id=user_pk, last_read_at=last_read_at,
+                unread_count=unread_counts.get(user_pk, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('object_events', '0007_audience'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objecteventuserstate',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Read up to'),
+        ),
+        migrations.RunPython(set_watermarks, migrations.RunPython.noop),
+    ]
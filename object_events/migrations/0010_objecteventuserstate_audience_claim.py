@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-17 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('object_events', '0009_objecteventuserstate_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='objecteventuserstate',
+            name='audience_claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Audience events claimed at'),
+        ),
+        migrations.AddField(
+            model_name='objecteventuserstate',
+            name='audience_claimed_by',
+            field=models.CharField(blank=True, max_length=256, verbose_name='Audience events claimed by'),
+        ),
+    ]
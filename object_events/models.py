@@ -1,14 +1,41 @@
 """Models for the ``object_events`` app."""
+from collections import Counter, namedtuple
+from datetime import timedelta
+
 from django import VERSION
+from django.apps import apps
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import (
+    IntegrityError,
+    connections,
+    models,
+    router,
+    transaction,
+)
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.query import prefetch_related_objects
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template.defaultfilters import date
 from django.utils.timesince import timesince
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
+from .app_settings import (
+    BULK_BATCH_SIZE,
+    COALESCE_WINDOWS,
+    LOOKBACK_DAYS,
+    WARM_EVENT_TYPE_CACHE,
+    WRITE_BEHIND,
+)
+from . import metrics
+from .brokers import publish_change
+from .cache import bump_versions
+
 if VERSION < (1, 7, 0):
     from django.contrib.auth.models import SiteProfileNotAvailable
 if VERSION >= (1, 7, 0):
@@ -35,6 +62,39 @@ NOTIFICATION_INTERVALS = (
     ('monthly', _('monthly')),
 )
 
+"""
+Audience of an event.
+
+  ''        -> the ``user`` of the event
+  all       -> every user
+  group     -> the members of the ``audience_group`` of the event
+  followers -> the users who subscribed to the ``content_object`` of the event
+
+Audience events are stored only once, no matter how many users they reach.
+
+"""
+AUDIENCES = (
+    ('', _('user')),
+    ('all', _('all users')),
+    ('group', _('group')),
+    ('followers', _('followers')),
+)
+
+#: The generic foreign keys, that are prefetched to render the events.
+GENERIC_RELATIONS = ['content_object', 'event_content_object']
+
+
+"""
+Recipient of a digest, as returned by ``UserAggregationBase.get_recipients``.
+
+  pk       -> the pk of the user
+  email    -> the address the digest is sent to
+  language -> the language the digest is rendered in or ``None``
+  interval -> the notification interval of the user
+
+"""
+Recipient = namedtuple('Recipient', ['pk', 'email', 'language', 'interval'])
+
 
 class UserAggregationBase(object):
     """Base aggregation class to inherit from."""
@@ -43,6 +103,23 @@ class UserAggregationBase(object):
         """Function to delegate user aggregation."""
         return getattr(self, 'get_{0}_users'.format(interval))()
 
+    def get_recipients(self, interval):
+        """
+        Returns a ``Recipient`` per user of the interval.
+
+        Override it to load the addresses and languages together with the
+        users. By default the users of ``get_users`` are fetched in one query
+        and get their own email address and no language.
+
+        """
+        user_pks = list(self.get_users(interval))
+        if not user_pks:
+            return []
+        return [
+            Recipient(pk, email, None, interval)
+            for pk, email in get_user_model().objects.filter(
+                pk__in=user_pks).order_by('pk').values_list('pk', 'email')]
+
     def get_realtime_users(self):
         """Function to aggregate users, which will be notified in realtime."""
         raise NotImplementedError()
@@ -74,8 +151,9 @@ class UserAggregation(UserAggregationBase):
             raise SiteProfileNotAvailable(
                 'app_label and model_name should be separated by a dot in'
                 ' the AUTH_PROFILE_MODULE setting')
-        self.model = models.get_model(app_label, model_name)
-        if self.model is None:
+        try:
+            self.model = apps.get_model(app_label, model_name)
+        except LookupError:
             raise SiteProfileNotAvailable(
                 'Unable to load the profile model, check'
                 ' AUTH_PROFILE_MODULE in your project settings')
@@ -102,6 +180,101 @@ class UserAggregation(UserAggregationBase):
         return self.model.objects.filter(interval='monthly').values_list(
             'user__pk', flat=True)
 
+    def get_recipients(self, interval):
+        """
+        Returns the recipients of the interval with one query.
+
+        The ``language`` field and the ``get_preferred_email`` method of the
+        profile are used, if the profile has them. ``get_preferred_email`` is
+        called on profiles that were fetched along with their users, so it
+        must not query the database itself.
+
+        """
+        field_names = [field.name for field in self.model._meta.fields]
+        language = 'language' in field_names
+        profiles = self.model.objects.filter(interval=interval).order_by(
+            'user__pk')
+        if hasattr(self.model, 'get_preferred_email'):
+            return [
+                Recipient(profile.user.pk, profile.get_preferred_email(),
+                          profile.language if language else None, interval)
+                for profile in profiles.select_related('user')]
+        return [
+            Recipient(values[0], values[1],
+                      values[2] if language else None, interval)
+            for values in profiles.values_list(
+                'user__pk', 'user__email',
+                'language' if language else 'interval')]
+
+
+"""
+Process-local cache that maps ``ObjectEventType`` titles to primary keys.
+
+It is warmed on first use and kept in sync by the ``post_save`` and
+``post_delete`` signal handlers at the bottom of this module. Titles are only
+added, once the transaction that read or created them has been committed, so
+the cache never holds the pk of a rolled back type.
+
+"""
+_event_type_cache = {}
+_event_type_cache_warmed = []
+
+
+def _cache_event_types(items, using=None):
+    """Adds the ``(title, pk)`` items to the cache after the commit."""
+    items = list(items)
+    transaction.on_commit(lambda: _event_type_cache.update(items), using)
+
+
+class ObjectEventTypeManager(models.Manager):
+    """Custom manager for the ``ObjectEventType`` model."""
+
+    def get_pk_for_title(self, title):
+        """
+        Returns the pk of the event type with the given title.
+
+        The event type gets created if it doesn't exist, yet. If another
+        process creates it at the same time, the unique constraint on
+        ``title`` makes us fetch that one instead.
+
+        """
+        try:
+            return _event_type_cache[title]
+        except KeyError:
+            pass
+        if WARM_EVENT_TYPE_CACHE and not _event_type_cache_warmed:
+            # The first miss loads all types instead of only this one.
+            pk = self.warm_cache().get(title)
+        else:
+            pk = self.filter(title=title).values_list(
+                'pk', flat=True).first()
+        if pk is None:
+            try:
+                with transaction.atomic(using=self.db):
+                    pk = self.create(title=title).pk
+            except IntegrityError:
+                pk = self.filter(title=title).values_list(
+                    'pk', flat=True).get()
+        _cache_event_types([(title, pk)], self.db)
+        return pk
+
+    def warm_cache(self):
+        """
+        Loads all existing event types into the cache.
+
+        :returns: A dict of the pks per title.
+
+        """
+        types = dict(self.values_list('title', 'pk'))
+        _event_type_cache_warmed.append(True)
+        _cache_event_types(types.items(), self.db)
+        return types
+
+    def clear_cache(self):
+        """Empties the cache, so that it is warmed again on next use."""
+        _event_type_cache.clear()
+        del _event_type_cache_warmed[:]
+
 
 class ObjectEventType(models.Model):
     """
@@ -118,6 +291,8 @@ class ObjectEventType(models.Model):
         help_text=_('Please use a slugified name, e.g. "student-news".'),
     )
 
+    objects = ObjectEventTypeManager()
+
     class Meta:
         ordering = ['title']
 
@@ -125,16 +300,171 @@ class ObjectEventType(models.Model):
         return u'{0}'.format(self.title)
 
 
+class ObjectEventQuerySet(models.QuerySet):
+    """Custom queryset for the ``ObjectEvent`` model."""
+
+    def with_related(self, prefetch=True):
+        """
+        Fetches all objects that are needed to render the events.
+
+        The user and the event type are joined and both generic foreign keys
+        are prefetched with one query per content type, instead of one query
+        per event.
+
+        :param prefetch: If ``False``, only the user and the event type are
+          joined. Use ``load_related`` to prefetch the generic foreign keys
+          later, e.g. after merging the events of several querysets.
+
+        """
+        queryset = self.select_related('user', 'event_type')
+        if not prefetch:
+            return queryset
+        return queryset.prefetch_related(*GENERIC_RELATIONS)
+
+    def recent(self, days=None):
+        """
+        Returns the events of the last ``days`` days.
+
+        Defaults to the ``OBJECT_EVENTS_LOOKBACK_DAYS`` setting and returns all
+        events, if neither is set. On a partitioned table only the partitions
+        of these days are read.
+
+        """
+        days = LOOKBACK_DAYS if days is None else days
+        if days is None:
+            return self.all()
+        return self.filter(creation_date__gte=now() - timedelta(days))
+
+    def for_user(self, user):
+        """
+        Returns the events of the user and the audience events for them.
+
+        Both parts are selected separately and combined with a UNION, so that
+        each of them can use its own index. Sorting and slicing the result
+        reads all events of the user, so use ``for_user_parts`` for pages.
+
+        """
+        return self.filter(pk__in=_union(*self.for_user_parts(user)))
+
+    def for_user_parts(self, user):
+        """
+        Returns the events of the user and the audience events for them.
+
+        The parts are returned as a list of two querysets, which should be
+        sorted and sliced separately, e.g. with
+        ``pagination.merge_querysets``. Then each of them is read from its
+        index and the database only sorts the rows of one page.
+
+        """
+        return [self.filter(user=user), self.for_audience(user)]
+
+    def for_audience(self, user):
+        """Returns only the audience events, that the user belongs to."""
+        return self.filter(_get_audience_filter(user))
+
+    def unread(self, user, state=None):
+        """
+        Returns the unread events of the user.
+
+        An event is unread, if it was created after the ``last_read_at``
+        watermark of the user and hasn't been read individually.
+
+        :param state: The ``ObjectEventUserState`` of the user. It is fetched,
+          if it is not given.
+
+        """
+        if state is None:
+            state = ObjectEventUserState.objects.get_for_user(user)
+        return self.filter(pk__in=_union(
+            self.filter(_get_unread_filter(
+                user, state.last_read_at, own=True)),
+            self.filter(_get_unread_filter(
+                user, state.last_read_at, own=False))))
+
+    def mark_read(self, user, pks):
+        """
+        Marks the given events of the user as read.
+
+        Events of the user are flagged in one UPDATE, audience events get a
+        read marker. The unread count of the user is updated accordingly. Use
+        ``ObjectEventUserState.objects.mark_all_read`` to mark all events.
+
+        :param pks: Primary keys of the events to mark.
+        :returns: Amount of events that have been marked.
+
+        """
+        state = ObjectEventUserState.objects.get_for_user(user)
+        unread = self.filter(pk__in=pks)
+        marked = unread.filter(_get_unread_filter(
+            user, state.last_read_at, own=True)).update(read_by_user=True)
+        marked += ObjectEventReadMarker.objects.mark(
+            user, unread.filter(_get_unread_filter(
+                user, state.last_read_at, own=False)).values_list(
+                    'pk', flat=True))
+        if marked:
+            ObjectEventUserState.objects.decrement(user, marked)
+        return marked
+
+    def mark_unread(self, user, pks):
+        """
+        Marks the given events of the user as unread again.
+
+        If an event is older than the ``last_read_at`` watermark of the user,
+        the watermark is moved right before it. The events in between, which
+        have been read because of the watermark, are flagged as read, so that
+        only the given events become unread.
+
+        :param pks: Primary keys of the events to mark.
+        :returns: Amount of events that have been marked.
+
+        """
+        pks = list(pks)
+        with transaction.atomic():
+            state = ObjectEventUserState.objects.select_for_update().get(
+                pk=ObjectEventUserState.objects.get_for_user(user).pk)
+            read = Q(pk__in=[])
+            if state.last_read_at is not None:
+                read = Q(creation_date__lte=state.last_read_at)
+            own_pks = list(self.filter(pk__in=pks, user=user).filter(
+                read | Q(read_by_user=True)).values_list('pk', flat=True))
+            markers = ObjectEventReadMarker.objects.filter(user=user)
+            audience_pks = list(self.filter(pk__in=pks).for_audience(
+                user).filter(read | Q(pk__in=markers.values(
+                    'event'))).values_list('pk', flat=True))
+            oldest = self.filter(
+                read, pk__in=own_pks + audience_pks).aggregate(
+                    models.Min('creation_date'))['creation_date__min']
+            if oldest is not None:
+                _move_watermark(
+                    user, state, oldest - timedelta(microseconds=1), pks)
+            marked = self.filter(pk__in=own_pks).update(read_by_user=False)
+            markers.filter(event__pk__in=audience_pks).delete()
+            marked += len(audience_pks)
+            if marked:
+                ObjectEventUserState.objects.increment([user.pk] * marked)
+        return marked
+
+
 class ObjectEvent(models.Model):
     """
     An event created by a user related to any object.
 
     :user: FK to the user who created this event. Leave this empty if this
       event was created by no user but automatically.
+    :audience: Who gets this event, if it isn't meant for the ``user`` only.
+      See ``AUDIENCES`` and ``create_audience_event``.
+    :audience_group: The group that gets this event, if the audience is
+      ``group``.
     :creation_date: Creation date of this event.
     :event_type: Type of this event.
     :email_sent: True, if user has received this event via email.
     :read_by_user: True, if user has noticed this event.
+    :coalesced_count: Amount of identical events that have been merged into
+      this one. See ``create_event``.
+    :last_seen: Date of the last event that has been merged into this one.
+    :claimed_by: Identifies the ``send_event_emails`` run, that is about to
+      send this event.
+    :claimed_at: Date at which the event was claimed.
     :content_object: Generic foreign key to the object this event is attached
       to. Leave this empty if it is a global event.
     :event_content_object: Generic foreign key to the object that has been
@@ -152,6 +482,21 @@ class ObjectEvent(models.Model):
         null=True, blank=True,
     )
 
+    audience = models.CharField(
+        max_length=16,
+        choices=AUDIENCES,
+        verbose_name=_('Audience'),
+        blank=True,
+        db_index=True,
+    )
+
+    audience_group = models.ForeignKey(
+        'auth.Group',
+        verbose_name=_('Audience group'),
+        related_name='object_events',
+        null=True, blank=True,
+    )
+
     creation_date = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_('Creation date'),
@@ -173,6 +518,27 @@ class ObjectEvent(models.Model):
         default=False,
     )
 
+    coalesced_count = models.PositiveIntegerField(
+        verbose_name=_('Coalesced events'),
+        default=1,
+    )
+
+    last_seen = models.DateTimeField(
+        verbose_name=_('Last seen'),
+        null=True, blank=True,
+    )
+
+    claimed_by = models.CharField(
+        max_length=256,
+        verbose_name=_('Claimed by'),
+        blank=True,
+    )
+
+    claimed_at = models.DateTimeField(
+        verbose_name=_('Claimed at'),
+        null=True, blank=True,
+    )
+
     # Generic FK to the object this event is attached to
     content_type = models.ForeignKey(
         ContentType,
@@ -198,8 +564,15 @@ class ObjectEvent(models.Model):
         blank=True,
     )
 
+    objects = ObjectEventQuerySet.as_manager()
+
     class Meta:
         ordering = ['-creation_date']
+        index_together = [
+            ('user', 'read_by_user'),
+            ('user', 'creation_date'),
+            ('email_sent', 'user'),
+        ]
 
     @staticmethod
     def create_event(user, content_object, event_content_object=None,
@@ -216,20 +589,370 @@ class ObjectEvent(models.Model):
         :event_type: String representing the type of this event.
         :additional_text: Additional text.
 
+        If the ``OBJECT_EVENTS_COALESCE_WINDOWS`` setting defines a window for
+        the type, an unread and unsent event of the same user, object and
+        type, which was created less than the window's seconds ago, is reused
+        instead: Its ``coalesced_count`` is incremented and it is returned.
+
+        The event is stored by the backend set in ``OBJECT_EVENTS_STORAGE``.
+
         """
-        event_type_obj, created = ObjectEventType.objects.get_or_create(
-            title=event_type)
+        from .storage import get_storage
+        return get_storage().create_event(
+            user, content_object, event_content_object, event_type,
+            additional_text)
+
+    @staticmethod
+    def _create_event(user, content_object, event_content_object=None,
+                      event_type='', additional_text=''):
+        """Creates an event in the database. See ``create_event``."""
         kwargs = {
             'user': user,
             'content_object': content_object,
-            'event_type': event_type_obj,
+            'event_type_id': ObjectEventType.objects.get_pk_for_title(
+                event_type),
+            'additional_text': additional_text,
+        }
+        if event_content_object is not None:
+            kwargs.update({'event_content_object': event_content_object})
+        if user is not None and COALESCE_WINDOWS.get(event_type):
+            obj = ObjectEvent._coalesce_event(
+                kwargs, COALESCE_WINDOWS[event_type])
+        else:
+            obj = ObjectEvent.objects.create(**kwargs)
+            if obj.user_id is not None:
+                ObjectEventUserState.objects.increment([obj.user_id])
+        metrics.incr(
+            'events.coalesced' if obj.coalesced_count > 1 else
+            'events.created', tags={'type': event_type})
+        return obj
+
+    @staticmethod
+    def create_audience_event(audience, content_object,
+                              event_content_object=None, event_type='',
+                              additional_text='', group=None):
+        """
+        Creates one event for a whole audience.
+
+        :param audience: ``all``, ``group`` or ``followers``.
+        :param group: The group that gets the event, if the audience is
+          ``group``.
+
+        See ``create_event`` for the remaining parameters. The read state of
+        the users is stored in ``ObjectEventReadMarker``, which only has rows
+        for users who have read the event. The unread counts and the versions
+        of the audience are incremented with one UPDATE.
+
+        """
+        if audience not in ('all', 'group', 'followers'):
+            raise ValueError('Unknown audience: {0}'.format(audience))
+        if (audience == 'group') != (group is not None):
+            raise ValueError('Please provide a group for group events only.')
+        kwargs = {
+            'audience': audience,
+            'audience_group': group,
+            'content_object': content_object,
+            'event_type_id': ObjectEventType.objects.get_pk_for_title(
+                event_type),
             'additional_text': additional_text,
         }
         if event_content_object is not None:
             kwargs.update({'event_content_object': event_content_object})
         obj = ObjectEvent.objects.create(**kwargs)
+        _get_audience_states(obj).update(
+            unread_count=F('unread_count') + 1, version=F('version') + 1)
+        _notify(audience=True)
+        metrics.incr('events.created',
+                     tags={'type': event_type, 'audience': audience})
         return obj
 
+    @staticmethod
+    def _coalesce_event(kwargs, window):
+        """
+        Reuses a recent event with the same user, object and type.
+
+        Concurrent producers are serialized by locking the state of the user,
+        so that they can't both create a new event.
+
+        """
+        user = kwargs['user']
+        now_ = now()
+        with transaction.atomic():
+            ObjectEventUserState.objects.get_for_user(user)
+            last_read_at = ObjectEventUserState.objects.select_for_update(
+                ).filter(user=user).values_list(
+                    'last_read_at', flat=True).get()
+            content_type_id, object_id = _get_generic_key(
+                kwargs['content_object'], {})
+            events = ObjectEvent.objects.all()
+            if last_read_at is not None:
+                events = events.filter(creation_date__gt=last_read_at)
+            obj = events.filter(
+                user=user,
+                event_type_id=kwargs['event_type_id'],
+                content_type_id=content_type_id,
+                object_id=object_id,
+                read_by_user=False,
+                email_sent=False,
+                creation_date__gte=now_ - timedelta(seconds=window),
+            ).order_by('-creation_date').first()
+            if obj is None:
+                obj = ObjectEvent.objects.create(**kwargs)
+                ObjectEventUserState.objects.increment([obj.user_id])
+                return obj
+            ObjectEvent.objects.filter(pk=obj.pk).update(
+                coalesced_count=F('coalesced_count') + 1, last_seen=now_)
+            obj.coalesced_count += 1
+            obj.last_seen = now_
+            _notify([obj.user_id])
+            return obj
+
+    @staticmethod
+    def enqueue_event(user, content_object, event_content_object=None,
+                      event_type='', additional_text=''):
+        """
+        Creates an event in the background, if write-behind is enabled.
+
+        If the ``OBJECT_EVENTS_WRITE_BEHIND`` setting is ``True``, the event
+        is handed to the write-behind queue of this process (see
+        ``object_events.writebehind``) and ``None`` is returned. Otherwise
+        this is the same as ``create_event``.
+
+        """
+        if not WRITE_BEHIND:
+            return ObjectEvent.create_event(
+                user, content_object, event_content_object, event_type,
+                additional_text)
+        from .writebehind import get_event_queue
+        get_event_queue().put((user, content_object, event_content_object,
+                               event_type, additional_text))
+
+    @staticmethod
+    def create_events(events, batch_size=None):
+        """
+        Creates many events at once.
+
+        Event types and content types are resolved only once per batch and the
+        rows are inserted in chunks, each chunk in its own transaction. On
+        PostgreSQL and SQLite 3.35 or newer a chunk is inserted with one
+        ``INSERT ... RETURNING`` statement, other databases save the events of
+        a chunk one by one, see ``_insert_chunk``.
+
+        :param events: Iterable of ``(user, content_object,
+          event_content_object, event_type, additional_text)`` tuples. The
+          last three items are optional, just like for ``create_event``.
+          ``user`` can be a user instance, a user pk or ``None``.
+        :param batch_size: Amount of events to insert per chunk. Defaults to
+          the ``OBJECT_EVENTS_BULK_BATCH_SIZE`` setting.
+        :returns: List of primary keys of the created events.
+
+        The events are stored by the backend set in ``OBJECT_EVENTS_STORAGE``.
+
+        """
+        from .storage import get_storage
+        return get_storage().create_events(events, batch_size)
+
+    @staticmethod
+    def _create_events(events, batch_size=None):
+        """Creates many events in the database. See ``create_events``."""
+        if batch_size is None:
+            batch_size = BULK_BATCH_SIZE
+        content_types = {}
+        ids = []
+        chunk = []
+        event_types = []
+        for event in events:
+            event = tuple(event)
+            user, content_object, event_content_object, event_type, text = (
+                event + (None, '', '')[len(event) - 2:])
+            obj = ObjectEvent(
+                user_id=getattr(user, 'pk', user),
+                event_type_id=ObjectEventType.objects.get_pk_for_title(
+                    event_type),
+                additional_text=text,
+            )
+            obj.content_type_id, obj.object_id = _get_generic_key(
+                content_object, content_types)
+            obj.event_content_type_id, obj.event_object_id = (
+                _get_generic_key(event_content_object, content_types))
+            chunk.append(obj)
+            event_types.append(event_type)
+            if len(chunk) >= batch_size:
+                ids.extend(ObjectEvent._insert_chunk(chunk, event_types))
+                chunk, event_types = [], []
+        if chunk:
+            ids.extend(ObjectEvent._insert_chunk(chunk, event_types))
+        return ids
+
+    @staticmethod
+    def create_events_for_users(users, content_object,
+                                event_content_object=None, event_type='',
+                                additional_text='', batch_size=None):
+        """
+        Creates the same event for each of the given users.
+
+        :param users: A user queryset or an iterable of users or user pks.
+        :param batch_size: Amount of events to insert per chunk.
+
+        See ``create_event`` for the remaining parameters.
+
+        """
+        if isinstance(users, models.QuerySet):
+            users = users.values_list('pk', flat=True).iterator()
+        return ObjectEvent.create_events(
+            ((user, content_object, event_content_object, event_type,
+              additional_text) for user in users),
+            batch_size=batch_size)
+
+    @staticmethod
+    def _insert_chunk(chunk, event_types):
+        """
+        Inserts a list of unsaved events and returns their primary keys.
+
+        On PostgreSQL and SQLite 3.35 or newer the chunk is inserted with
+        ``INSERT ... RETURNING``. Other backends can't tell which rows a bulk
+        insert created, while other processes insert events as well, so the
+        events are saved one by one.
+
+        Events of types with a window in ``OBJECT_EVENTS_COALESCE_WINDOWS``
+        are merged like in ``create_event``, see ``_coalesce_chunk``. Their
+        primary key is the one of the event they were merged into.
+
+        :param event_types: The event type title of every event.
+
+        """
+        using = router.db_for_write(ObjectEvent)
+        with transaction.atomic(using=using):
+            inserted, merged = ObjectEvent._coalesce_chunk(chunk, event_types)
+            if _supports_returning(connections[using]):
+                ObjectEvent._insert_returning(
+                    [obj for obj, event_type in inserted], connections[using])
+            else:
+                for obj, event_type in inserted:
+                    obj.save(force_insert=True, using=using)
+            for obj, event_type, target in merged:
+                obj.pk = target.pk
+            ObjectEventUserState.objects.increment(
+                obj.user_id for obj, event_type in inserted
+                if obj.user_id is not None)
+        for name, amounts in (
+                ('events.created', Counter(
+                    event_type for obj, event_type in inserted)),
+                ('events.coalesced', Counter(
+                    event_type for obj, event_type, target in merged))):
+            for event_type, amount in amounts.items():
+                metrics.incr(name, amount, tags={'type': event_type})
+        return [obj.pk for obj in chunk]
+
+    @staticmethod
+    def _coalesce_chunk(chunk, event_types):
+        """
+        Merges the events of a chunk, that can be coalesced.
+
+        The states of the affected users are locked like in
+        ``_coalesce_event`` and the recent events are looked up with one query
+        per user and event type. Events are merged into a matching recent
+        event or into the first matching event of the chunk.
+
+        :returns: A list of ``(event, event_type)`` tuples to insert and a
+          list of ``(event, event_type, target)`` tuples of the merged
+          events.
+
+        """
+        windows = [COALESCE_WINDOWS.get(event_type) if obj.user_id else None
+                   for obj, event_type in zip(chunk, event_types)]
+        if not any(windows):
+            return list(zip(chunk, event_types)), []
+        now_ = now()
+        user_pks = set(obj.user_id for obj, window in zip(chunk, windows)
+                       if window)
+        missing = user_pks - set(ObjectEventUserState.objects.filter(
+            user__pk__in=user_pks).values_list('user', flat=True))
+        if missing:
+            # Only existing rows can be locked.
+            for user in get_user_model().objects.filter(pk__in=missing):
+                ObjectEventUserState.objects.get_for_user(user)
+        last_read_at = dict(ObjectEventUserState.objects.select_for_update(
+            ).filter(user__pk__in=user_pks).values_list(
+                'user', 'last_read_at'))
+        targets = {}
+        for user_pk, event_type_id, window in set(
+                (obj.user_id, obj.event_type_id, window)
+                for obj, window in zip(chunk, windows) if window):
+            events = ObjectEvent.objects.filter(
+                user__pk=user_pk,
+                event_type_id=event_type_id,
+                read_by_user=False,
+                email_sent=False,
+                creation_date__gte=now_ - timedelta(seconds=window),
+            ).order_by('creation_date')
+            if last_read_at.get(user_pk) is not None:
+                events = events.filter(creation_date__gt=last_read_at[user_pk])
+            for event in events:
+                # The newest matching event wins.
+                targets[(user_pk, event_type_id, event.content_type_id,
+                         event.object_id)] = event
+        inserted, merged, updated = [], [], Counter()
+        for obj, event_type, window in zip(chunk, event_types, windows):
+            key = (obj.user_id, obj.event_type_id, obj.content_type_id,
+                   obj.object_id)
+            if not window or key not in targets:
+                inserted.append((obj, event_type))
+                if window:
+                    targets[key] = obj
+                continue
+            target = targets[key]
+            merged.append((obj, event_type, target))
+            if target.pk is None:
+                target.coalesced_count += 1
+                target.last_seen = now_
+            else:
+                updated[target.pk] += 1
+        for pk, amount in updated.items():
+            ObjectEvent.objects.filter(pk=pk).update(
+                coalesced_count=F('coalesced_count') + amount,
+                last_seen=now_)
+        if updated:
+            _notify(set(target.user_id for obj, event_type, target in merged
+                        if target.pk is not None))
+        return inserted, merged
+
+    @staticmethod
+    def _insert_returning(chunk, connection):
+        """
+        Inserts the events with ``INSERT ... RETURNING`` and sets their pks.
+
+        The chunk is split, if it has more parameters than the database
+        accepts in one statement.
+
+        """
+        fields = [field for field in ObjectEvent._meta.concrete_fields
+                  if not isinstance(field, models.AutoField)]
+        quote = connection.ops.quote_name
+        size = max(connection.ops.bulk_batch_size(fields, chunk), 1)
+        row = '({0})'.format(', '.join(['%s'] * len(fields)))
+        for start in range(0, len(chunk), size):
+            objs = chunk[start:start + size]
+            params = []
+            for obj in objs:
+                params.extend(
+                    field.get_db_prep_save(field.pre_save(obj, True),
+                                           connection)
+                    for field in fields)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO {0} ({1}) VALUES {2} RETURNING {3}'.format(
+                        quote(ObjectEvent._meta.db_table),
+                        ', '.join(quote(field.column) for field in fields),
+                        ', '.join([row] * len(objs)),
+                        quote(ObjectEvent._meta.pk.column)),
+                    params)
+                # Both databases number the rows in the order of the VALUES,
+                # but SQLite doesn't promise to return them in that order.
+                for obj, pk in zip(objs, sorted(
+                        pk for pk, in cursor.fetchall())):
+                    obj.pk = pk
+
     def __unicode__(self):
         return u'{0}'.format(self.content_object)
 
@@ -240,3 +963,615 @@ class ObjectEvent(models.Model):
         if self.creation_date.year != now().year:
             return date(self.creation_date, 'd F Y')
         return date(self.creation_date, 'd F')
+
+
+class ObjectEventArchive(models.Model):
+    """
+    Compact copy of an ``ObjectEvent`` that has been pruned.
+
+    It has no foreign keys, so that it is not affected by deletions of the
+    referenced objects and doesn't need their indexes. See the
+    ``prune_object_events`` command.
+
+    :event_id: The pk of the original event.
+    :event_type: The title of the event type.
+
+    All other fields are the same as in the ``ObjectEvent`` model.
+
+    """
+    event_id = models.PositiveIntegerField(
+        verbose_name=_('Event ID'),
+        unique=True,
+    )
+
+    user_id = models.PositiveIntegerField(
+        verbose_name=_('User ID'),
+        null=True, blank=True,
+    )
+
+    event_type = models.CharField(
+        max_length=256,
+        verbose_name=_('Type'),
+    )
+
+    creation_date = models.DateTimeField(
+        verbose_name=_('Creation date'),
+    )
+
+    content_type_id = models.PositiveIntegerField(null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    event_content_type_id = models.PositiveIntegerField(null=True, blank=True)
+    event_object_id = models.PositiveIntegerField(null=True, blank=True)
+
+    additional_text = models.CharField(
+        max_length=128,
+        verbose_name=_('Additional text'),
+        blank=True,
+    )
+
+    class Meta:
+        ordering = ['-creation_date']
+
+    def __unicode__(self):
+        return u'{0}'.format(self.event_type)
+
+
+class ObjectEventUserStateManager(models.Manager):
+    """Custom manager for the ``ObjectEventUserState`` model."""
+
+    def get_for_user(self, user):
+        """
+        Returns the state of the given user.
+
+        If the user has no state, yet, the unread events and audience events
+        are counted once and the state is stored.
+
+        """
+        try:
+            return self.get(user=user)
+        except self.model.DoesNotExist:
+            state, created = self.get_or_create(user=user, defaults={
+                'unread_count': _count_unread(user, None)})
+            return state
+
+    def get_unread_count(self, user, state=None):
+        """
+        Returns the amount of unread events of the given user.
+
+        The stored counter includes the audience events, so this costs no
+        more than the query for the state.
+
+        :param state: The state of the user. It is fetched, if it is not
+          given.
+
+        """
+        with metrics.timer('unread_count.query'):
+            if state is None:
+                state = self.get_for_user(user)
+            return state.unread_count
+
+    def increment(self, user_pks):
+        """
+        Increments the unread count of the given users.
+
+        ``user_pks`` may contain the same pk several times, it is incremented
+        once per occurrence. Users are grouped by amount, so that a batch of
+        events costs one UPDATE per distinct amount, which bumps the versions
+        as well. Users without a state are skipped, since their amount will be
+        counted when it is needed. The cached notifications and the streams of
+        the users are notified.
+
+        """
+        amounts = {}
+        counts = Counter(user_pks)
+        for user_pk, amount in counts.items():
+            amounts.setdefault(amount, []).append(user_pk)
+        for amount, pks in amounts.items():
+            self.filter(user__pk__in=pks).update(
+                unread_count=F('unread_count') + amount,
+                version=F('version') + 1)
+        _notify(counts.keys(), bump_states=False)
+
+    def decrement(self, user, amount=1):
+        """
+        Decrements the unread count of the given user.
+
+        The version is bumped in the same UPDATE and the cached notifications
+        and the stream of the user are notified.
+
+        """
+        if not self.filter(user=user, unread_count__gte=amount).update(
+                unread_count=F('unread_count') - amount,
+                version=F('version') + 1):
+            # The count is lower than it should be, it can't go below zero.
+            self.filter(user=user).update(
+                unread_count=0, version=F('version') + 1)
+        _notify([user.pk], bump_states=False)
+
+    def mark_all_read(self, user):
+        """
+        Marks all events of the given user as read.
+
+        Only the ``last_read_at`` watermark of the user is moved, so this
+        touches a single row, no matter how many events the user has.
+
+        """
+        values = {'last_read_at': now(), 'unread_count': 0}
+        if not self.filter(user=user).update(
+                version=F('version') + 1, **values):
+            try:
+                with transaction.atomic():
+                    self.create(user=user, **values)
+            except IntegrityError:
+                self.filter(user=user).update(
+                    version=F('version') + 1, **values)
+        # Notified after the UPDATE, so that a stream or a cache refill can't
+        # load the old state.
+        _notify([user.pk], bump_states=False)
+
+    def rebuild(self):
+        """
+        Recounts the unread events of all users.
+
+        The own events are counted with one query for all users. If there are
+        audience events, they are counted with one more query per user. The
+        versions of the changed states are bumped and their cached
+        notifications and streams are notified.
+
+        :returns: Amount of states that have been changed.
+
+        """
+        counts = dict(ObjectEvent.objects.filter(
+            read_by_user=False, user__isnull=False).filter(
+                Q(user__object_event_state__last_read_at__isnull=True) |
+                Q(creation_date__gt=F(
+                    'user__object_event_state__last_read_at'))
+            ).order_by().values_list('user').annotate(models.Count('pk')))
+        has_audience_events = ObjectEvent.objects.exclude(
+            audience='').exists()
+
+        def count(user, last_read_at):
+            amount = counts.pop(user.pk, 0)
+            if has_audience_events:
+                amount += ObjectEvent.objects.filter(_get_unread_filter(
+                    user, last_read_at, own=False)).count()
+            return amount
+
+        changed = []
+        for state in self.select_related('user').iterator():
+            amount = count(state.user, state.last_read_at)
+            if state.unread_count != amount:
+                self.filter(pk=state.pk).update(
+                    unread_count=amount, version=F('version') + 1)
+                changed.append(state.user_id)
+        created = [
+            self.model(user=user, unread_count=count(user, None))
+            for user in get_user_model().objects.filter(pk__in=list(counts))]
+        self.bulk_create(created)
+        changed.extend(state.user_id for state in created)
+        _notify(changed, bump_states=False)
+        return len(changed)
+
+
+class ObjectEventUserState(models.Model):
+    """
+    Denormalized per-user data about the user's events.
+
+    :user: The user this state belongs to.
+    :unread_count: Amount of unread events of the user, including the
+      audience events. It is kept up to date by ``ObjectEvent.create_event``,
+      ``ObjectEvent.create_events``, ``ObjectEvent.create_audience_event``,
+      the subscriptions and the ``ObjectEventsMarkView``. Use the
+      ``rebuild_unread_counters`` command after changing events or group
+      memberships in any other way.
+    :last_read_at: All events created up to this date count as read. See
+      ``ObjectEvent.objects.unread``.
+    :audience_emailed_until: Creation date of the newest audience event,
+      that has been sent to the user by ``send_event_emails``.
+    :audience_claimed_by: Identifies the ``send_event_emails --claim`` run,
+      that is about to send audience events to the user.
+    :audience_claimed_at: Date at which the audience events were claimed.
+    :version: Incremented whenever the notifications of the user change. The
+      ETags of the JSON endpoints are derived from it.
+
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('User'),
+        related_name='object_event_state',
+    )
+
+    unread_count = models.PositiveIntegerField(
+        verbose_name=_('Unread events'),
+        default=0,
+    )
+
+    last_read_at = models.DateTimeField(
+        verbose_name=_('Read up to'),
+        null=True, blank=True,
+    )
+
+    audience_emailed_until = models.DateTimeField(
+        verbose_name=_('Audience events emailed until'),
+        null=True, blank=True,
+    )
+
+    audience_claimed_by = models.CharField(
+        max_length=256,
+        verbose_name=_('Audience events claimed by'),
+        blank=True,
+    )
+
+    audience_claimed_at = models.DateTimeField(
+        verbose_name=_('Audience events claimed at'),
+        null=True, blank=True,
+    )
+
+    version = models.PositiveIntegerField(
+        verbose_name=_('Version'),
+        default=0,
+    )
+
+    objects = ObjectEventUserStateManager()
+
+    def __unicode__(self):
+        return u'{0}'.format(self.user)
+
+
+class ObjectEventSubscriptionManager(models.Manager):
+    """Custom manager for the ``ObjectEventSubscription`` model."""
+
+    def subscribe(self, user, obj):
+        """Lets the user follow the events of the given object."""
+        content_type_id, object_id = _get_generic_key(obj, {})
+        try:
+            with transaction.atomic():
+                subscription, created = self.get_or_create(
+                    user=user, content_type_id=content_type_id,
+                    object_id=object_id)
+        except IntegrityError:
+            return self.get(user=user, content_type_id=content_type_id,
+                            object_id=object_id)
+        if created:
+            amount = self._count_unread(user, content_type_id, object_id)
+            if amount:
+                ObjectEventUserState.objects.increment([user.pk] * amount)
+        return subscription
+
+    def unsubscribe(self, user, obj):
+        """Stops following the events of the given object."""
+        content_type_id, object_id = _get_generic_key(obj, {})
+        amount = self._count_unread(user, content_type_id, object_id)
+        if self.filter(user=user, content_type_id=content_type_id,
+                       object_id=object_id).delete()[0] and amount:
+            ObjectEventUserState.objects.decrement(user, amount)
+
+    def _count_unread(self, user, content_type_id, object_id):
+        """
+        Returns the amount of unread followers events of the object, that are
+        included in the unread count of the user.
+
+        """
+        state = ObjectEventUserState.objects.filter(user=user).first()
+        if state is None:
+            # The events are counted, when the state is created.
+            return 0
+        return ObjectEvent.objects.filter(
+            _get_unread_filter(user, state.last_read_at, own=False),
+            audience='followers', content_type_id=content_type_id,
+            object_id=object_id).count()
+
+
+class ObjectEventSubscription(models.Model):
+    """
+    A user following an object.
+
+    The user gets all events with the ``followers`` audience, that are
+    attached to the object.
+
+    :user: The user who follows the object.
+    :content_object: The followed object.
+    :creation_date: Creation date of this subscription.
+
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('User'),
+        related_name='object_event_subscriptions',
+    )
+
+    content_type = models.ForeignKey(
+        ContentType,
+        related_name='object_event_subscriptions',
+    )
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    creation_date = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Creation date'),
+    )
+
+    objects = ObjectEventSubscriptionManager()
+
+    class Meta:
+        unique_together = ('user', 'content_type', 'object_id')
+        index_together = [
+            ('content_type', 'object_id'),
+        ]
+
+    def __unicode__(self):
+        return u'{0}: {1}'.format(self.user, self.content_object)
+
+
+class ObjectEventReadMarkerManager(models.Manager):
+    """Custom manager for the ``ObjectEventReadMarker`` model."""
+
+    def mark(self, user, event_pks):
+        """
+        Marks the given audience events as read by the user.
+
+        :returns: Amount of markers that have been created.
+
+        """
+        event_pks = set(event_pks)
+        if not event_pks:
+            return 0
+        try:
+            with transaction.atomic():
+                self.bulk_create([
+                    self.model(user=user, event_id=pk) for pk in event_pks])
+        except IntegrityError:
+            # Another request marked some of the events in the meantime.
+            event_pks -= set(self.filter(
+                user=user, event__pk__in=event_pks).values_list(
+                    'event', flat=True))
+            for pk in event_pks:
+                self.get_or_create(user=user, event_id=pk)
+        return len(event_pks)
+
+
+class ObjectEventReadMarker(models.Model):
+    """
+    Read state of an audience event for one user.
+
+    Only users who read the event have a marker, so the table stays sparse.
+
+    :user: The user who read the event.
+    :event: The audience event.
+
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('User'),
+        related_name='object_event_read_markers',
+    )
+
+    event = models.ForeignKey(
+        ObjectEvent,
+        verbose_name=_('Event'),
+        related_name='read_markers',
+    )
+
+    objects = ObjectEventReadMarkerManager()
+
+    class Meta:
+        unique_together = ('user', 'event')
+
+    def __unicode__(self):
+        return u'{0}: {1}'.format(self.user, self.event_id)
+
+
+def load_related(events):
+    """
+    Prefetches the generic foreign keys of a list of events.
+
+    Does the same as ``ObjectEventQuerySet.with_related`` for events, that
+    have been fetched with ``with_related(prefetch=False)``.
+
+    """
+    prefetch_related_objects(events, GENERIC_RELATIONS)
+    return events
+
+
+def load_read_state(events, user, state=None):
+    """
+    Sets ``read_by_user`` of the given events to the read state of the user.
+
+    Follows the same rules as ``ObjectEvent.objects.unread`` and costs one
+    query for the state, if it is not given, and one query, if there are
+    audience events in ``events``.
+
+    """
+    if state is None:
+        state = ObjectEventUserState.objects.get_for_user(user)
+    last_read_at = state.last_read_at
+    pks = [event.pk for event in events if event.audience]
+    read = set()
+    if pks:
+        read = set(ObjectEventReadMarker.objects.filter(
+            user=user, event__pk__in=pks).values_list('event', flat=True))
+    for event in events:
+        if last_read_at is not None and event.creation_date <= last_read_at:
+            event.read_by_user = True
+        elif event.audience:
+            event.read_by_user = event.pk in read
+    return events
+
+
+def _get_unread_filter(user, last_read_at, own):
+    """
+    Returns a ``Q`` object matching the unread events of the given user.
+
+    :param last_read_at: The watermark of the user.
+    :param own: Matches the events of the user, if ``True``, and the audience
+      events for the user otherwise.
+
+    """
+    if own:
+        unread = Q(user=user, read_by_user=False)
+    else:
+        unread = _get_audience_filter(user) & ~Q(
+            pk__in=ObjectEventReadMarker.objects.filter(
+                user=user).values('event'))
+    if last_read_at is not None:
+        unread &= Q(creation_date__gt=last_read_at)
+    return unread
+
+
+class _RawSubquery(RawSQL):
+    """
+    Raw SQL selecting one column, that is used with an ``__in`` lookup.
+
+    Unlike ``RawSQL`` it isn't wrapped in parentheses, since the lookup adds
+    them already. Otherwise the database would only compare against the first
+    row.
+
+    """
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def _count_unread(user, last_read_at):
+    """Counts the unread events and audience events of the given user."""
+    return sum(
+        ObjectEvent.objects.filter(
+            _get_unread_filter(user, last_read_at, own)).count()
+        for own in (True, False))
+
+
+def _get_audience_states(event):
+    """Returns the states of the users in the audience of the given event."""
+    states = ObjectEventUserState.objects.all()
+    if event.audience == 'group':
+        states = states.filter(user__groups=event.audience_group)
+    elif event.audience == 'followers':
+        states = states.filter(
+            user__in=ObjectEventSubscription.objects.filter(
+                content_type_id=event.content_type_id,
+                object_id=event.object_id).values('user'))
+    return states
+
+
+def _union(*querysets):
+    """
+    Returns a subquery selecting the pks of all querysets.
+
+    The querysets are combined with UNION ALL instead of OR-ing their filters,
+    so that the database can answer every part with its own index.
+
+    """
+    sql, params = [], []
+    for queryset in querysets:
+        queryset = queryset.order_by().values('pk')
+        part, part_params = queryset.query.get_compiler(
+            queryset.db).as_sql()
+        sql.append(part)
+        params.extend(part_params)
+    return _RawSubquery(' UNION ALL '.join(sql), params)
+
+
+def _get_audience_filter(user):
+    """
+    Returns a ``Q`` object matching the audience events of the given user.
+
+    Followers are matched with a subquery, so the filter costs no extra
+    query. Audience events, that were created before the user joined, are
+    excluded.
+
+    """
+    audience = Q(audience='all')
+    if hasattr(user, 'groups'):
+        audience |= Q(audience='group',
+                      audience_group__in=user.groups.values('pk'))
+    audience |= Q(audience='followers', pk__in=_RawSubquery(
+        'SELECT e.id FROM {0} e INNER JOIN {1} s'
+        ' ON s.content_type_id = e.content_type_id'
+        ' AND s.object_id = e.object_id'
+        ' WHERE e.audience = %s AND s.user_id = %s'.format(
+            ObjectEvent._meta.db_table,
+            ObjectEventSubscription._meta.db_table),
+        ('followers', user.pk)))
+    audience &= Q(user__isnull=True)
+    if getattr(user, 'date_joined', None) is not None:
+        audience &= Q(creation_date__gte=user.date_joined)
+    return audience
+
+
+def _move_watermark(user, state, last_read_at, exclude_pks):
+    """
+    Moves the watermark of the user back to ``last_read_at``.
+
+    The events between the new and the old watermark, except for the
+    excluded ones, are flagged as read, so that they stay read.
+
+    """
+    between = ObjectEvent.objects.filter(
+        creation_date__gt=last_read_at,
+        creation_date__lte=state.last_read_at).exclude(pk__in=exclude_pks)
+    between.filter(user=user, read_by_user=False).update(read_by_user=True)
+    ObjectEventReadMarker.objects.mark(
+        user, between.for_audience(user).exclude(
+            read_markers__user=user).values_list('pk', flat=True))
+    ObjectEventUserState.objects.filter(pk=state.pk).update(
+        last_read_at=last_read_at)
+
+
+def _notify(user_pks=(), audience=False, bump_states=True):
+    """
+    Announces, that the notifications of the given users have changed.
+
+    Bumps the ``version`` of their states, invalidates their cached
+    notifications and tells their streams.
+
+    :param audience: Invalidates the cached notifications and tells the
+      streams of all users. The states of the audience are bumped along with
+      their unread counts by ``ObjectEvent.create_audience_event``.
+    :param bump_states: ``False``, if the caller bumped the states already.
+
+    """
+    user_pks = set(user_pks)
+    if bump_states and user_pks:
+        ObjectEventUserState.objects.filter(user__pk__in=user_pks).update(
+            version=F('version') + 1)
+    bump_versions(user_pks, audience)
+    publish_change(user_pks, audience)
+
+
+def _get_generic_key(obj, content_types):
+    """
+    Returns the ``(content_type_id, object_id)`` tuple for the given object.
+
+    ``content_types`` is a dict used to cache the content type ids per model
+    class.
+
+    """
+    if obj is None:
+        return None, None
+    if obj.__class__ not in content_types:
+        content_types[obj.__class__] = ContentType.objects.get_for_model(
+            obj).pk
+    return content_types[obj.__class__], obj.pk
+
+
+def _supports_returning(connection):
+    """Returns ``True``, if the database knows ``INSERT ... RETURNING``."""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and (
+        connection.Database.sqlite_version_info >= (3, 35))
+
+
+@receiver(post_save, sender=ObjectEventType)
+def update_event_type_cache(sender, instance, using=None, **kwargs):
+    """Keeps the event type cache in sync, if a type was added or renamed."""
+    for title, pk in list(_event_type_cache.items()):
+        if pk == instance.pk:
+            del _event_type_cache[title]
+    _cache_event_types([(instance.title, instance.pk)], using)
+
+
+@receiver(post_delete, sender=ObjectEventType)
+def remove_event_type_from_cache(sender, instance, **kwargs):
+    """Removes deleted event types from the event type cache."""
+    _event_type_cache.pop(instance.title, None)
@@ -0,0 +1,139 @@
+"""Keyset pagination for the events of the ``object_events`` app."""
+import base64
+from collections import namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+
+CursorPage = namedtuple(
+    'CursorPage', ['object_list', 'next_cursor', 'previous_cursor'])
+
+
+def encode_cursor(event):
+    """Returns an opaque token for the position of the given event."""
+    return force_text(base64.urlsafe_b64encode(force_bytes(u'{0}|{1}'.format(
+        event.creation_date.isoformat(), event.pk))))
+
+
+def decode_cursor(cursor):
+    """
+    Returns the ``(creation_date, pk)`` tuple encoded in the given token.
+
+    Raises ``ValueError`` if the token is invalid.
+
+    """
+    try:
+        creation_date, pk = force_text(base64.urlsafe_b64decode(
+            force_bytes(cursor))).split(u'|')
+        creation_date = parse_datetime(creation_date)
+        pk = int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor: {0!r}'.format(cursor))
+    if creation_date is None:
+        raise ValueError('Invalid cursor: {0!r}'.format(cursor))
+    return creation_date, pk
+
+
+def merge_querysets(querysets, ordering, limit):
+    """
+    Returns the first ``limit`` objects of all querysets in the given order.
+
+    Every queryset is sorted and cut on its own, so that the database can read
+    each of them from an index and never sorts more than ``limit`` rows. The
+    results are merged in Python.
+
+    :param ordering: Field names, that are either all ascending or all
+      descending.
+
+    """
+    fields = [name.lstrip('-') for name in ordering]
+    objects = []
+    for queryset in querysets:
+        objects.extend(queryset.order_by(*ordering)[:limit])
+    objects.sort(key=lambda obj: tuple(getattr(obj, name) for name in fields),
+                 reverse=ordering[0].startswith('-'))
+    return objects[:limit]
+
+
+def paginate_by_cursor(queryset, per_page, after=None, before=None):
+    """
+    Returns one page of events, newest first.
+
+    Instead of an offset, the page starts right after (or ends right before)
+    the event encoded in the given cursor. Therefore the page stays stable
+    while new events are created and it costs the same for every page depth.
+    No total count is computed.
+
+    :param queryset: The events to paginate or a list of querysets, which are
+      paginated separately and merged with ``merge_querysets``.
+    :param per_page: Amount of events per page.
+    :param after: Cursor of the event that precedes the requested page.
+    :param before: Cursor of the event that follows the requested page.
+    :returns: A ``CursorPage`` whose cursors are ``None`` if there is no
+      next or previous page.
+
+    """
+    if isinstance(queryset, (list, tuple)):
+        querysets = queryset
+    else:
+        querysets = [queryset]
+    ordering = ('-creation_date', '-pk')
+    position = Q()
+    if after:
+        creation_date, pk = decode_cursor(after)
+        position = (
+            Q(creation_date__lt=creation_date) |
+            Q(creation_date=creation_date, pk__lt=pk))
+    elif before:
+        creation_date, pk = decode_cursor(before)
+        position = (
+            Q(creation_date__gt=creation_date) |
+            Q(creation_date=creation_date, pk__gt=pk))
+        ordering = ('creation_date', 'pk')
+    return _get_page(merge_querysets(
+        [queryset.filter(position) for queryset in querysets], ordering,
+        per_page + 1), per_page, after, before)
+
+
+def paginate_list(events, per_page, after=None, before=None):
+    """
+    Same as ``paginate_by_cursor`` for a list of events.
+
+    Used by storage backends, that keep the events in memory.
+
+    """
+    events = sorted(events, key=lambda e: (e.creation_date, e.pk),
+                    reverse=True)
+    if after:
+        position = decode_cursor(after)
+        events = [e for e in events if (e.creation_date, e.pk) < position]
+    elif before:
+        position = decode_cursor(before)
+        events = [e for e in reversed(events)
+                  if (e.creation_date, e.pk) > position]
+    return _get_page(events[:per_page + 1], per_page, after, before)
+
+
+def _get_page(object_list, per_page, after, before):
+    """
+    Returns the ``CursorPage`` for the events of a page.
+
+    :param object_list: Up to ``per_page + 1`` events in the order they were
+      queried in. The additional event tells if there are more events.
+
+    """
+    has_more = len(object_list) > per_page
+    object_list = object_list[:per_page]
+    if before:
+        object_list.reverse()
+    if not object_list:
+        return CursorPage(object_list, None, None)
+    has_next = has_more if not before else True
+    has_previous = bool(after) if not before else has_more
+    return CursorPage(
+        object_list,
+        encode_cursor(object_list[-1]) if has_next else None,
+        encode_cursor(object_list[0]) if has_previous else None,
+    )
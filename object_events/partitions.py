@@ -0,0 +1,185 @@
+"""
+Monthly partitions of the ``ObjectEvent`` table on PostgreSQL.
+
+``get_setup_statements`` turn the table into a table, that is partitioned
+by ``creation_date`` (PostgreSQL 11 or newer). The existing rows stay in one
+partition for everything before the next month, new rows go to one partition
+per month. Rows without a partition end up in a default partition.
+
+Deleting a month is a cheap ``DROP TABLE`` instead of a ``DELETE`` of many
+rows. Queries, that filter by ``creation_date``, only read the partitions
+they need, see ``ObjectEvent.objects.recent``.
+
+Use the ``object_event_partitions`` command instead of calling these
+functions directly.
+
+"""
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ObjectEvent, ObjectEventReadMarker
+
+TABLE = ObjectEvent._meta.db_table
+LEGACY_TABLE = '{0}_legacy'.format(TABLE)
+DEFAULT_TABLE = '{0}_default'.format(TABLE)
+MIN_SERVER_VERSION = 110000
+
+BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+INDEX_RE = re.compile(r'^CREATE (UNIQUE )?INDEX (\S+) ON \S+ (.*)$')
+
+
+def supports_partitioning(connection):
+    """Returns ``True``, if the database can partition the event table."""
+    return (connection.vendor == 'postgresql' and
+            connection.pg_version >= MIN_SERVER_VERSION)
+
+
+def get_month(date):
+    """Returns the first day of the month of the given date as a ``date``."""
+    return date.replace(day=1) if not isinstance(date, datetime) else (
+        date.date().replace(day=1))
+
+
+def add_months(month, amount):
+    """Returns the first day of the month ``amount`` months later."""
+    index = month.year * 12 + month.month - 1 + amount
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def get_partition_name(month):
+    """Returns the table name of the partition of the given month."""
+    return '{0}_p{1:%Y%m}'.format(TABLE, month)
+
+
+def get_bound(month):
+    """Returns the first moment of the given month in UTC."""
+    bound = datetime(month.year, month.month, 1)
+    if settings.USE_TZ:
+        bound = timezone.make_aware(bound, timezone.utc)
+    return bound
+
+
+def _quote(connection, name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(cursor):
+    """Returns ``True``, if the event table is partitioned already."""
+    cursor.execute(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass',
+        [TABLE])
+    return cursor.fetchone() is not None
+
+
+def get_partitions(cursor):
+    """
+    Returns the partitions of the event table.
+
+    :returns: List of ``(name, upper bound)`` tuples, ordered by name. The
+      upper bound is a datetime or ``None`` for the default partition.
+
+    """
+    cursor.execute(
+        'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)'
+        ' FROM pg_inherits JOIN pg_class child ON child.oid = inhrelid'
+        ' WHERE inhparent = %s::regclass ORDER BY child.relname', [TABLE])
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = BOUND_RE.search(bound)
+        if match:
+            bound = parse_datetime(match.group(1))
+            if not settings.USE_TZ:
+                bound = timezone.make_naive(bound)
+        partitions.append((name, match and bound))
+    return partitions
+
+
+def get_setup_statements(cursor, connection, month):
+    """
+    Returns the SQL statements, that partition the event table.
+
+    :param month: The first month, that gets its own partition. All existing
+      rows must be older.
+
+    """
+    table = _quote(connection, TABLE)
+    legacy = _quote(connection, LEGACY_TABLE)
+    bound = get_bound(month).isoformat(' ')
+    statements = []
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [TABLE, 'id'])
+    sequence, = cursor.fetchone()
+    if sequence:
+        # Keeps the sequence, when the legacy partition is dropped.
+        statements.append('ALTER SEQUENCE {0} OWNED BY NONE'.format(sequence))
+    statements.append('ALTER TABLE {0} RENAME TO {1}'.format(table, legacy))
+    # Partitioned tables can't be referenced by foreign keys of other tables,
+    # so the read markers only keep their column. Django deletes them along
+    # with their events anyway.
+    cursor.execute(
+        'SELECT conrelid::regclass::text, conname FROM pg_constraint'
+        ' WHERE confrelid = %s::regclass AND contype = %s', [TABLE, 'f'])
+    for referencing_table, name in cursor.fetchall():
+        statements.append('ALTER TABLE {0} DROP CONSTRAINT {1}'.format(
+            referencing_table, _quote(connection, name)))
+    statements += [
+        'CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        ' PARTITION BY RANGE (creation_date)'.format(table, legacy),
+        'ALTER TABLE {0} ADD PRIMARY KEY (id, creation_date)'.format(table),
+        "ALTER TABLE {0} ADD CHECK (creation_date < '{1}')".format(
+            legacy, bound),
+        "ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM (MINVALUE)"
+        " TO ('{2}')".format(table, legacy, bound),
+        'CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(
+            _quote(connection, DEFAULT_TABLE), table),
+    ]
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE tablename = %s'
+        ' AND indexname NOT LIKE %s', [TABLE, '%pkey'])
+    for definition, in cursor.fetchall():
+        unique, name, rest = INDEX_RE.match(definition).groups()
+        if unique:
+            # Unique indexes of partitioned tables must contain the
+            # partition key.
+            continue
+        statements.append('CREATE INDEX {0} ON {1} {2}'.format(
+            _quote(connection, '{0}_part'.format(name[:58])), table, rest))
+    cursor.execute(
+        'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint'
+        ' WHERE conrelid = %s::regclass AND contype = %s', [TABLE, 'f'])
+    for name, definition in cursor.fetchall():
+        statements.append('ALTER TABLE {0} ADD CONSTRAINT {1} {2}'.format(
+            table, _quote(connection, '{0}_part'.format(name[:58])),
+            definition))
+    return statements
+
+
+def get_create_statement(connection, month):
+    """Returns the SQL statement, that creates the partition of a month."""
+    return (
+        "CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1}"
+        " FOR VALUES FROM ('{2}') TO ('{3}')".format(
+            _quote(connection, get_partition_name(month)),
+            _quote(connection, TABLE),
+            get_bound(month).isoformat(' '),
+            get_bound(add_months(month, 1)).isoformat(' ')))
+
+
+def get_drop_statements(connection, name):
+    """
+    Returns the SQL statements, that drop a partition.
+
+    The read markers of its events are deleted first.
+
+    """
+    return [
+        'DELETE FROM {0} WHERE event_id IN (SELECT id FROM {1})'.format(
+            _quote(connection, ObjectEventReadMarker._meta.db_table),
+            _quote(connection, name)),
+        'ALTER TABLE {0} DETACH PARTITION {1}'.format(
+            _quote(connection, TABLE), _quote(connection, name)),
+        'DROP TABLE {0}'.format(_quote(connection, name)),
+    ]
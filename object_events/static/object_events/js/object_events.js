@@ -5,7 +5,132 @@ function checkUnreadNotifications() {
     }
 }
 
+function setUnreadAmount(unread_amount) {
+    var counter = $('[data-id="notification-unread"]');
+    counter.text(unread_amount);
+    if (unread_amount > 0) {
+        counter.addClass('unread');
+    } else {
+        counter.removeClass('unread');
+    }
+}
+
+function pollUnreadNotifications() {
+    // Unchanged polls are answered with 304 Not Modified.
+    $.ajax({
+        url: $('[data-id="notification-unread"]').data('url')
+        ,dataType: 'json'
+        ,ifModified: true
+        ,success: function(data, status) {
+            if (status != 'notmodified' && data) {
+                setUnreadAmount(data.unread);
+            }
+        }
+    });
+}
+
+function streamNotifications(url) {
+    // One idle connection per tab, the browser reconnects by itself and
+    // sends the id of the last message.
+    var source = new EventSource(url);
+    source.onmessage = function(message) {
+        var data = JSON.parse(message.data);
+        setUnreadAmount(data.unread);
+        $(document).trigger('object_events:notifications', [data]);
+    };
+}
+
+function updateNotificationTimes() {
+    // The cached notifications contain absolute times, which are shown
+    // relative to now, if they are younger than a day.
+    if (!window.Intl || !Intl.RelativeTimeFormat) {
+        return;
+    }
+    var format = new Intl.RelativeTimeFormat(
+        document.documentElement.lang || undefined, {'numeric': 'auto'});
+    $('[data-id="notification-time"]').each(function() {
+        // Times in the future come from a skewed clock of the client.
+        var seconds = Math.min(
+            (Date.parse($(this).attr('datetime')) - Date.now()) / 1000, 0);
+        if (isNaN(seconds) || seconds < -86400) {
+            return;
+        }
+        if (seconds > -60) {
+            $(this).text(format.format(Math.round(seconds), 'second'));
+        } else if (seconds > -3600) {
+            $(this).text(format.format(Math.round(seconds / 60), 'minute'));
+        } else {
+            $(this).text(format.format(Math.round(seconds / 3600), 'hour'));
+        }
+    });
+}
+
+var pendingMarks = [];
+var pendingForm = null;
+var markTimeout = null;
+
+function sendPendingMarks() {
+    // Marks all notifications, that were clicked in the meantime, with one
+    // request.
+    var ids = pendingMarks;
+    pendingMarks = [];
+    $.post(
+        pendingForm.attr('action')
+        ,{
+            'mark_ids': ids.join(',')
+            ,'csrfmiddlewaretoken':  pendingForm.find('input[name="csrfmiddlewaretoken"]').val()
+        }
+        ,function(data) {
+            setUnreadAmount(data.unread);
+        }
+        ,'json'
+    );
+}
+
+function flushPendingMarks() {
+    // Sends the marks, that are still waiting for the timeout, when the page
+    // is left. A beacon survives the unload, an ajax request would be
+    // cancelled.
+    if (!pendingMarks.length) {
+        return;
+    }
+    clearTimeout(markTimeout);
+    if (!navigator.sendBeacon) {
+        sendPendingMarks();
+        return;
+    }
+    var data = new FormData();
+    data.append('mark_ids', pendingMarks.join(','));
+    data.append('beacon', '1');
+    data.append('csrfmiddlewaretoken', pendingForm.find('input[name="csrfmiddlewaretoken"]').val());
+    if (navigator.sendBeacon(pendingForm.attr('action'), data)) {
+        pendingMarks = [];
+    } else {
+        sendPendingMarks();
+    }
+}
+
+function markNotification(notif) {
+    var unread_amount = $('[data-id="notification-unread"]').text();
+    setUnreadAmount(Math.max(unread_amount - 1, 0));
+    pendingMarks.push(notif.find('[name="single_mark"]').val());
+    pendingForm = notif.parents('form');
+    clearTimeout(markTimeout);
+    markTimeout = setTimeout(sendPendingMarks, 500);
+}
+
 $(document).ready(function() {
+    updateNotificationTimes();
+    setInterval(updateNotificationTimes, 60000);
+    // pagehide also fires, when the page goes into the back-forward cache.
+    $(window).on('pagehide beforeunload', flushPendingMarks);
+    var counter = $('[data-id="notification-unread"]');
+    // The stream url is only rendered, if the server can stream reliably.
+    if (window.EventSource && counter.data('stream-url')) {
+        streamNotifications(counter.data('stream-url'));
+    } else if (counter.data('url')) {
+        setInterval(pollUnreadNotifications, 60000);
+    }
     $('[data-id="top-notifications"]').hide();
     $('[data-id="notification-btn"]').click(function() {
         if ($('[data-id="top-notifications"]').is(':visible')) {
@@ -25,26 +150,9 @@ $(document).ready(function() {
     $('[data-class="notification"]').click(function() {
         var notif = $(this);
         if (notif.hasClass('unread')) {
-            var form = notif.parents('form');
-            $.post(
-                form.attr('action')
-                ,{
-                    'single_mark': notif.find('[name="single_mark"]').val()
-                    ,'csrfmiddlewaretoken':  form.find('input[name="csrfmiddlewaretoken"]').val()
-                }
-                ,function(data) {
-                    if (data == 'marked') {
-                        notif.removeClass('unread');
-                        // Decrease notification counter
-                        var unread_amount = $('[data-id="notification-unread"]').text();
-                        if (unread_amount <= 1) {
-                            $('[data-id="notification-unread"]').removeClass('unread');
-                        }
-                        $('[data-id="notification-unread"]').text(unread_amount - 1);
-                        checkUnreadNotifications();
-                    }
-                }
-            );
+            notif.removeClass('unread');
+            markNotification(notif);
+            checkUnreadNotifications();
         }
     });
     $('[data-class="notifications"] button[name="bulk_mark"]').click(function() {
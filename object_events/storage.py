@@ -0,0 +1,660 @@
+"""
+Storage backends for the events of the ``object_events`` app.
+
+``ObjectEvent.create_event``, the views, the template tag and the
+``send_event_emails`` command read and write events through the backend set
+in ``OBJECT_EVENTS_STORAGE``. ``ModelStorage`` keeps them in the
+``ObjectEvent`` table, ``MemoryStorage`` keeps them in the memory of the
+current process, e.g. for tests and benchmarks.
+
+"""
+from collections import namedtuple
+from datetime import timedelta
+from itertools import count, groupby
+from threading import Lock
+
+from django.db import connections, router
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import app_settings, metrics
+from .brokers import publish_change
+from .cache import bump_versions
+from .pagination import merge_querysets, paginate_by_cursor, paginate_list
+
+_storage = None
+_storage_lock = Lock()
+
+#: The latest events of a user, newest first, and the unread amount.
+Feed = namedtuple('Feed', ['events', 'unread_count'])
+
+
+class BaseStorage(object):
+    """
+    Interface for the storage backends. Make sure to inherit it.
+
+    Events, that are returned by a backend, have ``read_by_user`` set to the
+    read state of the requesting user.
+
+    """
+    def create_event(self, user, content_object, event_content_object=None,
+                     event_type='', additional_text=''):
+        """Creates one event. See ``ObjectEvent.create_event``."""
+        raise NotImplementedError
+
+    def create_events(self, events, batch_size=None):
+        """Creates many events. See ``ObjectEvent.create_events``."""
+        raise NotImplementedError
+
+    def get_feed(self, user, limit, since=None):
+        """
+        Returns the ``Feed`` of the user with the newest events first.
+
+        :param limit: Maximum amount of events.
+        :param since: Only returns events with a higher pk. These are the
+          oldest ``limit`` events after ``since``, so that a client, that
+          polls again with the highest pk, doesn't miss any of them.
+
+        """
+        raise NotImplementedError
+
+    def paginate(self, user, per_page, after=None, before=None):
+        """
+        Returns a page of the events of the user as a ``CursorPage``.
+
+        See ``object_events.pagination.paginate_by_cursor``.
+
+        """
+        raise NotImplementedError
+
+    def get_unread_count(self, user):
+        """Returns the amount of unread events of the user."""
+        raise NotImplementedError
+
+    def get_version(self, user):
+        """Returns a value, that changes whenever the feed of the user does."""
+        raise NotImplementedError
+
+    def has_event(self, user, pk):
+        """Returns ``True``, if the event is part of the feed of the user."""
+        raise NotImplementedError
+
+    def mark_read(self, user, pks):
+        """Marks the given events as read and returns their amount."""
+        raise NotImplementedError
+
+    def mark_unread(self, user, pks):
+        """Marks the given events as unread and returns their amount."""
+        raise NotImplementedError
+
+    def mark_all_read(self, user):
+        """Marks all events of the user as read."""
+        raise NotImplementedError
+
+    def get_digests(self, user_pks, chunk_size, claim_token=None,
+                    claim_timeout=None):
+        """
+        Yields a ``(user, events)`` tuple per user with unsent events.
+
+        :param user_pks: The pks of the users to send digests to.
+        :param chunk_size: Amount of events to fetch at once.
+        :param claim_token: If given, events are claimed with this token, so
+          that concurrent runs don't send them twice.
+        :param claim_timeout: Seconds after which claims are stale.
+
+        """
+        raise NotImplementedError
+
+    def mark_sent(self, user, events):
+        """Flags the events of a digest, that has been sent to the user."""
+        raise NotImplementedError
+
+    def get_latest_pk(self):
+        """Returns the pk of the newest event or ``None``, if there is none."""
+        raise NotImplementedError
+
+
+class ModelStorage(BaseStorage):
+    """Keeps the events in the ``ObjectEvent`` table."""
+
+    def create_event(self, user, content_object, event_content_object=None,
+                     event_type='', additional_text=''):
+        from .models import ObjectEvent
+        return ObjectEvent._create_event(
+            user, content_object, event_content_object, event_type,
+            additional_text)
+
+    def create_events(self, events, batch_size=None):
+        from .models import ObjectEvent
+        return ObjectEvent._create_events(events, batch_size)
+
+    def get_feed(self, user, limit, since=None):
+        from .models import (
+            ObjectEvent,
+            ObjectEventUserState,
+            load_read_state,
+            load_related,
+        )
+        state = ObjectEventUserState.objects.get_for_user(user)
+        events = ObjectEvent.objects.recent().with_related(prefetch=False)
+        if since:
+            # Reads forward from ``since``, the newest events come first again.
+            events = merge_querysets(
+                events.filter(pk__gt=since).for_user_parts(user), ('pk', ),
+                max(limit, 0))[::-1]
+        else:
+            # Sorted like the pages, so that every part is read from its
+            # index.
+            events = merge_querysets(
+                events.for_user_parts(user), ('-creation_date', '-pk'),
+                max(limit, 0))
+        return Feed(
+            load_read_state(load_related(events), user, state),
+            ObjectEventUserState.objects.get_unread_count(user, state))
+
+    def paginate(self, user, per_page, after=None, before=None):
+        from .models import ObjectEvent, load_read_state, load_related
+        page = paginate_by_cursor(
+            ObjectEvent.objects.recent().with_related(
+                prefetch=False).for_user_parts(user),
+            per_page, after=after, before=before)
+        load_read_state(load_related(page.object_list), user)
+        return page
+
+    def get_unread_count(self, user):
+        from .models import ObjectEventUserState
+        return ObjectEventUserState.objects.get_unread_count(user)
+
+    def get_version(self, user):
+        """Returns the pk and the ``version`` of the state of the user."""
+        from .models import ObjectEventUserState
+        state = ObjectEventUserState.objects.get_for_user(user)
+        return state.pk, state.version
+
+    def has_event(self, user, pk):
+        from .models import ObjectEvent
+        return ObjectEvent.objects.for_user(user).filter(pk=pk).exists()
+
+    def mark_read(self, user, pks):
+        from .models import ObjectEvent
+        return ObjectEvent.objects.mark_read(user, pks)
+
+    def mark_unread(self, user, pks):
+        from .models import ObjectEvent
+        return ObjectEvent.objects.mark_unread(user, pks)
+
+    def mark_all_read(self, user):
+        from .models import ObjectEventUserState
+        ObjectEventUserState.objects.mark_all_read(user)
+
+    def get_digests(self, user_pks, chunk_size, claim_token=None,
+                    claim_timeout=None):
+        """
+        Yields the digests of the given users.
+
+        The audience events of the users are appended to their own events,
+        with one lookup per chunk of digests. Users without own events get a
+        digest of their audience events in a second pass. The second pass is
+        skipped, if no audience event was created after the oldest
+        ``audience_emailed_until`` of these users.
+
+        With a ``claim_token`` the audience events of a user are only sent by
+        the run, that claimed the user's state, see ``_claim_audience``.
+
+        """
+        from django.contrib.auth import get_user_model
+        from .models import ObjectEvent, ObjectEventUserState
+        latest_audience_event = ObjectEvent.objects.recent().exclude(
+            audience='').aggregate(Max('creation_date'))['creation_date__max']
+        claim = (claim_token, claim_timeout) if claim_token else None
+        seen = set()
+        if claim_token:
+            querysets = iter(lambda: self._claim_events(
+                user_pks, chunk_size, claim_token, claim_timeout), None)
+        else:
+            querysets = [ObjectEvent.objects.recent().filter(
+                email_sent=False, user__pk__in=user_pks)]
+        for queryset in querysets:
+            digests = (
+                (events[0].user, events) for events in (
+                    list(events) for user_pk, events in groupby(
+                        self._iter_events(queryset, chunk_size),
+                        lambda e: e.user_id)))
+            if latest_audience_event is not None:
+                digests = self._add_audience_events(
+                    digests, chunk_size, claim)
+            for user, events in digests:
+                seen.add(user.pk)
+                yield user, events
+        if latest_audience_event is None:
+            return
+        remaining = [pk for pk in user_pks if pk not in seen]
+        if not remaining:
+            return
+        emailed = ObjectEventUserState.objects.filter(
+            user__pk__in=remaining).aggregate(
+                Count('audience_emailed_until'), Min('audience_emailed_until'))
+        if (emailed['audience_emailed_until__count'] == len(remaining) and
+                emailed['audience_emailed_until__min'] >=
+                latest_audience_event):
+            return
+        user_model = get_user_model()
+        for i in range(0, len(remaining), chunk_size):
+            users = list(user_model.objects.filter(
+                pk__in=remaining[i:i + chunk_size]).order_by('pk'))
+            audience_events = self._get_audience_events(users, claim)
+            for user in users:
+                if audience_events.get(user.pk):
+                    yield user, audience_events[user.pk]
+
+    def _iter_events(self, queryset, chunk_size):
+        """
+        Yields all events of the given queryset, ordered by user.
+
+        The events are fetched in chunks of ``chunk_size`` using keyset
+        pagination on ``(user, pk)``, so that memory usage stays constant no
+        matter how large the backlog is. After a full chunk the remaining
+        events of the last user and the events of the following users are
+        fetched separately. Unlike one OR-ed condition both keysets can be
+        read from the ``(email_sent, user)`` index in order.
+
+        """
+        queryset = queryset.with_related().order_by('user__pk', 'pk')
+        chunk = queryset
+        same_user = False
+        last = None
+        while True:
+            events = list(chunk[:chunk_size])
+            for event in events:
+                yield event
+            if events:
+                last = events[-1]
+            if len(events) == chunk_size:
+                chunk = queryset.filter(user__pk=last.user_id, pk__gt=last.pk)
+                same_user = True
+            elif same_user:
+                chunk = queryset.filter(user__pk__gt=last.user_id)
+                same_user = False
+            else:
+                return
+
+    def _claim_events(self, user_pks, chunk_size, claim_token,
+                      claim_timeout):
+        """
+        Claims the unsent events of the next users, about ``chunk_size``
+        events at a time.
+
+        Users are claimed with all their events, as long as the claimed events
+        don't exceed ``chunk_size``. A user with more events is claimed alone.
+        The claim is a single atomic UPDATE, which only touches events that
+        are not claimed or whose claim is older than ``claim_timeout``
+        seconds. Concurrent runs therefore never claim the same event.
+
+        :returns: A queryset of the claimed events or ``None`` if there is
+          nothing left to claim.
+
+        """
+        from .models import ObjectEvent
+        claimable = ObjectEvent.objects.recent().filter(
+            email_sent=False, user__pk__in=user_pks).filter(
+                Q(claimed_at__isnull=True) |
+                Q(claimed_at__lt=timezone.now() - timedelta(
+                    seconds=claim_timeout)))
+        batch = []
+        amount = 0
+        for user_pk, events in claimable.order_by('user__pk').values_list(
+                'user__pk').annotate(Count('pk'))[:chunk_size]:
+            if batch and amount + events > chunk_size:
+                break
+            batch.append(user_pk)
+            amount += events
+        if not batch:
+            return None
+        claimable.filter(user__pk__in=batch).update(
+            claimed_by=claim_token, claimed_at=timezone.now())
+        return ObjectEvent.objects.recent().filter(
+            email_sent=False, claimed_by=claim_token, user__pk__in=batch)
+
+    def _add_audience_events(self, digests, chunk_size, claim=None):
+        """
+        Appends the unsent audience events to the given digests.
+
+        The digests are buffered until they contain about ``chunk_size``
+        events, then the audience events of all their users are looked up
+        at once.
+
+        :param claim: ``(claim_token, claim_timeout)`` tuple or ``None``.
+
+        """
+        batch = []
+        amount = 0
+        for user, events in digests:
+            batch.append((user, events))
+            amount += len(events)
+            if amount < chunk_size:
+                continue
+            for digest in self._flush_audience_events(batch, claim):
+                yield digest
+            batch = []
+            amount = 0
+        for digest in self._flush_audience_events(batch, claim):
+            yield digest
+
+    def _flush_audience_events(self, batch, claim=None):
+        """Yields the buffered digests with their audience events."""
+        audience_events = self._get_audience_events(
+            [user for user, events in batch], claim)
+        for user, events in batch:
+            yield user, events + audience_events.get(user.pk, [])
+
+    def _get_audience_events(self, users, claim=None):
+        """
+        Returns the audience events, that haven't been sent to the users.
+
+        One query joins the audience of every kind against the
+        ``audience_emailed_until`` of the users and returns the pairs of user
+        and event. A second one fetches the events.
+
+        :param claim: ``(claim_token, claim_timeout)`` tuple. If given, only
+          the users, whose audience events could be claimed, get them.
+
+        :returns: A dict with the events of every user pk, oldest first.
+
+        """
+        from django.contrib.auth import get_user_model
+        from .models import (
+            ObjectEvent, ObjectEventSubscription, ObjectEventUserState)
+        if not users:
+            return {}
+        connection = connections[router.db_for_read(ObjectEvent)]
+        qn = connection.ops.quote_name
+        user_model = get_user_model()
+        event_table = qn(ObjectEvent._meta.db_table)
+        # Every part selects the user column and joins the events on it.
+        parts = [(
+            '{0} u'.format(qn(user_model._meta.db_table)),
+            'u.{0}'.format(qn(user_model._meta.pk.column)),
+            "e.audience = 'all'",
+        ), (
+            '{0} s'.format(qn(ObjectEventSubscription._meta.db_table)),
+            's.user_id',
+            "e.audience = 'followers'"
+            ' AND e.content_type_id = s.content_type_id'
+            ' AND e.object_id = s.object_id',
+        )]
+        if hasattr(user_model, 'groups'):
+            groups = user_model._meta.get_field('groups')
+            parts.append((
+                '{0} g'.format(qn(groups.m2m_db_table())),
+                'g.{0}'.format(qn(groups.m2m_column_name())),
+                "e.audience = 'group' AND e.audience_group_id = g.{0}".format(
+                    qn(groups.m2m_reverse_name())),
+            ))
+        user_pks = [user.pk for user in users]
+        condition = (
+            ' WHERE {{user}} IN ({0}) AND e.user_id IS NULL'
+            ' AND (st.audience_emailed_until IS NULL'
+            ' OR e.creation_date > st.audience_emailed_until)'.format(
+                ', '.join(['%s'] * len(user_pks))))
+        params = user_pks
+        if app_settings.LOOKBACK_DAYS is not None:
+            condition += ' AND e.creation_date >= %s'
+            params = params + [timezone.now() - timedelta(
+                app_settings.LOOKBACK_DAYS)]
+        sql = ' UNION ALL '.join(
+            ('SELECT {user}, e.id FROM {source}'
+             ' INNER JOIN {events} e ON {join}'
+             ' LEFT OUTER JOIN {states} st ON st.user_id = {user}' +
+             condition).format(
+                user=user, source=source, join=join, events=event_table,
+                states=qn(ObjectEventUserState._meta.db_table))
+            for source, user, join in parts)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params * len(parts))
+            pairs = cursor.fetchall()
+        if claim and pairs:
+            recipients = set(user_pk for user_pk, event_pk in pairs)
+            claimed = self._claim_audience(
+                [user for user in users if user.pk in recipients], *claim)
+            pairs = [(user_pk, event_pk) for user_pk, event_pk in pairs
+                     if user_pk in claimed]
+        if not pairs:
+            return {}
+        events = dict(
+            (event.pk, event) for event in ObjectEvent.objects.recent().filter(
+                pk__in=set(event_pk for user_pk, event_pk in pairs)
+            ).with_related().order_by())
+        result = {}
+        for user_pk, event_pk in pairs:
+            if event_pk in events:
+                result.setdefault(user_pk, []).append(events[event_pk])
+        for user in users:
+            date_joined = getattr(user, 'date_joined', None)
+            result[user.pk] = sorted(
+                (event for event in result.get(user.pk, [])
+                 if date_joined is None or event.creation_date >= date_joined),
+                key=lambda event: (event.creation_date, event.pk))
+        return result
+
+    def _claim_audience(self, users, claim_token, claim_timeout):
+        """
+        Claims the audience events of the given users in their states and
+        returns the pks of the users, whose audience events may be sent.
+
+        Like ``_claim_events`` this is a single UPDATE, which only takes over
+        claims of other runs, that are older than ``claim_timeout`` seconds.
+        The claim is released by ``mark_sent``.
+
+        """
+        from .models import ObjectEventUserState
+        user_pks = [user.pk for user in users]
+        existing = set(ObjectEventUserState.objects.filter(
+            user__pk__in=user_pks).values_list('user__pk', flat=True))
+        for user in users:
+            if user.pk not in existing:
+                ObjectEventUserState.objects.get_for_user(user)
+        claimed_at = timezone.now()
+        ObjectEventUserState.objects.filter(user__pk__in=user_pks).filter(
+            Q(audience_claimed_at__isnull=True) |
+            Q(audience_claimed_by=claim_token) |
+            Q(audience_claimed_at__lt=claimed_at - timedelta(
+                seconds=claim_timeout))).update(
+                    audience_claimed_by=claim_token,
+                    audience_claimed_at=claimed_at)
+        return set(ObjectEventUserState.objects.filter(
+            user__pk__in=user_pks, audience_claimed_by=claim_token,
+        ).values_list('user__pk', flat=True))
+
+    def mark_sent(self, user, events):
+        """
+        Flags the own events as sent with one UPDATE.
+
+        For audience events the date of the newest one is stored in the state
+        of the user and the claim of the audience events is released.
+
+        """
+        from .models import ObjectEvent, ObjectEventUserState
+        ObjectEvent.objects.filter(
+            pk__in=[event.pk for event in events if not event.audience],
+        ).update(email_sent=True)
+        audience_dates = [
+            event.creation_date for event in events if event.audience]
+        if audience_dates:
+            ObjectEventUserState.objects.get_for_user(user)
+            ObjectEventUserState.objects.filter(user=user).update(
+                audience_emailed_until=max(audience_dates),
+                audience_claimed_by='', audience_claimed_at=None)
+
+    def get_latest_pk(self):
+        from .models import ObjectEvent
+        return ObjectEvent.objects.order_by('-pk').values_list(
+            'pk', flat=True).first()
+
+
+class MemoryStorage(BaseStorage):
+    """
+    Keeps the events in the memory of the current process.
+
+    The events are unsaved ``ObjectEvent`` instances with a pk assigned by the
+    storage. Audience events and coalescing are not supported.
+
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.pks = count(1)
+        self.events = {}
+        self.last_read_at = {}
+        self.versions = {}
+
+    def _get_user_pk(self, user):
+        return getattr(user, 'pk', user)
+
+    def _changed(self, user_pk):
+        self.versions[user_pk] = self.versions.get(user_pk, 0) + 1
+        if user_pk is not None:
+            bump_versions([user_pk])
+            publish_change([user_pk])
+
+    def _is_read(self, event):
+        last_read_at = self.last_read_at.get(event.user_id)
+        return event.read_by_user or (
+            last_read_at is not None and event.creation_date <= last_read_at)
+
+    def _get_events(self, user, pks=None):
+        events = self.events.get(self._get_user_pk(user), [])
+        if pks is not None:
+            pks = set(pks)
+            events = [event for event in events if event.pk in pks]
+        return events
+
+    def _with_read_state(self, events):
+        for event in events:
+            event.read_by_user = self._is_read(event)
+        return events
+
+    def create_event(self, user, content_object, event_content_object=None,
+                     event_type='', additional_text=''):
+        from .models import ObjectEvent, ObjectEventType
+        event = ObjectEvent(
+            content_object=content_object,
+            event_content_object=event_content_object,
+            event_type=ObjectEventType(title=event_type),
+            additional_text=additional_text,
+            creation_date=timezone.now(),
+        )
+        if hasattr(user, 'pk'):
+            event.user = user
+        else:
+            event.user_id = user
+        with self.lock:
+            event.pk = next(self.pks)
+            self.events.setdefault(event.user_id, []).append(event)
+            self._changed(event.user_id)
+        metrics.incr('events.created', tags={'type': event_type})
+        return event
+
+    def create_events(self, events, batch_size=None):
+        return [self.create_event(*event).pk for event in events]
+
+    def get_feed(self, user, limit, since=None):
+        with self.lock:
+            events = self._get_events(user)
+            unread_count = len(
+                [event for event in events if not self._is_read(event)])
+            if since:
+                events = [event for event in events
+                          if event.pk > since][:max(limit, 0)][::-1]
+            else:
+                events = events[::-1][:max(limit, 0)]
+            return Feed(self._with_read_state(events), unread_count)
+
+    def paginate(self, user, per_page, after=None, before=None):
+        with self.lock:
+            page = paginate_list(
+                self._get_events(user), per_page, after=after, before=before)
+            self._with_read_state(page.object_list)
+            return page
+
+    def get_unread_count(self, user):
+        with self.lock:
+            return len([event for event in self._get_events(user)
+                        if not self._is_read(event)])
+
+    def get_version(self, user):
+        return self.versions.get(self._get_user_pk(user), 0)
+
+    def has_event(self, user, pk):
+        with self.lock:
+            return bool(self._get_events(user, [pk]))
+
+    def mark_read(self, user, pks):
+        with self.lock:
+            marked = 0
+            for event in self._get_events(user, pks):
+                if not self._is_read(event):
+                    event.read_by_user = True
+                    marked += 1
+            if marked:
+                self._changed(self._get_user_pk(user))
+            return marked
+
+    def mark_unread(self, user, pks):
+        with self.lock:
+            user_pk = self._get_user_pk(user)
+            events = [event for event in self._get_events(user, pks)
+                      if self._is_read(event)]
+            last_read_at = self.last_read_at.get(user_pk)
+            if events and last_read_at is not None:
+                # Keeps the other events before the watermark read.
+                oldest = min(event.creation_date for event in events)
+                for event in self._get_events(user):
+                    if oldest <= event.creation_date <= last_read_at:
+                        event.read_by_user = True
+                self.last_read_at[user_pk] = oldest - timedelta(
+                    microseconds=1)
+            for event in events:
+                event.read_by_user = False
+            if events:
+                self._changed(user_pk)
+            return len(events)
+
+    def mark_all_read(self, user):
+        with self.lock:
+            user_pk = self._get_user_pk(user)
+            self.last_read_at[user_pk] = timezone.now()
+            self._changed(user_pk)
+
+    def get_digests(self, user_pks, chunk_size, claim_token=None,
+                    claim_timeout=None):
+        with self.lock:
+            digests = [
+                (self.events[user_pk][0].user, [
+                    event for event in self.events[user_pk]
+                    if not event.email_sent])
+                for user_pk in sorted(set(user_pks))
+                if user_pk in self.events]
+        for user, events in digests:
+            if events:
+                yield user, events
+
+    def mark_sent(self, user, events):
+        with self.lock:
+            for event in events:
+                event.email_sent = True
+
+    def get_latest_pk(self):
+        with self.lock:
+            return max([event.pk for events in self.events.values()
+                        for event in events] or [None])
+
+
+def get_storage():
+    """Returns the storage backend of this process."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = import_string(app_settings.STORAGE)()
+            if not isinstance(_storage, BaseStorage):
+                raise TypeError('Your storage must inherit BaseStorage.')
+        return _storage
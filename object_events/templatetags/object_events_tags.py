@@ -1,25 +1,73 @@
 """Template tags for the ``object_events`` app."""
 from django import template
+from django.middleware.csrf import get_token
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
 
-from ..models import ObjectEvent
+from .. import metrics
+from ..brokers import is_streaming_enabled
+from ..cache import (
+    CSRF_TOKEN_PLACEHOLDER,
+    NEXT_URL_PLACEHOLDER,
+    get_cache,
+    get_fragment,
+    get_versions,
+    set_fragment,
+)
+from ..storage import get_storage
 
 register = template.Library()
 
 
 @register.simple_tag(takes_context=True)
 def render_notifications(context, notification_amount=8, template_name=None):
-    """Template tag to render fresh notifications for the current user."""
+    """
+    Template tag to render fresh notifications for the current user.
+
+    If ``OBJECT_EVENTS_NOTIFICATIONS_CACHE`` is set, the fragment is cached
+    per user, language and timezone until the notifications of the user
+    change. The template gets placeholders for ``csrf_token`` and
+    ``next_url``, which are replaced for every request. Since a relative time
+    like "5 minutes ago" would be frozen in the cache, ``cached`` is set and
+    the notifications show their absolute time, which ``object_events.js``
+    turns into a relative one.
+
+    """
     ctx = {}
     if template_name is None:
         template_name = 'object_events/notifications.html'
-    if context.get('request') and context['request'].user.is_authenticated():
-        events = ObjectEvent.objects.filter(user=context['request'].user)
-        ctx = {
-            'authenticated': True,
-            'request': context['request'],
-            'unread_amount': events.filter(read_by_user=False).count(),
-        }
-        if events:
-            ctx.update({'notifications': events[:notification_amount]})
-    t = template.loader.get_template(template_name)
-    return t.render(template.Context(ctx))
+    request = context.get('request')
+    if not request or not request.user.is_authenticated():
+        t = template.loader.get_template(template_name)
+        return t.render(template.Context(ctx))
+    user = request.user
+    # The fragment contains translated strings and localized dates.
+    name = u'{0}:{1}:{2}:{3}'.format(
+        template_name, notification_amount, get_language(),
+        get_current_timezone_name())
+    with metrics.timer('notifications.render') as tags:
+        html = get_fragment(user.pk, name)
+        tags['cached'] = html is not None
+        if html is None:
+            versions = get_versions(user.pk)
+            notifications, unread_amount = get_storage().get_feed(
+                user, notification_amount)
+            ctx = {
+                'authenticated': True,
+                'cached': get_cache() is not None,
+                'request': request,
+                'csrf_token': CSRF_TOKEN_PLACEHOLDER,
+                'next_url': NEXT_URL_PLACEHOLDER,
+                'unread_amount': unread_amount,
+                'streaming': is_streaming_enabled(),
+            }
+            if notifications:
+                ctx.update({'notifications': notifications})
+            t = template.loader.get_template(template_name)
+            html = t.render(template.Context(ctx))
+            set_fragment(user.pk, name, versions, html)
+    return mark_safe(html.replace(
+        CSRF_TOKEN_PLACEHOLDER, get_token(request)).replace(
+            NEXT_URL_PLACEHOLDER, escape(request.get_full_path())))
@@ -0,0 +1,266 @@
+"""
+Benchmarks for the hot paths of the ``object_events`` app.
+
+Seeds synthetic users, objects and events and measures the queries, the wall
+time and the peak memory of every hot path. The results are compared with
+the budgets in ``benchmark_budgets.json``. ``benchmarks_tests.py`` checks the
+query budgets as well, since the timings and the memory depend on the host.
+
+Run it from the repository root to get the results as JSON::
+
+    python -m object_events.tests.benchmarks --output results.json
+
+The budgets are only checked, if the data is seeded with the same parameters
+as the budgets were measured with. The command exits with status 1, if a
+budget is exceeded.
+
+"""
+import argparse
+import json
+import os
+import sys
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__),
+                            'benchmark_budgets.json')
+
+
+def load_budgets(path=BUDGETS_FILE):
+    """Returns the seed parameters and the budgets from the given file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def seed(users, events_per_user, event_types, content_types):
+    """
+    Creates the data of the benchmarks.
+
+    :param users: Amount of users. All of them get realtime digests.
+    :param events_per_user: Amount of events per user.
+    :param event_types: Amount of event types.
+    :param content_types: Amount of content types (1 to 3) of the objects the
+      events are about.
+    :returns: The list of the users.
+
+    """
+    from django.contrib.auth.models import Group
+    from django_libs.tests.factories import UserFactory
+
+    from ..models import ObjectEvent, ObjectEventType, ObjectEventUserState
+    from .factories import (
+        DummyModelFactory,
+        ObjectEventTypeFactory,
+        TestProfileFactory,
+    )
+
+    ObjectEventType.objects.clear_cache()
+    object_factories = [
+        DummyModelFactory, UserFactory,
+        lambda: Group.objects.create(name='benchmark'),
+    ][:max(min(content_types, 3), 1)]
+    titles = [ObjectEventTypeFactory().title for i in range(event_types)]
+    objects = [factory() for factory in object_factories]
+    seeded_users = [
+        TestProfileFactory(interval='realtime').user for i in range(users)]
+    # Inserted in bulk, because creating thousands of events one by one
+    # would take longer than the benchmarks.
+    ObjectEvent.create_events(
+        (user, objects[i % len(objects)], None, titles[i % len(titles)])
+        for user in seeded_users for i in range(events_per_user))
+    # The states are created lazily, the benchmarks measure the steady state.
+    for user in seeded_users:
+        ObjectEventUserState.objects.get_for_user(user)
+    return seeded_users
+
+
+def measure(func):
+    """
+    Calls the function and returns its costs.
+
+    :returns: A dict with the amount of ``queries``, the wall time in ``ms``
+      and the ``peak_kb`` of allocated memory. Without ``tracemalloc`` the
+      latter is the growth of the peak resident memory of the process.
+
+    """
+    import resource
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    else:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with CaptureQueriesContext(connection) as queries:
+        start = default_timer()
+        func()
+        ms = (default_timer() - start) * 1000
+    if tracemalloc is not None:
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    else:
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    return {'queries': len(queries), 'ms': round(ms, 2), 'peak_kb': peak_kb}
+
+
+def get_scenarios(users):
+    """
+    Returns the hot paths as a list of ``(name, setup)`` tuples.
+
+    ``setup`` prepares a scenario without being measured and returns the
+    function to measure. The scenarios run in the given order.
+
+    """
+    from django.core.management import call_command
+    from django.core.urlresolvers import reverse
+    from django.template import Context, Template
+    from django.test import Client, RequestFactory
+    from django.utils.six import StringIO
+
+    from ..models import ObjectEvent, ObjectEventType
+    from .factories import DummyModelFactory
+
+    user = users[0]
+
+    def get_client():
+        client = Client()
+        client.login(username=user.username, password='test123')
+        return client
+
+    def create_event():
+        content_object = DummyModelFactory()
+        ObjectEventType.objects.get_pk_for_title('benchmark')
+        return lambda: ObjectEvent.create_event(
+            user, content_object, event_type='benchmark')
+
+    def render_notifications():
+        request = RequestFactory().get('/')
+        request.user = user
+        template = Template(
+            '{% load object_events_tags %}{% render_notifications %}')
+        return lambda: template.render(Context({'request': request}))
+
+    def list_view():
+        client = get_client()
+        return lambda: client.get(reverse('object_events_list'))
+
+    def mark_single():
+        client = get_client()
+        pk = ObjectEvent.objects.filter(user=user).values_list(
+            'pk', flat=True)[0]
+        return lambda: client.post(reverse('object_events_mark'),
+                                   data={'single_mark': pk})
+
+    def mark_bulk():
+        client = get_client()
+        return lambda: client.post(reverse('object_events_mark'),
+                                   data={'bulk_mark': 1})
+
+    def send_event_emails():
+        return lambda: call_command(
+            'send_event_emails', 'realtime', stdout=StringIO())
+
+    return [
+        ('create_event', create_event),
+        ('render_notifications', render_notifications),
+        ('list_view', list_view),
+        ('mark_single', mark_single),
+        ('mark_bulk', mark_bulk),
+        ('send_event_emails', send_event_emails),
+    ]
+
+
+def run_benchmarks(**seed_kwargs):
+    """
+    Seeds the data and measures all scenarios.
+
+    :returns: A dict of the results per scenario name.
+
+    """
+    users = seed(**seed_kwargs)
+    results = {}
+    for name, setup in get_scenarios(users):
+        results[name] = measure(setup())
+    return results
+
+
+def check_budgets(results, budgets, keys=None):
+    """
+    Compares the results with the budgets.
+
+    :param budgets: Dict of the maximum ``queries``, ``ms`` and ``peak_kb``
+      per scenario name. Missing keys aren't checked.
+    :param keys: Optional list of the keys to check, e.g. ``['queries']``.
+      Defaults to all keys of the budgets.
+    :returns: A list of messages about the exceeded budgets.
+
+    """
+    failures = []
+    for name, budget in sorted(budgets.items()):
+        if name not in results:
+            failures.append('{0}: not measured'.format(name))
+            continue
+        for key, limit in sorted(budget.items()):
+            if keys is not None and key not in keys:
+                continue
+            if results[name][key] > limit:
+                failures.append(
+                    '{0}: {1} {2} exceeds the budget of {3}'.format(
+                        name, results[name][key], key, limit))
+    return failures
+
+
+def main(argv=None):
+    """Runs the benchmarks against a test database and prints the JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    budgets = load_budgets()
+    for key, value in sorted(budgets['seed'].items()):
+        parser.add_argument('--{0}'.format(key.replace('_', '-')),
+                            type=int, dest=key, default=value)
+    parser.add_argument('--output', dest='output', default=None,
+                        help='Write the JSON to this file.')
+    args = parser.parse_args(argv)
+
+    import django
+    from django.conf import settings
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment
+
+    if not settings.configured:
+        from . import test_settings
+        settings.configure(**dict(
+            (key, value) for key, value in test_settings.__dict__.items()
+            if key.isupper()))
+    django.setup()
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        seed_kwargs = dict(
+            (key, getattr(args, key)) for key in budgets['seed'])
+        results = run_benchmarks(**seed_kwargs)
+    finally:
+        runner.teardown_databases(old_config)
+    checked = seed_kwargs == budgets['seed']
+    failures = check_budgets(results, budgets['budgets']) if checked else []
+    output = json.dumps({
+        'seed': seed_kwargs,
+        'results': results,
+        'checked': checked,
+        'failures': failures,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
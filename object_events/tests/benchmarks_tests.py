@@ -0,0 +1,36 @@
+"""Tests for the budgets of the benchmarks of the ``object_events`` app."""
+import json
+
+from django.test import TestCase
+
+from ..models import ObjectEventType
+from .benchmarks import check_budgets, load_budgets, run_benchmarks
+
+
+class BenchmarksTestCase(TestCase):
+    """Checks the hot paths against ``benchmark_budgets.json``."""
+    longMessage = True
+
+    def tearDown(self):
+        ObjectEventType.objects.clear_cache()
+
+    def test_budgets(self):
+        budgets = load_budgets()
+        results = run_benchmarks(**budgets['seed'])
+        self.assertEqual(sorted(results), sorted(budgets['budgets']), msg=(
+            'Should have a budget for every scenario.'))
+        # The timings and the memory depend on the host, only the queries are
+        # deterministic.
+        self.assertEqual(check_budgets(
+            results, budgets['budgets'], keys=['queries']), [], msg=(
+                json.dumps(results, indent=2, sort_keys=True)))
+
+    def test_check_budgets(self):
+        results = {'foo': {'queries': 3, 'ms': 10}}
+        self.assertEqual(check_budgets(results, {'foo': {'queries': 3}}), [])
+        self.assertEqual(
+            check_budgets(results, {'foo': {'queries': 2}, 'bar': {}}),
+            ['bar: not measured', 'foo: 3 queries exceeds the budget of 2'])
+        self.assertEqual(check_budgets(
+            results, {'foo': {'queries': 3, 'ms': 5}}, keys=['queries']), [],
+            msg='Should only check the given keys.')
@@ -0,0 +1,160 @@
+"""Tests for the brokers of the ``object_events`` app."""
+from django.test import TestCase, TransactionTestCase
+
+from django_libs.tests.factories import UserFactory
+from nose.tools import raises
+
+from .. import app_settings, brokers
+from ..brokers import (
+    BaseBroker,
+    LocalMemoryBroker,
+    get_broker,
+    is_streaming_enabled,
+)
+from ..models import ObjectEvent, ObjectEventType, ObjectEventUserState
+
+
+class SharedBroker(LocalMemoryBroker):
+    """Pretends to reach the streams of all processes."""
+    shared = True
+
+
+class StateBroker(LocalMemoryBroker):
+    """Remembers the unread counts of the users at the time of publishing."""
+    unread_counts = None
+
+    def publish(self, user_pks, message):
+        self.unread_counts = list(ObjectEventUserState.objects.filter(
+            user__pk__in=user_pks).values_list('unread_count', flat=True))
+        super(StateBroker, self).publish(user_pks, message)
+
+
+class LocalMemoryBrokerTestCase(TestCase):
+    """Tests for the ``LocalMemoryBroker`` class."""
+    longMessage = True
+
+    def setUp(self):
+        self.broker = LocalMemoryBroker(maxsize=2)
+
+    def test_publish(self):
+        subscription = self.broker.subscribe(1)
+        other_subscription = self.broker.subscribe(2)
+        self.broker.publish([1], {'type': 'changed'})
+        self.assertEqual(subscription.get(0), {'type': 'changed'})
+        self.assertIsNone(other_subscription.get(0), msg=(
+            'Should only publish to the channels of the given users.'))
+        self.broker.publish(None, {'type': 'changed'})
+        self.assertTrue(subscription.get(0))
+        self.assertTrue(other_subscription.get(0), msg=(
+            'Should publish to all channels, if no users are given.'))
+
+    def test_full_subscription(self):
+        subscription = self.broker.subscribe(1)
+        for i in range(3):
+            self.broker.publish([1], {'type': i})
+        self.assertEqual(subscription.get(0), {'type': 0})
+        self.assertEqual(subscription.get(0), {'type': 1})
+        self.assertIsNone(subscription.get(0), msg=(
+            'Should drop messages, if the subscription is full.'))
+
+    def test_close(self):
+        subscription = self.broker.subscribe(1)
+        subscription.close()
+        self.assertEqual(self.broker.subscriptions, {})
+        self.broker.publish([1], {'type': 'changed'})
+        self.assertIsNone(subscription.get(0))
+
+
+class GetBrokerTestCase(TestCase):
+    """Tests for the ``get_broker`` function."""
+    longMessage = True
+
+    def setUp(self):
+        self.broker_path = app_settings.BROKER
+        self.streaming = app_settings.STREAMING
+        brokers._broker = None
+
+    def tearDown(self):
+        app_settings.BROKER = self.broker_path
+        app_settings.STREAMING = self.streaming
+        brokers._broker = None
+
+    def test_get_broker(self):
+        self.assertIsInstance(get_broker(), LocalMemoryBroker)
+        self.assertIs(get_broker(), get_broker())
+
+    @raises(TypeError)
+    def test_wrong_broker(self):
+        app_settings.BROKER = 'object_events.brokers.BaseSubscription'
+        get_broker()
+
+    def test_is_streaming_enabled(self):
+        self.assertFalse(is_streaming_enabled(), msg=(
+            'Should poll by default.'))
+        app_settings.STREAMING = True
+        self.assertFalse(is_streaming_enabled(), msg=(
+            'Should not stream with the broker of one process.'))
+        app_settings.BROKER = (
+            'object_events.tests.brokers_tests.SharedBroker')
+        brokers._broker = None
+        self.assertTrue(is_streaming_enabled())
+
+
+class PublishChangeTestCase(TransactionTestCase):
+    """Tests for publishing the changes of the events."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.subscription = get_broker().subscribe(self.user.pk)
+
+    def tearDown(self):
+        self.subscription.close()
+        # The flush of the database doesn't update the event type cache.
+        ObjectEventType.objects.clear_cache()
+
+    def test_create_event(self):
+        ObjectEvent.objects.create(
+            user=self.user, event_type=ObjectEventType.objects.create())
+        self.assertIsNone(self.subscription.get(0))
+        ObjectEvent.create_event(self.user, self.user)
+        self.assertEqual(self.subscription.get(0), {'type': 'changed'})
+        ObjectEvent.create_audience_event('all', self.user)
+        self.assertTrue(self.subscription.get(0), msg=(
+            'Should tell all streams about audience events.'))
+        ObjectEvent.create_events_for_users([self.user], self.user)
+        self.assertTrue(self.subscription.get(0))
+
+    def test_mark_read(self):
+        ObjectEvent.create_event(self.user, self.user)
+        self.subscription.get(0)
+        ObjectEvent.objects.mark_read(self.user, [0])
+        self.assertIsNone(self.subscription.get(0), msg=(
+            'Should not publish, if nothing changed.'))
+        ObjectEvent.objects.mark_read(
+            self.user, ObjectEvent.objects.values_list('pk', flat=True))
+        self.assertTrue(self.subscription.get(0))
+
+    def test_mark_all_read(self):
+        ObjectEvent.create_event(self.user, self.user)
+        broker_path = app_settings.BROKER
+        app_settings.BROKER = 'object_events.tests.brokers_tests.StateBroker'
+        brokers._broker = None
+        try:
+            ObjectEventUserState.objects.mark_all_read(self.user)
+            self.assertEqual(get_broker().unread_counts, [0], msg=(
+                'Should publish after the state has been updated.'))
+        finally:
+            app_settings.BROKER = broker_path
+            brokers._broker = None
+
+
+class BaseBrokerTestCase(TestCase):
+    """Tests for the ``BaseBroker`` interface."""
+    @raises(NotImplementedError)
+    def test_publish(self):
+        BaseBroker().publish([1], {})
+
+    @raises(NotImplementedError)
+    def test_subscribe(self):
+        BaseBroker().subscribe(1)
@@ -0,0 +1,126 @@
+"""Tests for the ``digests`` module of the ``object_events`` app."""
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase
+
+from .. import app_settings
+from ..digests import DigestItem, DigestMailer, get_event_types
+from .factories import ObjectEventFactory, ObjectEventTypeFactory
+
+
+class FailingBackend(EmailBackend):
+    """Backend that fails while ``failures`` is greater than zero."""
+    failures = 0
+    connections = 0
+
+    def open(self):
+        FailingBackend.connections += 1
+
+    def send_messages(self, messages):
+        if FailingBackend.failures:
+            FailingBackend.failures -= 1
+            raise Exception('SMTP error')
+        return super(FailingBackend, self).send_messages(messages)
+
+
+class RefusingBackend(EmailBackend):
+    """Backend that refuses messages to ``fail@example.com``."""
+    def send_messages(self, messages):
+        if any('fail@example.com' in message.to for message in messages):
+            raise Exception('Recipient refused')
+        return super(RefusingBackend, self).send_messages(messages)
+
+
+class GetEventTypesTestCase(TestCase):
+    """Tests for the ``get_event_types`` function."""
+    longMessage = True
+
+    def test_function(self):
+        event_type = ObjectEventTypeFactory()
+        events = [ObjectEventFactory(event_type=event_type) for i in range(2)]
+        event_types = get_event_types(events)
+        self.assertEqual(list(event_types.keys()), [event_type.title])
+        items = event_types[event_type.title]
+        self.assertEqual([item.pk for item in items],
+                         [event.pk for event in events])
+        self.assertIsInstance(items[0], DigestItem)
+        self.assertEqual(u'{0}'.format(items[0]), u'{0}'.format(events[0]),
+                         msg='Should render as the text of the event.')
+
+
+class DigestMailerTestCase(TestCase):
+    """Tests for the ``DigestMailer`` class."""
+    longMessage = True
+
+    def setUp(self):
+        self.event_type = ObjectEventTypeFactory()
+        self.context = {'event_types': get_event_types(
+            [ObjectEventFactory(event_type=self.event_type)])}
+        FailingBackend.failures = 0
+        FailingBackend.connections = 0
+
+    def test_render(self):
+        mailer = DigestMailer(backend='django.core.mail.backends.locmem'
+                                      '.EmailBackend')
+        message = mailer.render('foo@example.com', self.context)
+        self.assertEqual(message.to, ['foo@example.com'])
+        self.assertIn(u'{0}'.format(self.context['event_types'][
+            self.event_type.title][0]), message.alternatives[0][0])
+
+    def test_batches(self):
+        mailer = DigestMailer(2, backend='django.core.mail.backends.locmem'
+                                         '.EmailBackend')
+        sent = []
+        for i in range(3):
+            mailer.send(mailer.render('foo@example.com', self.context),
+                        sent.append)
+        self.assertEqual(len(mail.outbox), 2, msg=(
+            'Should send a batch, once it is full.'))
+        self.assertTrue(mailer.flush())
+        mailer.close()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(sent, [True] * 3)
+
+    def test_reconnect(self):
+        backend = 'object_events.tests.digests_tests.FailingBackend'
+        FailingBackend.failures = 1
+        mailer = DigestMailer(10, retries=1, backend=backend)
+        sent = []
+        mailer.send(mailer.render('foo@example.com', self.context),
+                    sent.append)
+        self.assertTrue(mailer.flush())
+        self.assertEqual(FailingBackend.connections, 2, msg=(
+            'Should send the batch again through a new connection.'))
+        self.assertEqual(sent, [True])
+
+        FailingBackend.failures = 2
+        mailer.send(mailer.render('foo@example.com', self.context),
+                    sent.append)
+        self.assertFalse(mailer.flush())
+        self.assertEqual(sent, [True, False])
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_refused_message(self):
+        mailer = DigestMailer(
+            10, retries=0,
+            backend='object_events.tests.digests_tests.RefusingBackend')
+        sent = []
+
+        def fail(result):
+            raise Exception('Callback error')
+
+        for email, callback in (('foo@example.com', fail),
+                                ('fail@example.com', sent.append),
+                                ('bar@example.com', sent.append)):
+            mailer.send(mailer.render(email, self.context), callback)
+        self.assertFalse(mailer.flush())
+        self.assertEqual(sent, [False, True], msg=(
+            'Should report the result of every message to its callback, even'
+            ' if another callback fails.'))
+        self.assertEqual([message.to for message in mail.outbox], [
+            ['foo@example.com'], ['bar@example.com']], msg=(
+                'Should send the other messages once.'))
+
+    def test_default_batch_size(self):
+        self.assertEqual(DigestMailer().batch_size,
+                         app_settings.EMAIL_BATCH_SIZE)
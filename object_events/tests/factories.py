@@ -5,7 +5,7 @@ from django.utils.timezone import now
 
 from django_libs.tests.factories import UserFactory
 
-from ..models import ObjectEvent, ObjectEventType
+from ..models import ObjectEvent, ObjectEventType, ObjectEventUserState
 from .test_app.models import DummyModel, TestProfile
 
 
@@ -36,3 +36,9 @@ class ObjectEventFactory(factory.DjangoModelFactory):
     creation_date = factory.LazyAttribute(lambda x: now())
     event_type = factory.SubFactory(ObjectEventTypeFactory)
     content_object = factory.SubFactory(DummyModelFactory)
+
+
+class ObjectEventUserStateFactory(factory.DjangoModelFactory):
+    FACTORY_FOR = ObjectEventUserState
+
+    user = factory.SubFactory(UserFactory)
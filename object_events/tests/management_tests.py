@@ -1,14 +1,196 @@
 """Tests for the management commands of the ``object_events`` app."""
-from django.contrib.auth.models import SiteProfileNotAvailable
+import gzip
+import json
+import os
+import shutil
+import signal
+from datetime import datetime
+from tempfile import mkdtemp
+from unittest import skipUnless
+
+from django.core import mail
+from django.core.cache import caches
 from django.core.management import call_command, CommandError
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.six import StringIO
+from django.utils.timezone import now, timedelta
+from django.utils.translation import get_language
 
 from mailer.models import Message
 from nose.tools import raises
 
-from .factories import ObjectEventFactory, TestProfileFactory
-from ..models import UserAggregation
+from .factories import (
+    ObjectEventFactory,
+    ObjectEventTypeFactory,
+    TestProfileFactory,
+)
+from .. import app_settings
+from ..management.commands.run_event_mailer import (
+    Command as RunEventMailerCommand,
+    LOCK_KEY,
+    get_next_run,
+)
+from ..management.commands.send_event_emails import Command
+from ..models import (
+    ObjectEvent,
+    ObjectEventArchive,
+    ObjectEventType,
+    ObjectEventUserState,
+    SiteProfileNotAvailable,
+    UserAggregation,
+)
+
+
+class PruneObjectEventsTestMixin(object):
+    """Creates events of different ages for ``prune_object_events``."""
+    longMessage = True
+
+    def setUp(self):
+        self.old = now() - timedelta(days=40)
+        self.comment_type = ObjectEventTypeFactory(title='comment')
+        self.old_comment = self.create_event(self.comment_type, self.old)
+        self.new_comment = self.create_event(
+            self.comment_type, now() - timedelta(days=10))
+        self.unread_comment = self.create_event(
+            self.comment_type, self.old, read_by_user=False)
+        self.old_event = self.create_event(ObjectEventTypeFactory(), self.old)
+
+    def create_event(self, event_type, creation_date, **kwargs):
+        kwargs.setdefault('read_by_user', True)
+        event = ObjectEventFactory(
+            event_type=event_type, email_sent=True, **kwargs)
+        ObjectEvent.objects.filter(pk=event.pk).update(
+            creation_date=creation_date)
+        return event
+
+
+class PruneObjectEventsTestCase(PruneObjectEventsTestMixin, TestCase):
+    """Tests for the ``prune_object_events`` management command."""
+    @raises(CommandError)
+    def test_missing_policies(self):
+        call_command('prune_object_events')
+
+    def test_dry_run(self):
+        stdout = StringIO()
+        call_command('prune_object_events', days=30, dry_run=True,
+                     stdout=stdout)
+        self.assertEqual(ObjectEvent.objects.count(), 4)
+        self.assertIn('events would be deleted.', stdout.getvalue())
+
+    def test_policies(self):
+        app_settings.RETENTION_POLICIES = {'comment': 30}
+        try:
+            call_command('prune_object_events', chunk_size=1)
+        finally:
+            app_settings.RETENTION_POLICIES = {}
+        self.assertEqual(set(ObjectEvent.objects.all()), set([
+            self.new_comment, self.unread_comment, self.old_event]), msg=(
+                'Should only delete old, read and sent comments.'))
+
+        call_command('prune_object_events', days=30, archive_table=True)
+        self.assertEqual(set(ObjectEvent.objects.all()), set([
+            self.new_comment, self.unread_comment]))
+        archive = ObjectEventArchive.objects.get()
+        self.assertEqual(archive.event_id, self.old_event.pk)
+        self.assertEqual(archive.event_type, self.old_event.event_type.title)
+        self.assertEqual(archive.user_id, self.old_event.user.pk)
+
+    def test_audience_events(self):
+        state = ObjectEventUserState.objects.get_for_user(self.old_event.user)
+        event = ObjectEvent.create_audience_event('all', self.old_event)
+        ObjectEvent.objects.filter(pk=event.pk).update(creation_date=self.old)
+        self.assertEqual(ObjectEventUserState.objects.get(
+            pk=state.pk).unread_count, 1)
+        call_command('prune_object_events', days=30)
+        self.assertFalse(ObjectEvent.objects.filter(pk=event.pk).exists())
+        self.assertEqual(ObjectEventUserState.objects.get(
+            pk=state.pk).unread_count, 0, msg=(
+                'Should not count the deleted audience events as unread.'))
+
+    def test_keyset_cursor(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('prune_object_events', days=30, chunk_size=1)
+        self.assertEqual(ObjectEvent.objects.count(), 2)
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT')]
+        self.assertIn('"id" > ', selects[-1], msg=(
+            'Should continue after the pk of the last chunk.'))
+
+
+class PruneObjectEventsArchiveFileTestCase(PruneObjectEventsTestMixin,
+                                           TransactionTestCase):
+    """Tests for the archive file of ``prune_object_events``."""
+    def setUp(self):
+        super(PruneObjectEventsArchiveFileTestCase, self).setUp()
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'archive.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive_file(self):
+        call_command('prune_object_events', days=30, archive_file=self.path)
+        with gzip.open(self.path) as f:
+            rows = [json.loads(line.decode('utf-8')) for line in f]
+        self.assertEqual(set(row['pk'] for row in rows), set([
+            self.old_comment.pk, self.old_event.pk]))
+        self.assertEqual(ObjectEvent.objects.count(), 2)
+
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                call_command('prune_object_events', days=30,
+                             archive_file=self.path)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(os.path.exists(self.path), msg=(
+            'Should not archive events, that have not been deleted.'))
+        self.assertEqual(ObjectEvent.objects.count(), 4)
+
+
+@skipUnless(connection.vendor != 'postgresql', 'Needs another database.')
+class ObjectEventPartitionsTestCase(TestCase):
+    """Tests for the ``object_event_partitions`` management command."""
+    @raises(CommandError)
+    def test_unsupported_database(self):
+        call_command('object_event_partitions', setup=True)
+
+
+class RebuildUnreadCountersTestCase(TestCase):
+    """Tests for the ``rebuild_unread_counters`` management command."""
+    def test_command(self):
+        event = ObjectEventFactory()
+        ObjectEventUserState.objects.create(user=event.user, unread_count=3)
+        stdout = StringIO()
+        call_command('rebuild_unread_counters', stdout=stdout)
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=event.user).unread_count, 1)
+        self.assertEqual(stdout.getvalue(),
+                         'Updated the unread counters of 1 users.\n')
+
+
+class FailingCommand(Command):
+    """Command that can't send emails to ``fail@example.com``."""
+    attempts = 0
+
+    def send_mail_to_user(self, email_context, to):
+        if to.email == 'fail@example.com':
+            self.attempts += 1
+            raise Exception('SMTP error')
+        return super(FailingCommand, self).send_mail_to_user(
+            email_context, to)
+
+
+class LanguageCommand(Command):
+    """Command that remembers the active language of every digest."""
+    def send_mail_to_user(self, email_context, to):
+        message = super(LanguageCommand, self).send_mail_to_user(
+            email_context, to)
+        self.languages.append(get_language())
+        return message
 
 
 class SendEventEmailsTestCase(TestCase):
@@ -18,8 +200,8 @@ class SendEventEmailsTestCase(TestCase):
     @raises(CommandError)
     def test_wrong_aggregation_class(self):
         with self.settings(
-            OBJECT_EVENTS_USER_AGGREGATION_CLASS=('test_app.models.'
-                                                  'EmptyAggregation')):
+            OBJECT_EVENTS_USER_AGGREGATION_CLASS=(
+                'object_events.tests.test_app.models.EmptyAggregation')):
             call_command('send_event_emails', 'realtime')
 
     @raises(CommandError)
@@ -92,3 +274,369 @@ class SendEventEmailsTestCase(TestCase):
         ObjectEventFactory(user=profile.user)
         self.assertFalse(call_command('send_event_emails', 'monthly'))
         self.assertEqual(Message.objects.all().count(), 1)
+
+    def test_chunked_digest(self):
+        profile = TestProfileFactory(interval='daily')
+        other_profile = TestProfileFactory(interval='daily')
+        for i in range(3):
+            ObjectEventFactory(user=profile.user)
+            ObjectEventFactory(user=other_profile.user)
+        call_command('send_event_emails', 'daily', chunk_size=2)
+        self.assertEqual(Message.objects.all().count(), 2, msg=(
+            'Should send one digest per user, even if the events of one user'
+            ' are spread over several chunks.'))
+        self.assertFalse(ObjectEvent.objects.filter(email_sent=False))
+
+    def test_query_count(self):
+        """The amount of queries should not grow with the amount of events."""
+        def count_queries(events_per_user):
+            for i in range(2):
+                profile = TestProfileFactory(interval='daily')
+                for j in range(events_per_user):
+                    ObjectEventFactory(user=profile.user)
+            with CaptureQueriesContext(connection) as context:
+                call_command('send_event_emails', 'daily')
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(10))
+
+    def test_failed_digest(self):
+        profile = TestProfileFactory(interval='daily')
+        failing_profile = TestProfileFactory(
+            interval='daily', user__email='fail@example.com')
+        event = ObjectEventFactory(user=profile.user)
+        failing_event = ObjectEventFactory(user=failing_profile.user)
+        command = FailingCommand(stderr=StringIO())
+        command.handle('daily', retries=2)
+        self.assertEqual(command.attempts, 3, msg=(
+            'Should retry a failed digest.'))
+        self.assertEqual(command.failed_digests, 1)
+        self.assertEqual(command.retried_digests, 2)
+        self.assertTrue(ObjectEvent.objects.get(pk=event.pk).email_sent)
+        self.assertFalse(
+            ObjectEvent.objects.get(pk=failing_event.pk).email_sent, msg=(
+                'Events of a failed digest should not be flagged as sent.'))
+        self.assertEqual(Message.objects.all().count(), 1)
+
+    def test_failed_batch(self):
+        profiles = [TestProfileFactory(interval='daily') for i in range(2)]
+        failing_profile = TestProfileFactory(
+            interval='daily', user__email='fail@example.com')
+        events = [ObjectEventFactory(user=profile.user)
+                  for profile in profiles]
+        failing_event = ObjectEventFactory(user=failing_profile.user)
+        backend = app_settings.EMAIL_BACKEND
+        app_settings.EMAIL_BACKEND = (
+            'object_events.tests.digests_tests.RefusingBackend')
+        try:
+            command = Command(stderr=StringIO())
+            command.handle('daily', retries=1, batch_size=3)
+        finally:
+            app_settings.EMAIL_BACKEND = backend
+        self.assertEqual(command.failed_digests, 1, msg=(
+            'Should only count the refused digest as failed.'))
+        self.assertEqual(len(mail.outbox), 2, msg=(
+            'Should send the other digests of the batch once.'))
+        self.assertEqual(ObjectEvent.objects.filter(
+            pk__in=[event.pk for event in events], email_sent=True).count(),
+            2)
+        self.assertFalse(
+            ObjectEvent.objects.get(pk=failing_event.pk).email_sent)
+
+    def test_languages(self):
+        for language in ('de', 'en', 'de'):
+            profile = TestProfileFactory(interval='daily', language=language)
+            ObjectEventFactory(user=profile.user)
+        command = LanguageCommand()
+        command.languages = []
+        with CaptureQueriesContext(connection) as context:
+            command.handle('daily')
+        self.assertEqual(command.languages, ['de', 'de', 'en'], msg=(
+            'Should send the digests grouped by language.'))
+        self.assertEqual(Message.objects.all().count(), 3)
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'test_app_testprofile' in query['sql'] and
+            'interval' not in query['sql']], msg=(
+                'Should not query the profile of every recipient.'))
+
+    def test_shard(self):
+        profiles = [TestProfileFactory(interval='daily') for i in range(4)]
+        for profile in profiles:
+            ObjectEventFactory(user=profile.user)
+        call_command('send_event_emails', 'daily', shard='0/2')
+        self.assertEqual(Message.objects.all().count(), 2)
+        for profile in profiles:
+            self.assertEqual(
+                ObjectEvent.objects.get(user=profile.user).email_sent,
+                profile.user.pk % 2 == 0)
+        call_command('send_event_emails', 'daily', shard='1/2')
+        self.assertEqual(Message.objects.all().count(), 4)
+
+    @raises(CommandError)
+    def test_invalid_shard(self):
+        TestProfileFactory(interval='daily')
+        call_command('send_event_emails', 'daily', shard='2/2')
+
+    def test_claim(self):
+        profile = TestProfileFactory(interval='daily')
+        other_profile = TestProfileFactory(interval='daily')
+        ObjectEventFactory(user=profile.user)
+        ObjectEventFactory(user=other_profile.user)
+        ObjectEventFactory(user=other_profile.user)
+        # A claim of another node
+        claimed = ObjectEventFactory(user=other_profile.user)
+        ObjectEvent.objects.filter(pk=claimed.pk).update(
+            claimed_by='other', claimed_at=now())
+        call_command('send_event_emails', 'daily', claim=True, chunk_size=1)
+        self.assertEqual(Message.objects.all().count(), 2)
+        self.assertEqual(list(ObjectEvent.objects.filter(
+            email_sent=False)), [claimed], msg=(
+                'Should not send events claimed by another node.'))
+
+        # The claim of the other node is stale
+        ObjectEvent.objects.filter(pk=claimed.pk).update(
+            claimed_at=now() - timedelta(hours=2))
+        call_command('send_event_emails', 'daily', claim=True,
+                     claim_timeout=3600)
+        self.assertEqual(Message.objects.all().count(), 3)
+        self.assertFalse(ObjectEvent.objects.filter(email_sent=False))
+
+    def test_audience_events(self):
+        profile = TestProfileFactory(interval='daily')
+        other_profile = TestProfileFactory(interval='daily')
+        ObjectEventFactory(user=profile.user)
+        ObjectEvent.create_audience_event('all', profile.user)
+        call_command('send_event_emails', 'daily')
+        self.assertEqual(Message.objects.all().count(), 2, msg=(
+            'Should send the audience event along with the own events and to'
+            ' the users without own events.'))
+        self.assertTrue(ObjectEventUserState.objects.get(
+            user=other_profile.user).audience_emailed_until)
+        call_command('send_event_emails', 'daily')
+        self.assertEqual(Message.objects.all().count(), 2, msg=(
+            'Should send every audience event only once per user.'))
+
+    def test_claim_audience_events(self):
+        profile = TestProfileFactory(interval='daily')
+        other_profile = TestProfileFactory(interval='daily')
+        ObjectEvent.create_audience_event('all', profile.user)
+        # A claim of another node
+        ObjectEventUserState.objects.get_for_user(profile.user)
+        ObjectEventUserState.objects.filter(user=profile.user).update(
+            audience_claimed_by='other', audience_claimed_at=now())
+        call_command('send_event_emails', 'daily', claim=True)
+        self.assertEqual(Message.objects.all().count(), 1, msg=(
+            'Should send the audience events to users without own events,'
+            ' unless another node claimed them.'))
+        state = ObjectEventUserState.objects.get(user=other_profile.user)
+        self.assertTrue(state.audience_emailed_until)
+        self.assertEqual(state.audience_claimed_by, '', msg=(
+            'Should release the claim after sending.'))
+
+        # The claim of the other node is stale
+        ObjectEventUserState.objects.filter(user=profile.user).update(
+            audience_claimed_at=now() - timedelta(hours=2))
+        call_command('send_event_emails', 'daily', claim=True,
+                     claim_timeout=3600)
+        self.assertEqual(Message.objects.all().count(), 2)
+        call_command('send_event_emails', 'daily', claim=True)
+        self.assertEqual(Message.objects.all().count(), 2)
+
+
+def can_share_db_between_threads():
+    """Worker threads can't see an in-memory database on some platforms."""
+    return not (
+        connection.vendor == 'sqlite' and
+        connection.is_in_memory_db(connection.settings_dict['NAME']) and
+        not connection.features.can_share_in_memory_db)
+
+
+@skipUnless(can_share_db_between_threads(),
+            'The test database can not be shared between threads.')
+class SendEventEmailsWorkersTestCase(TransactionTestCase):
+    """Tests for the ``--workers`` option of ``send_event_emails``."""
+    longMessage = True
+
+    def tearDown(self):
+        # The flush of the database doesn't update the event type cache.
+        ObjectEventType.objects.clear_cache()
+
+    def test_workers(self):
+        for i in range(4):
+            profile = TestProfileFactory(interval='daily')
+            ObjectEventFactory(user=profile.user)
+            ObjectEventFactory(user=profile.user)
+        failing_profile = TestProfileFactory(
+            interval='daily', user__email='fail@example.com')
+        ObjectEventFactory(user=failing_profile.user)
+        command = FailingCommand()
+        command.handle('daily', workers=3, retries=0)
+        self.assertEqual(command.sent_emails, 4)
+        self.assertEqual(command.sent_events, 8)
+        self.assertEqual(command.failed_digests, 1)
+        self.assertEqual(Message.objects.all().count(), 4)
+        self.assertEqual(ObjectEvent.objects.filter(
+            email_sent=False).count(), 1)
+
+
+class OnceCommand(RunEventMailerCommand):
+    """Scheduler that stops after its first tick."""
+    def tick(self, now):
+        super(OnceCommand, self).tick(now)
+        self.stop()
+
+
+class SignalCommand(RunEventMailerCommand):
+    """Scheduler that receives SIGTERM during its first tick."""
+    ticks = 0
+
+    def tick(self, now):
+        self.ticks += 1
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class LostLockCommand(RunEventMailerCommand):
+    """Scheduler, whose lock is taken by another one during its first tick."""
+    def tick(self, now):
+        self.get_cache().set(LOCK_KEY, 'other')
+        self.stopped.wait(5)
+        self.send('realtime')
+
+
+class RunEventMailerTestCase(TestCase):
+    """Tests for the ``run_event_mailer`` management command."""
+    longMessage = True
+
+    def setUp(self):
+        self.command = RunEventMailerCommand(stderr=StringIO())
+        self.command.send_options = {}
+        self.command.last_pk = None
+        self.command.next_runs = {}
+        self.sent = []
+        send = self.command.send
+
+        def record(interval):
+            self.sent.append(interval)
+            return send(interval)
+
+        self.command.send = record
+
+    def tearDown(self):
+        caches[app_settings.MAILER_LOCK_CACHE].delete(LOCK_KEY)
+
+    def test_get_next_run(self):
+        # 2016-01-31 is a sunday.
+        after = datetime(2016, 1, 31, 12, 0)
+        self.assertEqual(get_next_run({'hour': 0}, after),
+                         datetime(2016, 2, 1, 0, 0))
+        self.assertEqual(get_next_run({'weekday': 6, 'hour': 15}, after),
+                         datetime(2016, 1, 31, 15, 0))
+        self.assertEqual(get_next_run({'day': 1, 'minute': 30}, after),
+                         datetime(2016, 2, 1, 0, 30))
+        self.assertEqual(
+            get_next_run({'day': 31, 'hour': 17},
+                         datetime(2016, 1, 31, 18, 0)),
+            datetime(2016, 2, 29, 17, 0), msg=(
+                'Should use the last day of shorter months.'))
+        self.assertGreater(get_next_run({'hour': 0}, now()), now())
+
+    def test_tick(self):
+        profile = TestProfileFactory(interval='realtime')
+        event = ObjectEventFactory(user=profile.user)
+        self.command.tick(now())
+        self.assertEqual(self.sent, ['realtime'])
+        self.assertTrue(ObjectEvent.objects.get(pk=event.pk).email_sent)
+        self.command.tick(now())
+        self.assertEqual(self.sent, ['realtime'], msg=(
+            'Should not send realtime digests without new events.'))
+        ObjectEventFactory(user=profile.user)
+        self.command.next_runs['daily'] = now() - timedelta(minutes=1)
+        self.command.tick(now())
+        self.assertEqual(self.sent, ['realtime', 'daily', 'realtime'])
+        self.assertGreater(self.command.next_runs['daily'], now())
+        self.assertEqual(Message.objects.all().count(), 2)
+
+    def test_send(self):
+        self.assertFalse(self.command.send('hourly'))
+        self.assertIn('Could not send the hourly digests',
+                      self.command.stderr.getvalue(), msg=(
+                          'Should not stop the scheduler.'))
+
+    def test_tick_failed_run(self):
+        profile = TestProfileFactory(interval='realtime')
+        event = ObjectEventFactory(user=profile.user)
+        self.command.send_options = {'shard': 'invalid'}
+        self.command.tick(now())
+        self.assertIsNone(self.command.last_pk, msg=(
+            'Should only remember the newest event after a successful run.'))
+        self.command.send_options = {}
+        self.command.tick(now())
+        self.assertEqual(self.sent, ['realtime', 'realtime'])
+        self.assertEqual(self.command.last_pk, event.pk)
+        self.assertTrue(ObjectEvent.objects.get(pk=event.pk).email_sent)
+
+    def test_lock(self):
+        self.command.acquire_lock()
+        other = RunEventMailerCommand()
+        self.assertRaises(CommandError, other.acquire_lock)
+        self.assertTrue(self.command.heartbeat())
+        cache = caches[app_settings.MAILER_LOCK_CACHE]
+        cache.set(LOCK_KEY, 'other')
+        self.assertFalse(self.command.heartbeat(), msg=(
+            'Should notice, that another scheduler took the lock.'))
+        self.command.release_lock()
+        self.assertEqual(cache.get(LOCK_KEY), 'other', msg=(
+            'Should not release the lock of another scheduler.'))
+        cache.delete(LOCK_KEY)
+        self.assertFalse(self.command.heartbeat(), msg=(
+            'Should not take an expired lock again.'))
+
+    @raises(CommandError)
+    def test_local_lock_cache(self):
+        app_settings.MAILER_LOCK_CACHE = 'default'
+        try:
+            self.command.acquire_lock()
+        finally:
+            app_settings.MAILER_LOCK_CACHE = 'mailer_lock'
+
+
+class RunEventMailerHandleTestCase(TransactionTestCase):
+    """Tests for the ``handle`` method of ``run_event_mailer``."""
+    longMessage = True
+
+    def tearDown(self):
+        # The flush of the database doesn't update the event type cache.
+        ObjectEventType.objects.clear_cache()
+
+    def test_handle(self):
+        profile = TestProfileFactory(interval='realtime')
+        ObjectEventFactory(user=profile.user)
+        handler = signal.getsignal(signal.SIGTERM)
+        OnceCommand().handle(poll_interval=0.1)
+        self.assertEqual(Message.objects.all().count(), 1)
+        self.assertIsNone(
+            caches[app_settings.MAILER_LOCK_CACHE].get(LOCK_KEY), msg=(
+                'Should release the lock.'))
+        self.assertEqual(signal.getsignal(signal.SIGTERM), handler, msg=(
+            'Should restore the signal handlers.'))
+
+    def test_lost_lock(self):
+        profile = TestProfileFactory(interval='realtime')
+        ObjectEventFactory(user=profile.user)
+        app_settings.MAILER_LOCK_TIMEOUT = 0.3
+        try:
+            self.assertRaises(
+                CommandError, LostLockCommand(stderr=StringIO()).handle,
+                poll_interval=0.1)
+        finally:
+            app_settings.MAILER_LOCK_TIMEOUT = 60
+            caches[app_settings.MAILER_LOCK_CACHE].delete(LOCK_KEY)
+        self.assertEqual(Message.objects.all().count(), 0, msg=(
+            'Should not send digests after the lock has been lost.'))
+
+    def test_sigterm(self):
+        command = SignalCommand()
+        command.handle(poll_interval=0.1)
+        self.assertEqual(command.ticks, 1, msg=(
+            'Should stop after SIGTERM.'))
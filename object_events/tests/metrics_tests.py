@@ -0,0 +1,144 @@
+"""Tests for the metrics of the ``object_events`` app."""
+import socket
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.six import StringIO
+
+from django_libs.tests.factories import UserFactory
+from nose.tools import raises
+
+from .. import app_settings, metrics
+from ..metrics import (
+    BaseSink,
+    MemorySink,
+    StatsdSink,
+    get_sink,
+    metric_recorded,
+)
+from ..models import ObjectEvent, ObjectEventUserState
+from ..templatetags.object_events_tags import render_notifications
+from .factories import DummyModelFactory, TestProfileFactory
+
+
+class MetricsTestMixin(object):
+    """Collects the metrics in a ``MemorySink``."""
+    longMessage = True
+
+    def setUp(self):
+        self.sink_path = app_settings.METRICS_SINK
+        app_settings.METRICS_SINK = 'object_events.metrics.MemorySink'
+        metrics._sink = None
+        self.sink = get_sink()
+
+    def tearDown(self):
+        app_settings.METRICS_SINK = self.sink_path
+        metrics._sink = None
+
+
+class RecordTestCase(MetricsTestMixin, TestCase):
+    """Tests for recording metrics."""
+    def test_record(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append((kwargs['kind'], kwargs['name'], kwargs['value'],
+                             kwargs['tags']))
+
+        metric_recorded.connect(receiver)
+        try:
+            metrics.incr('foo', tags={'type': 'bar'})
+            metrics.incr('foo', 2, tags={'type': 'bar'})
+            metrics.gauge('depth', 3)
+            with metrics.timer('time') as tags:
+                tags['cached'] = True
+        finally:
+            metric_recorded.disconnect(receiver)
+        self.assertEqual(self.sink.get_counter('foo', type='bar'), 3)
+        self.assertEqual(self.sink.gauges, {('depth', ()): 3})
+        self.assertEqual(len(self.sink.get_timings('time', cached='True')), 1,
+                         msg='Should record the tags set inside the block.')
+        self.assertEqual(received[0], ('counter', 'foo', 1, {'type': 'bar'}))
+        self.assertEqual(len(received), 4)
+
+    def test_disabled(self):
+        app_settings.METRICS_SINK = None
+        self.assertIsNone(get_sink())
+        metrics.incr('foo')
+        self.assertEqual(self.sink.counters, {})
+
+    @raises(TypeError)
+    def test_wrong_sink(self):
+        app_settings.METRICS_SINK = 'object_events.brokers.LocalMemoryBroker'
+        metrics._sink = None
+        get_sink()
+
+
+class StatsdSinkTestCase(TestCase):
+    """Tests for the ``StatsdSink`` class."""
+    def test_record(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(1)
+        try:
+            sink = StatsdSink('127.0.0.1', server.getsockname()[1], 'app')
+            sink.record('counter', 'events.created', 2,
+                        {'type': 'new comment'})
+            self.assertEqual(server.recv(1024),
+                             b'app.events.created.type_new_comment:2|c')
+        finally:
+            server.close()
+        self.assertEqual(sink.format('timing', 'render', 1.5, {}),
+                         'app.render:1.5|ms')
+
+
+class HotPathMetricsTestCase(MetricsTestMixin, TestCase):
+    """Tests for the metrics of the hot paths."""
+    def test_create_event(self):
+        user = UserFactory()
+        ObjectEvent.create_event(user, DummyModelFactory(), event_type='foo')
+        ObjectEvent.create_events([(user, user, None, 'foo')] * 2)
+        self.assertEqual(self.sink.get_counter('events.created', type='foo'),
+                         3)
+
+    def test_render_notifications(self):
+        request = RequestFactory().get('/')
+        request.user = UserFactory()
+        render_notifications({'request': request})
+        self.assertEqual(
+            len(self.sink.get_timings('notifications.render', cached='False')),
+            1)
+        self.assertEqual(len(self.sink.get_timings('unread_count.query')), 1)
+
+    def test_send_event_emails(self):
+        user = TestProfileFactory(interval='daily').user
+        ObjectEventUserState.objects.get_for_user(user)
+        ObjectEvent.create_event(user, DummyModelFactory())
+        call_command('send_event_emails', 'daily', stdout=StringIO())
+        self.assertEqual(self.sink.get_counter('digest.sent',
+                                               interval='daily'), 1)
+        self.assertEqual(self.sink.get_counter('digest.events',
+                                               interval='daily'), 1)
+        self.assertTrue(self.sink.get_timings('digest.send',
+                                              interval='daily'))
+        self.assertTrue(self.sink.get_timings('digest.build',
+                                              interval='daily'))
+        self.assertTrue(self.sink.get_timings('digest.run',
+                                              interval='daily'))
+
+
+class BaseSinkTestCase(TestCase):
+    """Tests for the ``BaseSink`` interface."""
+    @raises(NotImplementedError)
+    def test_record(self):
+        BaseSink().record('counter', 'foo', 1, {})
+
+
+class MemorySinkTestCase(TestCase):
+    """Tests for the ``MemorySink`` class."""
+    def test_clear(self):
+        sink = MemorySink()
+        sink.record('counter', 'foo', 1, {})
+        sink.clear()
+        self.assertEqual(sink.get_counter('foo'), 0)
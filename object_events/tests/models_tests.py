@@ -1,22 +1,105 @@
 """Tests for the models of the ``object_events`` app."""
+from sqlite3 import sqlite_version_info
+from unittest import skipUnless
+
+from django.contrib.auth.models import Group, User
+from django.db import DatabaseError, connection, transaction
 from django.template.defaultfilters import date
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now, timedelta
 
 from django_libs.tests.factories import UserFactory
 from nose.tools import raises
 
-from ..models import ObjectEvent, ObjectEventType, UserAggregationBase
-from .factories import ObjectEventFactory, ObjectEventTypeFactory
+from ..app_settings import COALESCE_WINDOWS
+from ..models import (
+    ObjectEvent,
+    ObjectEventReadMarker,
+    ObjectEventSubscription,
+    ObjectEventType,
+    ObjectEventUserState,
+    Recipient,
+    UserAggregation,
+    UserAggregationBase,
+    load_read_state,
+)
+from .factories import (
+    ObjectEventFactory,
+    ObjectEventTypeFactory,
+    ObjectEventUserStateFactory,
+    TestProfileFactory,
+)
 
 
-class ObjectEventTypeTestCase(TestCase):
+class ObjectEventTypeTestCase(TransactionTestCase):
     """Tests for the ``ObjectEventType`` model class."""
+    def tearDown(self):
+        ObjectEventType.objects.clear_cache()
+
     def test_model(self):
         """Should be able to instantiate and save the model."""
         obj = ObjectEventTypeFactory()
         self.assertTrue(obj.pk)
 
+    def test_get_pk_for_title(self):
+        pk = ObjectEventType.objects.get_pk_for_title('foo')
+        self.assertEqual(ObjectEventType.objects.get(title='foo').pk, pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ObjectEventType.objects.get_pk_for_title('foo'), pk)
+
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                ObjectEventType.objects.get_pk_for_title('foo')
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        pk = ObjectEventType.objects.get_pk_for_title('foo')
+        self.assertEqual(ObjectEventType.objects.get(title='foo').pk, pk,
+                         msg='Should not cache rolled back types.')
+
+    def test_create_event(self):
+        user = UserFactory()
+        ObjectEvent.create_event(user, user)
+        with CaptureQueriesContext(connection) as context:
+            ObjectEvent.create_event(user, user)
+        # Once the type is known, creating an event is a single INSERT plus
+        # the update of the unread counter
+        self.assertEqual(len([
+            query for query in context.captured_queries
+            if query['sql'] != 'BEGIN']), 2)
+
+    def test_cache_invalidation(self):
+        obj = ObjectEventTypeFactory(title='foo')
+        self.assertEqual(
+            ObjectEventType.objects.get_pk_for_title('foo'), obj.pk)
+        obj.title = 'bar'
+        obj.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ObjectEventType.objects.get_pk_for_title('bar'), obj.pk)
+        self.assertNotEqual(
+            ObjectEventType.objects.get_pk_for_title('foo'), obj.pk, msg=(
+                'Renamed types should not be cached with their old title.'))
+        obj.delete()
+        self.assertNotEqual(
+            ObjectEventType.objects.get_pk_for_title('bar'), obj.pk)
+
+    def test_warm_cache(self):
+        obj = ObjectEventTypeFactory()
+        other = ObjectEventTypeFactory()
+        ObjectEventType.objects.clear_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                ObjectEventType.objects.get_pk_for_title(obj.title), obj.pk)
+        # The first miss loads all types.
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ObjectEventType.objects.get_pk_for_title(other.title),
+                other.pk)
+
 
 class ObjectEventTestCase(TestCase):
     """Tests for the ``ObjectEvent`` model class."""
@@ -39,6 +122,146 @@ class ObjectEventTestCase(TestCase):
                                          event_content_object)
         self.assertEqual(event.event_content_object, event_content_object)
 
+    @skipUnless(connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and sqlite_version_info >= (3, 35)),
+        'The database does not support INSERT ... RETURNING.')
+    def test_insert_returning(self):
+        users = [UserFactory(), UserFactory()]
+        chunk = [ObjectEvent(
+            user=user, content_object=user,
+            event_type_id=ObjectEventType.objects.get_pk_for_title('foo'))
+            for user in users]
+        ObjectEvent._insert_returning(chunk, connection)
+        self.assertEqual(
+            [ObjectEvent.objects.get(pk=obj.pk).user for obj in chunk], users)
+        self.assertIsNotNone(ObjectEvent.objects.get(
+            pk=chunk[0].pk).creation_date)
+        with CaptureQueriesContext(connection) as queries:
+            pks = ObjectEvent.create_events(
+                (user, user, None, 'foo') for user in users * 10)
+        self.assertEqual(
+            [ObjectEvent.objects.get(pk=pk).user for pk in pks], users * 10)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('INSERT')]), 1, msg=(
+            'Should insert the chunk with one statement.'))
+
+    def test_coalesce_event(self):
+        user = UserFactory()
+        content_object = UserFactory()
+        COALESCE_WINDOWS['edit'] = 60
+        try:
+            event = ObjectEvent.create_event(
+                user, content_object, event_type='edit')
+            self.assertEqual(event.coalesced_count, 1)
+            same_event = ObjectEvent.create_event(
+                user, content_object, event_type='edit')
+            self.assertEqual(same_event.pk, event.pk)
+            self.assertEqual(same_event.coalesced_count, 2)
+            self.assertEqual(ObjectEvent.objects.get().coalesced_count, 2)
+            self.assertTrue(ObjectEvent.objects.get().last_seen)
+            self.assertEqual(
+                ObjectEventUserState.objects.get_unread_count(user), 1, msg=(
+                    'Coalesced events should not be counted as unread.'))
+
+            # Other objects, types and users get their own events
+            ObjectEvent.create_event(user, user, event_type='edit')
+            ObjectEvent.create_event(user, content_object, event_type='foo')
+            ObjectEvent.create_event(
+                content_object, content_object, event_type='edit')
+            self.assertEqual(ObjectEvent.objects.count(), 4)
+
+            # Read events and events outside of the window aren't reused
+            ObjectEvent.objects.filter(pk=event.pk).update(read_by_user=True)
+            new_event = ObjectEvent.create_event(
+                user, content_object, event_type='edit')
+            self.assertNotEqual(new_event.pk, event.pk)
+            ObjectEvent.objects.filter(pk=new_event.pk).update(
+                creation_date=now() - timedelta(seconds=61))
+            self.assertNotEqual(ObjectEvent.create_event(
+                user, content_object, event_type='edit').pk, new_event.pk)
+        finally:
+            del COALESCE_WINDOWS['edit']
+
+    def test_coalesce_events(self):
+        user = UserFactory()
+        content_object = UserFactory()
+        COALESCE_WINDOWS['edit'] = 60
+        try:
+            event = ObjectEvent.create_event(
+                user, content_object, event_type='edit')
+            with CaptureQueriesContext(connection) as queries:
+                pks = ObjectEvent.create_events([
+                    (user, content_object, None, 'edit'),
+                    (user, user, None, 'edit'),
+                    (user, user, None, 'edit'),
+                    (user, content_object, None, 'foo'),
+                ])
+            self.assertEqual(len([
+                query for query in queries.captured_queries
+                if query['sql'].startswith(
+                    'SELECT "object_events_objectevent"."id"')]), 1, msg=(
+                        'Should look up the recent events once per user and'
+                        ' type.'))
+            self.assertEqual(pks[0], event.pk, msg=(
+                'Should merge the event into the recent one.'))
+            self.assertEqual(pks[1], pks[2], msg=(
+                'Should merge the events of the same chunk.'))
+            self.assertEqual(ObjectEvent.objects.count(), 3)
+            self.assertEqual(ObjectEvent.objects.get(
+                pk=event.pk).coalesced_count, 2)
+            self.assertEqual(ObjectEvent.objects.get(
+                pk=pks[1]).coalesced_count, 2)
+            self.assertEqual(
+                ObjectEventUserState.objects.get_unread_count(user), 3)
+            ObjectEvent.create_events_for_users(
+                [user], content_object, event_type='edit')
+            self.assertEqual(ObjectEvent.objects.get(
+                pk=event.pk).coalesced_count, 3, msg=(
+                    'Should coalesce the events for several users as well.'))
+        finally:
+            del COALESCE_WINDOWS['edit']
+
+    def test_enqueue_event(self):
+        user = UserFactory()
+        event = ObjectEvent.enqueue_event(user, user, event_type='foo')
+        self.assertEqual(event.event_type.title, 'foo', msg=(
+            'Should create the event right away, if write-behind is off.'))
+
+    def test_create_events(self):
+        user = UserFactory()
+        other_user = UserFactory()
+        content_object = UserFactory()
+        event_content_object = UserFactory()
+        ids = ObjectEvent.create_events([
+            (user, content_object),
+            (other_user.pk, content_object, event_content_object, 'foo'),
+            (None, content_object, None, 'foo', 'bar'),
+        ], batch_size=2)
+        self.assertEqual(len(ids), 3, msg=(
+            'Should return the ids of all created events.'))
+        self.assertEqual(set(ids), set(
+            ObjectEvent.objects.values_list('pk', flat=True)))
+        self.assertEqual(
+            ObjectEvent.objects.get(pk=ids[1]).user, other_user, msg=(
+                'Should return the ids in the order of the events.'))
+        self.assertEqual(ObjectEventType.objects.all().count(), 2)
+        event = ObjectEvent.objects.get(user=other_user)
+        self.assertEqual(event.content_object, content_object)
+        self.assertEqual(event.event_content_object, event_content_object)
+        self.assertEqual(event.event_type.title, 'foo')
+        self.assertEqual(
+            ObjectEvent.objects.get(user__isnull=True).additional_text, 'bar')
+
+    def test_create_events_for_users(self):
+        UserFactory.create_batch(3)
+        content_object = UserFactory()
+        ids = ObjectEvent.create_events_for_users(
+            User.objects.exclude(pk=content_object.pk), content_object,
+            event_type='foo', batch_size=2)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ObjectEvent.objects.filter(
+            event_type__title='foo', object_id=content_object.pk).count(), 3)
+
     def test_get_timesince(self):
         # Just created object_event
         object_event = ObjectEventFactory()
@@ -59,6 +282,315 @@ class ObjectEventTestCase(TestCase):
             object_event.creation_date, 'd F Y'))
 
 
+class ObjectEventQuerySetTestCase(TestCase):
+    """Tests for the ``ObjectEventQuerySet`` queryset class."""
+    def test_with_related(self):
+        for i in range(3):
+            ObjectEventFactory()
+        ObjectEventFactory(content_object=UserFactory(),
+                           event_content_object=UserFactory())
+        # One query for the events, two for the content objects (two content
+        # types) and one for the event content objects.
+        with self.assertNumQueries(4):
+            for event in ObjectEvent.objects.with_related():
+                self.assertTrue(event.content_object)
+                self.assertTrue(event.user)
+                self.assertTrue(event.event_type)
+                event.event_content_object
+
+    def test_recent(self):
+        event = ObjectEventFactory()
+        old_event = ObjectEventFactory()
+        ObjectEvent.objects.filter(pk=old_event.pk).update(
+            creation_date=now() - timedelta(days=10))
+        self.assertEqual(list(ObjectEvent.objects.recent(days=5)), [event])
+        self.assertEqual(ObjectEvent.objects.recent().count(), 2, msg=(
+            'Should return all events, if no lookback is set.'))
+        self.assertIn(old_event, ObjectEvent.objects.recent(days=30))
+
+
+class ObjectEventUserStateTestCase(TestCase):
+    """Tests for the ``ObjectEventUserState`` model class."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+
+    def test_model(self):
+        """Should be able to instantiate and save the model."""
+        obj = ObjectEventUserStateFactory()
+        self.assertTrue(obj.pk)
+
+    def test_get_unread_count(self):
+        ObjectEventFactory(user=self.user)
+        ObjectEventFactory(user=self.user, read_by_user=True)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 1,
+            msg='Should count the unread events, if there is no state.')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                ObjectEventUserState.objects.get_unread_count(self.user), 1,
+                msg='Should only read the state.')
+
+    def test_counter_maintenance(self):
+        content_object = UserFactory()
+        ObjectEventUserState.objects.get_unread_count(self.user)
+        ObjectEvent.create_event(self.user, content_object)
+        ObjectEvent.create_events([
+            (self.user, content_object),
+            (self.user, content_object),
+            (content_object, content_object),
+        ])
+        ObjectEvent.create_events_for_users([self.user], content_object)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 4)
+        ObjectEventUserState.objects.decrement(self.user, 3)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 1)
+        version = ObjectEventUserState.objects.get(user=self.user).version
+        ObjectEventUserState.objects.decrement(self.user, 2)
+        state = ObjectEventUserState.objects.get(user=self.user)
+        self.assertEqual(state.unread_count, 0, msg=(
+            'Should stop at zero instead of keeping a stale count.'))
+        self.assertGreater(state.version, version)
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 0)
+
+    def test_rebuild(self):
+        other_user = UserFactory()
+        ObjectEventUserStateFactory(user=self.user, unread_count=5)
+        ObjectEventUserStateFactory(user=other_user, unread_count=0)
+        ObjectEventFactory(user=other_user)
+        ObjectEventFactory(user=UserFactory())
+        self.assertEqual(ObjectEventUserState.objects.rebuild(), 3)
+        self.assertEqual(dict(ObjectEventUserState.objects.values_list(
+            'user', 'unread_count')), {
+                self.user.pk: 0, other_user.pk: 1,
+                ObjectEvent.objects.latest('pk').user_id: 1})
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=self.user).version, 1, msg=(
+                'Should bump the versions of the changed states, so that the'
+                ' ETags change.'))
+        self.assertEqual(ObjectEventUserState.objects.rebuild(), 0)
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=self.user).version, 1)
+
+
+class WatermarkTestCase(TestCase):
+    """Tests for the ``last_read_at`` watermark of the users."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.old_event = ObjectEventFactory(user=self.user)
+        self.audience_event = ObjectEvent.create_audience_event(
+            'all', self.user)
+
+    def test_mark_all_read(self):
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        with self.assertNumQueries(1):
+            ObjectEventUserState.objects.mark_all_read(self.user)
+        new_event = ObjectEventFactory(user=self.user)
+        ObjectEventUserState.objects.increment([self.user.pk])
+        self.assertEqual(
+            list(ObjectEvent.objects.unread(self.user)), [new_event], msg=(
+                'Should only count events after the watermark as unread.'))
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 1)
+        self.assertFalse(
+            ObjectEvent.objects.get(pk=self.old_event.pk).read_by_user,
+            msg='Should not touch the events.')
+
+    def test_mark_read_before_watermark(self):
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        ObjectEventUserState.objects.filter(user=self.user).update(
+            unread_count=1)
+        self.assertEqual(ObjectEvent.objects.mark_read(
+            self.user, [self.old_event.pk, self.audience_event.pk]), 0, msg=(
+                'Events before the watermark are read already.'))
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=self.user).unread_count, 1)
+
+    def test_mark_unread(self):
+        middle_event = ObjectEventFactory(user=self.user)
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        new_event = ObjectEvent.create_event(self.user, self.user)
+        ObjectEvent.objects.mark_read(self.user, [new_event.pk])
+        self.assertEqual(ObjectEvent.objects.mark_unread(
+            self.user, [new_event.pk, self.audience_event.pk]), 2)
+        self.assertEqual(
+            set(ObjectEvent.objects.unread(self.user)),
+            set([new_event, self.audience_event]), msg=(
+                'Should move the watermark, but keep the events in between'
+                ' read.'))
+        self.assertTrue(ObjectEvent.objects.get(
+            pk=middle_event.pk).read_by_user)
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=self.user).unread_count, 2)
+        self.assertEqual(ObjectEvent.objects.mark_unread(
+            self.user, [new_event.pk, self.audience_event.pk]), 0, msg=(
+                'Should not mark unread events again.'))
+        ObjectEvent.objects.mark_read(
+            self.user, [new_event.pk, self.audience_event.pk])
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 0)
+
+    def test_load_read_state(self):
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        new_event = ObjectEventFactory(user=self.user)
+        events = load_read_state(
+            list(ObjectEvent.objects.for_user(self.user)), self.user)
+        self.assertEqual(
+            dict((event.pk, event.read_by_user) for event in events), {
+                new_event.pk: False,
+                self.old_event.pk: True,
+                self.audience_event.pk: True,
+            })
+
+    def test_rebuild(self):
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        ObjectEventFactory(user=self.user)
+        ObjectEventUserState.objects.filter(user=self.user).update(
+            unread_count=5)
+        ObjectEventUserState.objects.rebuild()
+        self.assertEqual(ObjectEventUserState.objects.get(
+            user=self.user).unread_count, 1, msg=(
+                'Should only count the events after the watermark.'))
+
+
+class AudienceEventTestCase(TestCase):
+    """Tests for events, that are meant for an audience."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.other_user = UserFactory()
+        self.group = Group.objects.create(name='staff')
+        self.user.groups.add(self.group)
+        self.content_object = UserFactory()
+
+    def test_create_audience_event(self):
+        event = ObjectEvent.create_audience_event(
+            'group', self.content_object, event_type='news', group=self.group)
+        self.assertEqual(ObjectEvent.objects.count(), 1, msg=(
+            'Should store the event only once.'))
+        self.assertIsNone(event.user)
+        self.assertEqual(event.audience_group, self.group)
+
+    @raises(ValueError)
+    def test_create_audience_event_without_group(self):
+        ObjectEvent.create_audience_event('group', self.content_object)
+
+    @raises(ValueError)
+    def test_create_audience_event_unknown_audience(self):
+        ObjectEvent.create_audience_event('friends', self.content_object)
+
+    def test_for_user(self):
+        own = ObjectEventFactory(user=self.user)
+        ObjectEventFactory(user=self.other_user)
+        everybody = ObjectEvent.create_audience_event(
+            'all', self.content_object)
+        group = ObjectEvent.create_audience_event(
+            'group', self.content_object, group=self.group)
+        followers = ObjectEvent.create_audience_event(
+            'followers', self.content_object)
+        ObjectEvent.create_audience_event('followers', self.other_user)
+        ObjectEventSubscription.objects.subscribe(
+            self.user, self.content_object)
+        ObjectEventSubscription.objects.subscribe(
+            self.user, self.content_object)
+        self.assertEqual(
+            set(ObjectEvent.objects.for_user(self.user)),
+            set([own, everybody, group, followers]), msg=(
+                'Should return the own events and the audience events of the'
+                ' user.'))
+        self.assertEqual(
+            set(ObjectEvent.objects.for_user(self.other_user)),
+            set([self.other_user.object_events.get(), everybody]), msg=(
+                'Should not return the events of other groups and objects.'))
+        ObjectEventSubscription.objects.unsubscribe(
+            self.user, self.content_object)
+        self.assertNotIn(
+            followers, ObjectEvent.objects.for_audience(self.user))
+
+    def test_for_user_joined_later(self):
+        ObjectEvent.create_audience_event('all', self.content_object)
+        self.user.date_joined = now() + timedelta(minutes=1)
+        self.assertFalse(ObjectEvent.objects.for_audience(self.user), msg=(
+            'Should not return events from before the user joined.'))
+
+    def test_mark_read(self):
+        ObjectEventFactory(user=self.user)
+        event = ObjectEvent.create_audience_event('all', self.content_object)
+        ObjectEvent.create_audience_event('all', self.content_object)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 3)
+        self.assertEqual(
+            ObjectEvent.objects.mark_read(self.user, [event.pk]), 1)
+        self.assertEqual(
+            ObjectEvent.objects.mark_read(self.user, [event.pk]), 0,
+            msg='Should not mark an event twice.')
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 2)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.other_user), 2,
+            msg='Should keep the read state per user.')
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 0)
+        self.assertEqual(ObjectEventReadMarker.objects.count(), 1, msg=(
+            'Should not create markers, when marking all events.'))
+
+    def test_load_read_state(self):
+        read = ObjectEvent.create_audience_event('all', self.content_object)
+        unread = ObjectEvent.create_audience_event('all', self.content_object)
+        ObjectEventReadMarker.objects.mark(self.user, [read.pk])
+        events = list(ObjectEvent.objects.for_user(self.user))
+        state = ObjectEventUserState.objects.get_for_user(self.user)
+        with self.assertNumQueries(1):
+            load_read_state(events, self.user, state)
+        self.assertEqual(
+            dict((event.pk, event.read_by_user) for event in events),
+            {read.pk: True, unread.pk: False})
+
+    def test_unread_count(self):
+        ObjectEventUserState.objects.get_for_user(self.user)
+        ObjectEventUserState.objects.get_for_user(self.other_user)
+        ObjectEvent.create_audience_event(
+            'group', self.content_object, group=self.group)
+        ObjectEvent.create_audience_event('all', self.content_object)
+        followers = [
+            ObjectEvent.create_audience_event(
+                'followers', self.content_object) for i in range(2)]
+        self.assertEqual(dict(ObjectEventUserState.objects.values_list(
+            'user', 'unread_count')), {self.user.pk: 2, self.other_user.pk: 1},
+            msg='Should increment the counters of the audience.')
+        ObjectEventSubscription.objects.subscribe(
+            self.user, self.content_object)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 4, msg=(
+                'Should add the events of the followed object.'))
+        self.assertEqual(
+            set(ObjectEvent.objects.for_audience(self.user).filter(
+                audience='followers')), set(followers))
+        ObjectEvent.objects.mark_read(self.user, [followers[0].pk])
+        ObjectEvent.create_audience_event('followers', self.content_object)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 4)
+        self.assertEqual(ObjectEventUserState.objects.rebuild(), 0, msg=(
+            'Should have kept the counters up to date.'))
+        ObjectEventSubscription.objects.unsubscribe(
+            self.user, self.content_object)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 2, msg=(
+                'Should subtract the unread events of the followed object.'))
+        new_user = UserFactory(date_joined=now() - timedelta(days=1))
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(new_user), 1,
+            msg='Should count the audience events for a new state.')
+
+
 class UserAggregationBaseTestCase(TestCase):
     """Tests for the ``UserAggregationBase`` aggregation class."""
     @raises(NotImplementedError)
@@ -76,3 +608,26 @@ class UserAggregationBaseTestCase(TestCase):
     @raises(NotImplementedError)
     def test_get_monthly_users(self):
         UserAggregationBase().get_users('monthly')
+
+    def test_get_recipients(self):
+        user = UserFactory()
+
+        class Aggregation(UserAggregationBase):
+            def get_daily_users(self):
+                return [user.pk]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Aggregation().get_recipients('daily'), [
+                Recipient(user.pk, user.email, None, 'daily')])
+
+
+class UserAggregationTestCase(TestCase):
+    """Tests for the ``UserAggregation`` aggregation class."""
+    def test_get_recipients(self):
+        profile = TestProfileFactory(interval='daily', language='de')
+        TestProfileFactory(interval='weekly')
+        aggregation = UserAggregation()
+        with self.assertNumQueries(1):
+            self.assertEqual(aggregation.get_recipients('daily'), [
+                Recipient(profile.user.pk, profile.user.email, 'de',
+                          'daily')])
@@ -0,0 +1,67 @@
+"""Tests for the pagination helpers of the ``object_events`` app."""
+from django.test import TestCase
+from django.utils.timezone import now, timedelta
+
+from django_libs.tests.factories import UserFactory
+from nose.tools import raises
+
+from ..models import ObjectEvent
+from ..pagination import decode_cursor, encode_cursor, paginate_by_cursor
+from .factories import ObjectEventFactory
+
+
+class CursorTestCase(TestCase):
+    """Tests for the ``encode_cursor`` and ``decode_cursor`` functions."""
+    def test_cursor(self):
+        event = ObjectEventFactory()
+        self.assertEqual(decode_cursor(encode_cursor(event)),
+                         (event.creation_date, event.pk))
+
+    @raises(ValueError)
+    def test_invalid_cursor(self):
+        decode_cursor('foo')
+
+
+class PaginateByCursorTestCase(TestCase):
+    """Tests for the ``paginate_by_cursor`` function."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        date = now() - timedelta(hours=1)
+        # Two events share their creation date to test the pk tie-breaker.
+        self.events = [ObjectEventFactory(user=self.user) for i in range(5)]
+        for i, event in enumerate(self.events):
+            event.creation_date = date + timedelta(minutes=i // 2)
+            event.save()
+        self.events.reverse()
+        self.queryset = ObjectEvent.objects.filter(user=self.user)
+
+    def test_paginate_by_cursor(self):
+        page = paginate_by_cursor(self.queryset, 2)
+        self.assertEqual(page.object_list, self.events[:2])
+        self.assertIsNone(page.previous_cursor)
+
+        page = paginate_by_cursor(self.queryset, 2, after=page.next_cursor)
+        self.assertEqual(page.object_list, self.events[2:4])
+
+        # New events don't shift the following pages
+        ObjectEventFactory(user=self.user)
+        last_page = paginate_by_cursor(
+            self.queryset, 2, after=page.next_cursor)
+        self.assertEqual(last_page.object_list, self.events[4:])
+        self.assertIsNone(last_page.next_cursor)
+
+        page = paginate_by_cursor(
+            self.queryset, 2, before=last_page.previous_cursor)
+        self.assertEqual(page.object_list, self.events[2:4])
+        page = paginate_by_cursor(
+            self.queryset, 2, before=page.previous_cursor)
+        self.assertEqual(page.object_list, self.events[:2], msg=(
+            'Should return the first page again.'))
+        self.assertIsNotNone(page.previous_cursor, msg=(
+            'The event that was created in the meantime precedes this page.'))
+
+    def test_empty(self):
+        self.assertEqual(paginate_by_cursor(ObjectEvent.objects.none(), 2),
+                         ([], None, None))
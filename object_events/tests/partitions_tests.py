@@ -0,0 +1,45 @@
+"""Tests for the partitions of the ``object_events`` app."""
+from datetime import date, datetime
+
+from django.db import connection
+from django.test import TestCase
+
+from ..models import ObjectEventReadMarker
+from ..partitions import (
+    TABLE,
+    add_months,
+    get_create_statement,
+    get_drop_statements,
+    get_month,
+    get_partition_name,
+)
+
+
+class PartitionsTestCase(TestCase):
+    """Tests for the helpers of the ``partitions`` module."""
+    longMessage = True
+
+    def test_get_month(self):
+        self.assertEqual(get_month(datetime(2026, 10, 17, 12)),
+                         date(2026, 10, 1))
+        self.assertEqual(get_month(date(2026, 10, 17)), date(2026, 10, 1))
+
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2026, 10, 1), 3), date(2027, 1, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(add_months(date(2026, 12, 1), 0), date(2026, 12, 1))
+
+    def test_get_create_statement(self):
+        self.assertEqual(get_partition_name(date(2026, 2, 1)),
+                         '{0}_p202602'.format(TABLE))
+        statement = get_create_statement(connection, date(2026, 12, 1))
+        self.assertIn('{0}_p202612'.format(TABLE), statement)
+        self.assertIn("FROM ('2026-12-01 00:00:00", statement)
+        self.assertIn("TO ('2027-01-01 00:00:00", statement, msg=(
+            'Should cover exactly one month.'))
+
+    def test_get_drop_statements(self):
+        statements = get_drop_statements(connection, 'foo')
+        self.assertIn(ObjectEventReadMarker._meta.db_table, statements[0],
+                      msg='Should delete the read markers first.')
+        self.assertTrue(statements[-1].startswith('DROP TABLE'))
@@ -0,0 +1,131 @@
+"""Tests for the query plans of the ``object_events`` app."""
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_libs.tests.factories import UserFactory
+
+from ..models import ObjectEvent, ObjectEventUserState
+from ..storage import ModelStorage
+from .factories import ObjectEventFactory
+
+
+class QueryPlanTestMixin(object):
+    """
+    Asserts that the hot queries can be answered using an index.
+
+    The querysets are built by the methods, that run them in production.
+
+    """
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.storage = ModelStorage()
+        for i in range(3):
+            ObjectEventFactory(user=self.user)
+            ObjectEventFactory(user=self.user, read_by_user=True,
+                               email_sent=True)
+
+    def get_plan(self, sql, params=None):
+        raise NotImplementedError
+
+    def assertPlanUsesIndex(self, plan, sort=False):
+        raise NotImplementedError
+
+    def assertUsesIndex(self, queryset, sort=False):
+        """
+        Asserts that the queryset is answered with an index.
+
+        :param sort: Allows to sort the found rows, e.g. if they come from
+          several indexes.
+
+        """
+        self.assertPlanUsesIndex(
+            self.get_plan(*queryset.query.sql_with_params()), sort)
+
+    def assertQueriesUseIndex(self, func, sort=False):
+        """Asserts that every query of ``func`` on the events uses an index."""
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        table = connection.ops.quote_name(ObjectEvent._meta.db_table)
+        statements = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('SELECT', 'UPDATE')) and
+            table in query['sql']]
+        self.assertTrue(statements, msg='Should query the events.')
+        for sql in statements:
+            self.assertPlanUsesIndex(self.get_plan(sql), sort)
+
+    def test_list_query(self):
+        page = self.storage.paginate(self.user, 2)
+        self.assertQueriesUseIndex(
+            lambda: self.storage.paginate(self.user, 2))
+        self.assertQueriesUseIndex(lambda: self.storage.paginate(
+            self.user, 2, after=page.next_cursor))
+
+    def test_feed_query(self):
+        self.assertQueriesUseIndex(
+            lambda: self.storage.get_feed(self.user, 2))
+
+    def test_unread_query(self):
+        pks = list(ObjectEvent.objects.values_list('pk', flat=True))
+        self.assertUsesIndex(
+            ObjectEvent.objects.unread(self.user).order_by('-pk'))
+        self.assertQueriesUseIndex(
+            lambda: ObjectEvent.objects.mark_read(self.user, pks[:2]))
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        # The same queries with a watermark
+        self.assertUsesIndex(
+            ObjectEvent.objects.unread(self.user).order_by('-pk'))
+        self.assertQueriesUseIndex(
+            lambda: ObjectEvent.objects.mark_read(self.user, pks))
+
+    def test_digest_query(self):
+        other_user = UserFactory()
+        ObjectEventFactory(user=other_user)
+        user_pks = [self.user.pk, other_user.pk]
+        self.assertQueriesUseIndex(lambda: list(self.storage._iter_events(
+            ObjectEvent.objects.recent().filter(
+                email_sent=False, user__pk__in=user_pks), 2)))
+        self.assertQueriesUseIndex(lambda: self.storage._claim_events(
+            user_pks, 2, 'token', 60))
+        claimed = self.storage._claim_events(user_pks, 2, 'token', 60)
+        self.assertQueriesUseIndex(
+            lambda: list(self.storage._iter_events(claimed, 2)))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Needs SQLite.')
+class SQLiteQueryPlanTestCase(QueryPlanTestMixin, TestCase):
+    """Query plan tests for SQLite."""
+    def get_plan(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertPlanUsesIndex(self, plan, sort=False):
+        self.assertIn('USING', plan, msg=plan)
+        for line in plan.splitlines():
+            if 'object_events_objectevent' in line:
+                self.assertIn('SEARCH', line, msg=(
+                    'Should not scan the whole table:\n' + plan))
+        if not sort:
+            self.assertNotIn('TEMP B-TREE', plan, msg=(
+                'Should not sort the rows in a temporary table:\n' + plan))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL.')
+class PostgreSQLQueryPlanTestCase(QueryPlanTestMixin, TestCase):
+    """Query plan tests for PostgreSQL."""
+    def get_plan(self, sql, params=None):
+        with connection.cursor() as cursor:
+            # The test tables are tiny, so sequential scans are always cheap.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def assertPlanUsesIndex(self, plan, sort=False):
+        self.assertIn('Index', plan, msg=plan)
+        self.assertNotIn('Seq Scan', plan, msg=plan)
@@ -0,0 +1,257 @@
+"""Tests for the storage backends of the ``object_events`` app."""
+from django.contrib.auth.models import Group
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_libs.tests.factories import UserFactory
+from nose.tools import raises
+
+from .. import app_settings, storage
+from ..models import ObjectEvent, ObjectEventSubscription
+from ..storage import BaseStorage, MemoryStorage, ModelStorage, get_storage
+from .factories import DummyModelFactory, ObjectEventFactory
+
+
+class ModelStorageTestCase(TestCase):
+    """Tests for the ``ModelStorage`` class."""
+    longMessage = True
+
+    def setUp(self):
+        self.storage = ModelStorage()
+        self.user = UserFactory()
+        self.events = [
+            ObjectEvent.create_event(self.user, DummyModelFactory(),
+                                     event_type='comment')
+            for i in range(3)]
+
+    def test_get_feed(self):
+        feed = self.storage.get_feed(self.user, 2)
+        self.assertEqual([event.pk for event in feed.events],
+                         [self.events[2].pk, self.events[1].pk])
+        self.assertEqual(feed.unread_count, 3)
+        feed = self.storage.get_feed(self.user, 10, since=self.events[1].pk)
+        self.assertEqual(feed.events, [self.events[2]], msg=(
+            'Should only return events with a higher pk.'))
+        feed = self.storage.get_feed(self.user, 1, since=self.events[0].pk)
+        self.assertEqual(feed.events, [self.events[1]], msg=(
+            'Should return the oldest events after since.'))
+
+    def test_mark(self):
+        version = self.storage.get_version(self.user)
+        self.assertEqual(
+            self.storage.mark_read(self.user, [self.events[0].pk]), 1)
+        self.assertEqual(self.storage.get_unread_count(self.user), 2)
+        self.assertNotEqual(self.storage.get_version(self.user), version)
+        self.storage.mark_all_read(self.user)
+        self.assertEqual(self.storage.get_unread_count(self.user), 0)
+        self.assertTrue(self.storage.has_event(self.user, self.events[0].pk))
+        self.assertFalse(self.storage.has_event(
+            UserFactory(), self.events[0].pk))
+
+    def test_get_version(self):
+        version = self.storage.get_version(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.storage.get_version(self.user), version)
+        ObjectEvent.create_event(self.user, DummyModelFactory(),
+                                 event_type='comment')
+        self.assertNotEqual(self.storage.get_version(self.user), version, msg=(
+            'Should change, when an event is created.'))
+        version = self.storage.get_version(self.user)
+        self.storage.mark_all_read(self.user)
+        self.assertNotEqual(self.storage.get_version(self.user), version, msg=(
+            'Should change, when the events are marked.'))
+
+    def test_get_latest_pk(self):
+        self.assertEqual(self.storage.get_latest_pk(), self.events[2].pk)
+
+    def test_digests(self):
+        digests = list(self.storage.get_digests([self.user.pk], 2))
+        self.assertEqual(digests, [(self.user, self.events)])
+        self.storage.mark_sent(self.user, self.events)
+        self.assertEqual(list(self.storage.get_digests([self.user.pk], 2)),
+                         [])
+
+    def test_audience_digests(self):
+        content_object = DummyModelFactory()
+        group = Group.objects.create(name='staff')
+        follower, member = UserFactory(), UserFactory()
+        member.groups.add(group)
+        ObjectEventSubscription.objects.subscribe(follower, content_object)
+        everybody = ObjectEvent.create_audience_event('all', content_object)
+        followers = ObjectEvent.create_audience_event(
+            'followers', content_object)
+        staff = ObjectEvent.create_audience_event(
+            'group', content_object, group=group)
+        users = [self.user, follower, member]
+        user_pks = [user.pk for user in users]
+        with CaptureQueriesContext(connection) as queries:
+            digests = list(self.storage.get_digests(user_pks, 10))
+        self.assertEqual(digests, [
+            (self.user, self.events + [everybody]),
+            (follower, [everybody, followers]),
+            (member, [everybody, staff]),
+        ])
+        for user in [UserFactory() for i in range(3)]:
+            ObjectEventSubscription.objects.subscribe(user, content_object)
+            ObjectEvent.create_event(user, DummyModelFactory())
+            user_pks.append(user.pk)
+        with self.assertNumQueries(len(queries)):
+            # Own events and audience events are fetched per chunk, not per
+            # user.
+            self.assertEqual(len(list(self.storage.get_digests(
+                user_pks, 10))), 6)
+        for user, events in digests:
+            self.storage.mark_sent(user, events)
+        with self.assertNumQueries(3):
+            # The member has been sent the newest audience event, so the
+            # second pass is skipped.
+            self.assertEqual(
+                list(self.storage.get_digests([member.pk], 10)), [])
+
+    def test_claim_events(self):
+        users = [UserFactory(), UserFactory()]
+        for user in users:
+            ObjectEvent.create_event(user, user)
+        user_pks = [self.user.pk] + [user.pk for user in users]
+        claimed = self.storage._claim_events(user_pks, 2, 'token', 60)
+        self.assertEqual(set(claimed), set(self.events), msg=(
+            'Should claim a user with more events than the chunk size'
+            ' alone.'))
+        claimed = self.storage._claim_events(user_pks, 2, 'token', 60)
+        self.assertEqual(set(event.user for event in claimed), set(users),
+                         msg='Should claim users up to the chunk size.')
+        self.assertIsNone(
+            self.storage._claim_events(user_pks, 2, 'token', 60))
+
+
+class MemoryStorageTestCase(TestCase):
+    """Tests for the ``MemoryStorage`` class."""
+    longMessage = True
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.user = UserFactory()
+        self.content_object = DummyModelFactory()
+        self.events = [
+            self.storage.create_event(self.user, self.content_object,
+                                      event_type='comment')
+            for i in range(3)]
+
+    def test_create_event(self):
+        self.assertEqual([event.pk for event in self.events], [1, 2, 3])
+        self.assertEqual(self.events[0].event_type.title, 'comment')
+        self.assertEqual(self.events[0].content_object, self.content_object)
+        self.assertEqual(ObjectEvent.objects.count(), 0, msg=(
+            'Should not touch the database.'))
+        self.assertEqual(self.storage.create_events(
+            [(self.user.pk, self.content_object)]), [4])
+
+    def test_get_feed(self):
+        feed = self.storage.get_feed(self.user, 2)
+        self.assertEqual(feed.events, [self.events[2], self.events[1]])
+        self.assertEqual(feed.unread_count, 3)
+        self.assertEqual(self.storage.get_feed(self.user, 10, since=2).events,
+                         [self.events[2]])
+        self.assertEqual(self.storage.get_feed(self.user, 1, since=1).events,
+                         [self.events[1]])
+        self.assertEqual(self.storage.get_feed(UserFactory(), 10),
+                         ([], 0))
+
+    def test_paginate(self):
+        page = self.storage.paginate(self.user, 2)
+        self.assertEqual(page.object_list, [self.events[2], self.events[1]])
+        page = self.storage.paginate(self.user, 2, after=page.next_cursor)
+        self.assertEqual(page.object_list, [self.events[0]])
+        self.assertIsNone(page.next_cursor)
+
+    def test_mark(self):
+        version = self.storage.get_version(self.user)
+        self.assertEqual(self.storage.mark_read(self.user, [1, 2, 4]), 2)
+        self.assertEqual(self.storage.mark_read(self.user, [1]), 0, msg=(
+            'Should not count events, that were read already.'))
+        self.assertEqual(self.storage.get_unread_count(self.user), 1)
+        self.assertNotEqual(self.storage.get_version(self.user), version)
+        self.storage.mark_all_read(self.user)
+        self.assertEqual(self.storage.get_unread_count(self.user), 0)
+        self.assertEqual(self.storage.mark_unread(self.user, [3]), 1)
+        self.assertEqual(self.storage.get_unread_count(self.user), 1, msg=(
+            'Should keep the older events read.'))
+        self.assertEqual(
+            [event.read_by_user for event in self.storage.get_feed(
+                self.user, 10).events], [False, True, True])
+
+    def test_get_latest_pk(self):
+        self.assertEqual(self.storage.get_latest_pk(), 3)
+        self.assertIsNone(MemoryStorage().get_latest_pk())
+
+    def test_digests(self):
+        self.storage.mark_read(self.user, [1])
+        self.assertEqual(list(self.storage.get_digests([self.user.pk], 10)),
+                         [(self.user, self.events)])
+        self.storage.mark_sent(self.user, self.events)
+        self.assertEqual(list(self.storage.get_digests([self.user.pk], 10)),
+                         [])
+
+
+class StorageViewsTestCase(TestCase):
+    """Tests for the views with the ``MemoryStorage``."""
+    longMessage = True
+
+    def setUp(self):
+        self.storage_path = app_settings.STORAGE
+        app_settings.STORAGE = 'object_events.storage.MemoryStorage'
+        storage._storage = None
+        self.user = UserFactory()
+        self.event = ObjectEvent.create_event(self.user, DummyModelFactory())
+        self.client.login(username=self.user.username, password='test123')
+
+    def tearDown(self):
+        app_settings.STORAGE = self.storage_path
+        storage._storage = None
+
+    def test_views(self):
+        self.assertEqual(ObjectEvent.objects.count(), 0)
+        resp = self.client.get(reverse('object_events_api_events'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([e['id'] for e in resp.json()['events']],
+                         [self.event.pk])
+        resp = self.client.post(reverse('object_events_api_mark'),
+                                data={'ids': str(self.event.pk)})
+        self.assertEqual(resp.json(), {'marked': 1, 'unread': 0})
+        resp = self.client.post(reverse('object_events_mark'),
+                                data={'single_mark': self.event.pk})
+        self.assertEqual(resp.status_code, 302, msg=(
+            'Should find the event in the storage.'))
+
+
+class GetStorageTestCase(TestCase):
+    """Tests for the ``get_storage`` function."""
+    def setUp(self):
+        self.storage_path = app_settings.STORAGE
+        storage._storage = None
+
+    def tearDown(self):
+        app_settings.STORAGE = self.storage_path
+        storage._storage = None
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(), ModelStorage)
+        self.assertIs(get_storage(), get_storage())
+
+    @raises(TypeError)
+    def test_wrong_storage(self):
+        app_settings.STORAGE = 'object_events.brokers.LocalMemoryBroker'
+        get_storage()
+
+
+class BaseStorageTestCase(TestCase):
+    """Tests for the ``BaseStorage`` interface."""
+    @raises(NotImplementedError)
+    def test_get_feed(self):
+        BaseStorage().get_feed(None, 1)
+
+    @raises(NotImplementedError)
+    def test_create_event(self):
+        BaseStorage().create_event(None, ObjectEventFactory())
@@ -1,12 +1,19 @@
 """Tests for tags of the ``object_events``` application."""
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import caches
 from django.template.context import RequestContext
+from django.db import connection
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone, translation
 
 from django_libs.tests.factories import UserFactory
 
+from .. import app_settings, brokers
+from ..cache import CSRF_TOKEN_PLACEHOLDER, NEXT_URL_PLACEHOLDER
+from ..models import ObjectEvent, ObjectEventUserState
 from ..templatetags.object_events_tags import render_notifications
 from .factories import ObjectEventFactory
 
@@ -30,3 +37,99 @@ class RenderNotificationsTestCase(TestCase):
         request.user = UserFactory()
         ObjectEventFactory(user=request.user)
         self.assertTrue(render_notifications(context))
+
+        # Reads the counter and fetches the latest own and audience
+        # notifications only (plus their content objects, one query per
+        # content type)
+        ObjectEventFactory(user=request.user)
+        ObjectEventFactory(user=request.user)
+        context = {'request': request}
+        render_notifications(context)
+        with self.assertNumQueries(4):
+            html = render_notifications(context)
+        self.assertIn('>3</span>', html)
+        self.assertIn(' ago</time>', html, msg=(
+            'Should render relative times without the cache.'))
+
+    def test_streaming(self):
+        request = RequestFactory().get('/')
+        request.user = UserFactory()
+        context = {'request': request}
+        self.assertNotIn('data-stream-url', render_notifications(context),
+                         msg='Should let the client poll by default.')
+        streaming, broker_path = app_settings.STREAMING, app_settings.BROKER
+        app_settings.STREAMING = True
+        app_settings.BROKER = (
+            'object_events.tests.brokers_tests.SharedBroker')
+        brokers._broker = None
+        try:
+            self.assertIn('data-stream-url', render_notifications(context))
+        finally:
+            app_settings.STREAMING = streaming
+            app_settings.BROKER = broker_path
+            brokers._broker = None
+
+
+class CachedRenderNotificationsTestCase(TestCase):
+    """Tests for the ``render_notifications`` tag with the fragment cache."""
+    longMessage = True
+
+    def setUp(self):
+        self.cache_alias = app_settings.NOTIFICATIONS_CACHE
+        app_settings.NOTIFICATIONS_CACHE = 'default'
+        caches['default'].clear()
+        self.user = UserFactory()
+        self.request = RequestFactory().get('/foo/?bar=1&baz=2')
+        self.request.user = self.user
+        self.context = {'request': self.request}
+        ObjectEvent.create_event(self.user, self.user)
+
+    def tearDown(self):
+        app_settings.NOTIFICATIONS_CACHE = self.cache_alias
+        caches['default'].clear()
+
+    def test_tag(self):
+        html = render_notifications(self.context)
+        self.assertIn('>1</span>', html)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_notifications(self.context), html, msg=(
+                'Should use the cached fragment, if nothing changed.'))
+        self.assertNotIn(CSRF_TOKEN_PLACEHOLDER, html)
+        self.assertNotIn(NEXT_URL_PLACEHOLDER, html)
+        self.assertIn('value="/foo/?bar=1&amp;baz=2"', html)
+        self.assertIn(self.request.META['CSRF_COOKIE'], html)
+        self.assertNotIn(' ago', html, msg=(
+            'Should not freeze the relative times in the cache.'))
+        self.assertIn('datetime="', html)
+
+    def test_language_and_timezone(self):
+        with translation.override('en'):
+            html = render_notifications(self.context)
+        with translation.override('de'):
+            self.assertNotEqual(render_notifications(self.context), html, msg=(
+                'Should not serve the fragment of another language.'))
+        tokyo = timezone.get_fixed_timezone(540)
+        with timezone.override(tokyo), translation.override('en'):
+            with CaptureQueriesContext(connection) as queries:
+                render_notifications(self.context)
+        self.assertTrue(queries.captured_queries, msg=(
+            'Should not serve the fragment of another timezone.'))
+        with translation.override('en'):
+            with self.assertNumQueries(0):
+                self.assertEqual(render_notifications(self.context), html)
+
+    def test_invalidation(self):
+        render_notifications(self.context)
+        event = ObjectEvent.create_event(self.user, self.user)
+        self.assertIn('>2</span>', render_notifications(self.context), msg=(
+            'Should render again after an event was created.'))
+        ObjectEvent.objects.mark_read(self.user, [event.pk])
+        self.assertIn('>1</span>', render_notifications(self.context), msg=(
+            'Should render again after an event was marked.'))
+        ObjectEvent.create_audience_event('all', self.user)
+        self.assertIn('>2</span>', render_notifications(self.context), msg=(
+            'Should render again after an audience event was created.'))
+        ObjectEventUserState.objects.mark_all_read(self.user)
+        self.assertIn('>0</span>', render_notifications(self.context))
+        self.assertIn('>0</span>', render_notifications(self.context, 3),
+                      msg='Should cache every amount on its own.')
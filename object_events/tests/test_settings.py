@@ -1,6 +1,7 @@
 """Settings that need to be set in order to run the tests."""
 import logging
 import os
+import tempfile
 
 logging.getLogger("factory").setLevel(logging.WARN)
 
@@ -19,6 +20,19 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'mailer_lock': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(
+            tempfile.gettempdir(), 'object_events_mailer_lock'),
+    },
+}
+
+OBJECT_EVENTS_MAILER_LOCK_CACHE = 'mailer_lock'
+
 ROOT_URLCONF = 'object_events.tests.urls'
 
 STATIC_URL = '/static/'
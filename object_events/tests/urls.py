@@ -8,6 +8,8 @@ from django.conf.urls import include, patterns, url
 from django.contrib import admin
 from django.views.generic import TemplateView
 
+from ..views import ObjectEventsListView
+
 
 admin.autodiscover()
 
@@ -16,5 +18,8 @@ urlpatterns = patterns(
     '',
     url(r'^admin/', include(admin.site.urls)),
     url(r'^notifications/', include('object_events.urls')),
+    url(r'^cursor-notifications/$',
+        ObjectEventsListView.as_view(cursor_pagination=True, paginate_by=2),
+        name='object_events_cursor_list'),
     url(r'^test/$', TemplateView.as_view(template_name='test_app/tag.html')),
 )
@@ -1,12 +1,26 @@
 """Tests for views of the ``object_events``` application."""
+import json
+
+from django.contrib.auth.models import Group
+from django.core.cache import caches
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 
 from django_libs.tests.factories import UserFactory
 from django_libs.tests.mixins import ViewTestMixin
 
 from .factories import ObjectEventFactory
-from ..models import ObjectEvent
+from .. import app_settings
+from ..brokers import get_broker
+from ..models import (
+    ObjectEvent,
+    ObjectEventReadMarker,
+    ObjectEventUserState,
+)
+from ..views import ObjectEventsStreamView
 
 
 class ObjectEventsListViewTestCase(ViewTestMixin, TestCase):
@@ -22,6 +36,51 @@ class ObjectEventsListViewTestCase(ViewTestMixin, TestCase):
     def test_view(self):
         self.should_be_callable_when_authenticated(self.user)
 
+    def test_audience_events(self):
+        ObjectEventFactory(user=self.user)
+        event = ObjectEvent.create_audience_event('all', self.user)
+        ObjectEventReadMarker.objects.mark(self.user, [event.pk])
+        self.login(self.user)
+        resp = self.client.get(self.get_url())
+        self.assertEqual(len(resp.context['object_list']), 2, msg=(
+            'Should list the own and the audience events of the user.'))
+        self.assertEqual(
+            [e.read_by_user for e in resp.context['object_list']],
+            [True, False], msg='Should show the read state of the user.')
+
+
+class ObjectEventsCursorListViewTestCase(ViewTestMixin, TestCase):
+    """Tests for the ``ObjectEventsListView`` view with cursor pagination."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.events = [ObjectEventFactory(user=self.user) for i in range(3)]
+
+    def get_view_name(self):
+        return 'object_events_cursor_list'
+
+    def test_view(self):
+        self.should_be_callable_when_authenticated(self.user)
+        resp = self.client.get(self.get_url())
+        self.assertEqual(list(resp.context['object_list']),
+                         self.events[:0:-1])
+        self.assertIsNone(resp.context['previous_cursor'])
+        self.assertIsNone(resp.context['paginator'], msg=(
+            'Should not count the events.'))
+
+        resp = self.client.get(self.get_url(), data={
+            'after': resp.context['next_cursor']})
+        self.assertEqual(list(resp.context['object_list']), self.events[:1])
+        self.assertIsNone(resp.context['next_cursor'])
+
+        resp = self.client.get(self.get_url(), data={
+            'before': resp.context['previous_cursor']})
+        self.assertEqual(list(resp.context['object_list']),
+                         self.events[:0:-1])
+
+        self.is_not_callable(data={'after': 'foo'})
+
 
 class ObjectEventsMarkViewTestCase(ViewTestMixin, TestCase):
     """Tests for the ``ObjectEventsMarkView`` view."""
@@ -46,9 +105,13 @@ class ObjectEventsMarkViewTestCase(ViewTestMixin, TestCase):
         self.is_not_callable(method='post', data={'single_mark': 999})
 
         # Successful post and redirect to custom url
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 1)
         self.is_callable(method='post', and_redirects_to='/test/',
                          data={'single_mark': self.event.pk, 'next': '/test/'})
         self.assertTrue(ObjectEvent.objects.get(pk=self.event.pk).read_by_user)
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 0)
 
         # Succesful single-mark AJAX post
         resp = self.client.post(self.get_url(), {'single_mark': self.event.pk},
@@ -69,10 +132,227 @@ class ObjectEventsMarkViewTestCase(ViewTestMixin, TestCase):
         self.is_callable(method='post',
                          data={'bulk_mark': '{0}, {1}, '.format(e2.pk, e3.pk)},
                          and_redirects_to=reverse('object_events_list'))
-        self.assertTrue(ObjectEvent.objects.get(pk=e2.pk).read_by_user)
-        self.assertTrue(ObjectEvent.objects.get(pk=e3.pk).read_by_user)
+        self.assertFalse(ObjectEvent.objects.unread(self.user))
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 0)
 
         # Succesful bulk-mark AJAX post
         resp = self.client.post(self.get_url(), {'bulk_mark': e2.pk},
                                 HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(resp.content, 'marked')
+
+    def test_mark_ids(self):
+        events = [self.event] + [
+            ObjectEventFactory(user=self.user) for i in range(2)]
+        other_event = ObjectEventFactory()
+        ids = ','.join(str(event.pk) for event in events + [other_event])
+        self.login(self.user)
+        with CaptureQueriesContext(connection) as context:
+            resp = self.client.post(self.get_url(), {'mark_ids': ids},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(json.loads(resp.content), {'marked': 3, 'unread': 0})
+        self.assertEqual(len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "object_events_objectevent"')
+        ]), 1, msg='Should mark all events with one UPDATE.')
+        self.assertFalse(ObjectEvent.objects.get(
+            pk=other_event.pk).read_by_user, msg=(
+                'Should not mark the events of other users.'))
+        resp = self.client.post(
+            self.get_url(), {'mark_ids': events[0].pk, 'unread': 1},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(json.loads(resp.content), {'marked': 1, 'unread': 1})
+        self.is_callable(method='post', data={'mark_ids': '1,foo'},
+                         status_code=404)
+        self.is_callable(method='post', data={'mark_ids': events[1].pk},
+                         and_redirects_to=reverse('object_events_list'))
+        resp = self.client.post(
+            self.get_url(), {'mark_ids': events[0].pk, 'beacon': 1})
+        self.assertEqual(resp.status_code, 204, msg=(
+            'Should not redirect a beacon.'))
+        self.assertTrue(ObjectEvent.objects.get(pk=events[0].pk).read_by_user)
+
+    def test_audience_event(self):
+        event = ObjectEvent.create_audience_event('all', self.event)
+        group_event = ObjectEvent.create_audience_event(
+            'group', self.event, group=Group.objects.create(name='staff'))
+        self.is_not_callable(method='post', user=self.user,
+                             data={'single_mark': group_event.pk})
+        self.is_callable(method='post', data={'single_mark': event.pk},
+                         and_redirects_to=reverse('object_events_list'))
+        self.assertTrue(event.read_markers.filter(user=self.user).exists())
+        self.assertFalse(ObjectEvent.objects.get(pk=event.pk).read_by_user,
+                         msg='Should not flag the shared event itself.')
+        self.assertEqual(
+            ObjectEventUserState.objects.get_unread_count(self.user), 1)
+
+
+class ObjectEventsUnreadAPIViewTestCase(ViewTestMixin, TestCase):
+    """Tests for the ``ObjectEventsUnreadAPIView`` view."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        ObjectEvent.create_event(self.user, self.user)
+
+    def get_view_name(self):
+        return 'object_events_api_unread'
+
+    def test_view(self):
+        self.is_callable(anonymous=True, status_code=403)
+        resp = self.is_callable(user=self.user)
+        self.assertEqual(json.loads(resp.content), {'unread': 1})
+        etag = resp['ETag']
+        self.is_callable(extra={'HTTP_IF_NONE_MATCH': etag}, status_code=304)
+        ObjectEvent.create_event(self.user, self.user)
+        resp = self.is_callable(extra={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(json.loads(resp.content), {'unread': 2}, msg=(
+            'Should return the new amount, after an event was created.'))
+
+    def test_cached_versions(self):
+        cache_alias = app_settings.NOTIFICATIONS_CACHE
+        app_settings.NOTIFICATIONS_CACHE = 'default'
+        caches['default'].clear()
+        try:
+            etag = self.is_callable(user=self.user)['ETag']
+            with CaptureQueriesContext(connection) as context:
+                self.is_callable(extra={'HTTP_IF_NONE_MATCH': etag},
+                                 status_code=304)
+            self.assertFalse([
+                query for query in context.captured_queries
+                if 'object_events_' in query['sql']], msg=(
+                    'Should not touch the tables of the app, if nothing'
+                    ' changed.'))
+            ObjectEventUserState.objects.mark_all_read(self.user)
+            resp = self.is_callable(extra={'HTTP_IF_NONE_MATCH': etag})
+            self.assertEqual(json.loads(resp.content), {'unread': 0})
+        finally:
+            app_settings.NOTIFICATIONS_CACHE = cache_alias
+            caches['default'].clear()
+
+
+class ObjectEventsAPIViewTestCase(ViewTestMixin, TestCase):
+    """Tests for the ``ObjectEventsAPIView`` view."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.first = ObjectEvent.create_event(
+            self.user, self.user, event_type='foo', additional_text='bar')
+        self.second = ObjectEvent.create_audience_event('all', self.user)
+
+    def get_view_name(self):
+        return 'object_events_api_events'
+
+    def test_view(self):
+        self.is_callable(anonymous=True, status_code=403)
+        data = json.loads(self.is_callable(user=self.user).content)
+        self.assertEqual(data['since'], self.second.pk)
+        self.assertEqual(data['unread'], 2)
+        self.assertEqual(
+            [event['id'] for event in data['events']],
+            [self.second.pk, self.first.pk])
+        self.assertEqual(
+            sorted(data['events'][1].keys()),
+            ['additional_text', 'created', 'id', 'read', 'text', 'type'],
+            msg='Should leave out empty values.')
+
+        data = json.loads(self.is_callable(
+            data={'since': self.first.pk}).content)
+        self.assertEqual(
+            [event['id'] for event in data['events']], [self.second.pk])
+        data = json.loads(self.is_callable(
+            data={'since': self.second.pk}).content)
+        self.assertEqual(data['events'], [])
+        self.assertEqual(data['since'], self.second.pk)
+        data = json.loads(self.is_callable(data={'limit': 1}).content)
+        self.assertEqual(len(data['events']), 1)
+        self.is_callable(data={'since': 'foo'}, status_code=400)
+
+    def test_more_than_limit(self):
+        events = [ObjectEvent.create_event(self.user, self.user)
+                  for i in range(3)]
+        data = json.loads(self.is_callable(user=self.user, data={
+            'since': self.second.pk, 'limit': 2}).content)
+        self.assertEqual(
+            [event['id'] for event in data['events']],
+            [events[1].pk, events[0].pk], msg=(
+                'Should return the oldest events after since.'))
+        self.assertTrue(data['more'])
+        data = json.loads(self.is_callable(data={
+            'since': data['since'], 'limit': 2}).content)
+        self.assertEqual(
+            [event['id'] for event in data['events']], [events[2].pk])
+        self.assertFalse(data['more'])
+
+
+class ObjectEventsMarkAPIViewTestCase(ViewTestMixin, TestCase):
+    """Tests for the ``ObjectEventsMarkAPIView`` view."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.events = [ObjectEvent.create_event(self.user, self.user)
+                       for i in range(3)]
+
+    def get_view_name(self):
+        return 'object_events_api_mark'
+
+    def test_view(self):
+        self.is_callable(method='post', anonymous=True, status_code=403)
+        self.is_callable(user=self.user, status_code=405)
+        resp = self.is_callable(method='post', data={'ids': '{0},{1}'.format(
+            self.events[0].pk, self.events[1].pk)})
+        self.assertEqual(json.loads(resp.content), {'marked': 2, 'unread': 1})
+        self.is_callable(method='post', data={'ids': 'foo'}, status_code=400)
+        self.is_callable(method='post', data={'ids': ''}, status_code=400)
+        resp = self.is_callable(method='post', data={
+            'ids': self.events[0].pk, 'unread': 1})
+        self.assertEqual(json.loads(resp.content), {'marked': 1, 'unread': 2})
+        resp = self.is_callable(method='post', data={'ids': 'all'})
+        self.assertEqual(json.loads(resp.content), {'marked': 2, 'unread': 0})
+
+
+class ObjectEventsStreamViewTestCase(ViewTestMixin, TestCase):
+    """Tests for the ``ObjectEventsStreamView`` view."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.event = ObjectEvent.create_event(self.user, self.user)
+
+    def get_view_name(self):
+        return 'object_events_api_stream'
+
+    def get_messages(self, content, amount):
+        return [json.loads(next(content).split(b'data: ')[1].decode())
+                for i in range(amount)]
+
+    def test_view(self):
+        self.is_callable(anonymous=True, status_code=403)
+        self.is_callable(user=self.user, data={'since': 'foo'},
+                         status_code=400)
+        request = RequestFactory().get(
+            '/', HTTP_LAST_EVENT_ID=str(self.event.pk))
+        request.user = self.user
+        response = ObjectEventsStreamView.as_view(
+            timeout=0.3, heartbeat=0.05)(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), b'retry: 1000\n\n')
+        self.assertEqual(self.get_messages(content, 1), [{
+            'events': [], 'more': False, 'since': self.event.pk,
+            'unread': 1}], msg=(
+                'Should start with the state after the last event id.'))
+        self.assertEqual(next(content), b': keep-alive\n\n')
+
+        new_event = ObjectEvent.create_event(self.user, self.user)
+        get_broker().publish([self.user.pk], {'type': 'changed'})
+        get_broker().publish([self.user.pk], {'type': 'changed'})
+        message = self.get_messages(content, 1)[0]
+        self.assertEqual(
+            [event['id'] for event in message['events']], [new_event.pk])
+        self.assertEqual(message['unread'], 2)
+        self.assertEqual(set(list(content)), set([b': keep-alive\n\n']),
+                         msg='Should end the stream after the timeout.')
+        self.assertEqual(get_broker().subscriptions, {})
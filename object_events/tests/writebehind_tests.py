@@ -0,0 +1,81 @@
+"""Tests for the write-behind queue of the ``object_events`` app."""
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from django_libs.tests.factories import UserFactory
+
+from ..models import ObjectEvent, ObjectEventType
+from ..writebehind import EventQueue, get_event_queue
+
+
+class EventQueueTestCase(TransactionTestCase):
+    """Tests for the ``EventQueue`` class."""
+    longMessage = True
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.queue = EventQueue(3, 0.01, 2, autostart=False)
+
+    def tearDown(self):
+        # The flush of the database doesn't update the event type cache.
+        ObjectEventType.objects.clear_cache()
+
+    def test_flush(self):
+        for i in range(3):
+            self.queue.put((self.user, self.user, None, 'foo'))
+        self.assertEqual(self.queue.get_metrics()['depth'], 3)
+        self.assertEqual(self.queue.flush(), 2, msg=(
+            'Should not insert more than flush_size events at once.'))
+        self.assertEqual(ObjectEvent.objects.count(), 2)
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.queue.get_metrics(), {
+            'depth': 0, 'enqueued': 3, 'flushed': 3, 'blocked': 0,
+            'dropped': 0, 'failed': 0})
+
+    def test_full_queue(self):
+        for i in range(4):
+            self.queue.put((self.user, self.user))
+        self.assertEqual(self.queue.get_metrics()['dropped'], 1)
+        self.queue.block_timeout = 0.01
+        self.queue.put((self.user, self.user))
+        metrics = self.queue.get_metrics()
+        self.assertEqual(metrics['blocked'], 1)
+        self.assertEqual(metrics['dropped'], 2)
+        self.assertEqual(metrics['depth'], 3)
+
+    def test_transaction(self):
+        with transaction.atomic():
+            self.queue.put((self.user, self.user))
+            self.assertEqual(self.queue.get_metrics()['depth'], 0, msg=(
+                'Should wait until the transaction is committed.'))
+        self.assertEqual(self.queue.get_metrics()['depth'], 1)
+        try:
+            with transaction.atomic():
+                self.queue.put((self.user, self.user))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.queue.get_metrics()['depth'], 1, msg=(
+            'Should not enqueue events of rolled back transactions.'))
+
+    def test_stop(self):
+        self.queue.put((self.user, self.user))
+        self.queue.put((self.user, self.user))
+        self.queue.put((self.user, self.user))
+        self.queue.stop()
+        self.assertEqual(ObjectEvent.objects.count(), 3, msg=(
+            'Should insert all waiting events when stopped.'))
+
+    def test_start(self):
+        self.queue.start()
+        self.assertTrue(self.queue.thread.is_alive())
+        self.queue.stop()
+        self.assertIsNone(self.queue.thread)
+
+
+class GetEventQueueTestCase(TestCase):
+    """Tests for the ``get_event_queue`` function."""
+    def test_function(self):
+        self.assertIsInstance(get_event_queue(), EventQueue)
+        self.assertIs(get_event_queue(), get_event_queue())
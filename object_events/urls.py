@@ -1,11 +1,26 @@
 """Urls for the ``object_events`` app."""
 from django.conf.urls import patterns, url
 
-from .views import ObjectEventsMarkView, ObjectEventsListView
+from .views import (
+    ObjectEventsAPIView,
+    ObjectEventsListView,
+    ObjectEventsMarkAPIView,
+    ObjectEventsMarkView,
+    ObjectEventsStreamView,
+    ObjectEventsUnreadAPIView,
+)
 
 
 urlpatterns = patterns(
     '',
     url(r'^mark/$', ObjectEventsMarkView.as_view(), name='object_events_mark'),
+    url(r'^api/unread/$', ObjectEventsUnreadAPIView.as_view(),
+        name='object_events_api_unread'),
+    url(r'^api/events/$', ObjectEventsAPIView.as_view(),
+        name='object_events_api_events'),
+    url(r'^api/mark/$', ObjectEventsMarkAPIView.as_view(),
+        name='object_events_api_mark'),
+    url(r'^api/stream/$', ObjectEventsStreamView.as_view(),
+        name='object_events_api_stream'),
     url(r'^$', ObjectEventsListView.as_view(), name='object_events_list'),
 )
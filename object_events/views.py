@@ -1,12 +1,34 @@
 """Views for the ``object_events`` app."""
+import json
+import time
+from hashlib import md5
+
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.http import Http404, HttpResponse
+from django.db import connection
+from django.http import (
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.dateformat import format as date_format
 from django.utils.decorators import method_decorator
-from django.views.generic import ListView, RedirectView
+from django.utils.encoding import force_bytes
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.generic import ListView, RedirectView, View
 
-from .models import ObjectEvent
-from .app_settings import PAGINATION_ITEMS
+from .brokers import get_broker
+from .cache import get_versions
+from .models import ObjectEvent, load_read_state
+from .app_settings import (
+    CURSOR_PAGINATION,
+    PAGINATION_ITEMS,
+    STREAM_HEARTBEAT,
+    STREAM_TIMEOUT,
+)
+from .storage import get_storage
 
 
 def is_integer(mark_string):
@@ -18,9 +40,235 @@ def is_integer(mark_string):
     return mark_id
 
 
+def parse_ids(ids_string):
+    """
+    Returns the pks of a comma separated list.
+
+    Returns ``None``, if the list is empty or any item is no integer.
+
+    """
+    pks = [is_integer(pk) for pk in ids_string.split(',') if pk.strip()]
+    if not pks or not all(pks):
+        return None
+    return pks
+
+
+def get_etag(request, *args, **kwargs):
+    """
+    Returns the ETag of the notifications of the current user.
+
+    It is derived from the cache versions of the user, so an unchanged poll
+    costs no database queries. If the notifications cache is disabled, it is
+    derived from the version of the storage backend instead, which is a
+    single row for the ``ModelStorage``.
+
+    """
+    user = request.user
+    if not user.is_authenticated():
+        return None
+    versions = get_versions(user.pk)
+    if versions is None:
+        versions = get_storage().get_version(user)
+    return md5(force_bytes(u'{0}:{1}'.format(
+        versions, request.GET.urlencode()))).hexdigest()
+
+
+def serialize_event(event):
+    """Returns a compact dict of the event, leaving out empty values."""
+    data = {
+        'id': event.pk,
+        'type': event.event_type.title,
+        'text': u'{0}'.format(event),
+        'created': int(date_format(event.creation_date, 'U')),
+        'read': event.read_by_user,
+    }
+    if event.additional_text:
+        data['additional_text'] = event.additional_text
+    if event.coalesced_count > 1:
+        data['count'] = event.coalesced_count
+    if hasattr(event.content_object, 'get_absolute_url'):
+        data['url'] = event.content_object.get_absolute_url()
+    return data
+
+
+def get_events_data(user, since=0, limit=PAGINATION_ITEMS):
+    """
+    Returns the latest events of the user and the unread amount as a dict.
+
+    With ``since``, ``more`` tells, that there are newer events than the
+    returned ones, which the next request with the new ``since`` returns.
+
+    :param since: Only returns events with a higher pk.
+    :param limit: Maximum amount of events.
+
+    """
+    events, unread_count = get_storage().get_feed(user, limit, since)
+    return {
+        'events': [serialize_event(event) for event in events],
+        'more': bool(since) and limit > 0 and len(events) >= limit,
+        'since': max(event.pk for event in events) if events else since,
+        'unread': unread_count,
+    }
+
+
+class ObjectEventsAPIMixin(object):
+    """
+    Mixin for the JSON views of the ``object_events`` app.
+
+    Anonymous users get a 403 response instead of a redirect. Clients may
+    keep responses, but have to revalidate them with their ETag.
+
+    """
+    @method_decorator(cache_control(private=True, no_cache=True))
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated():
+            return JsonResponse({'error': 'login required'}, status=403)
+        self.user = request.user
+        return super(ObjectEventsAPIMixin, self).dispatch(request, *args,
+                                                          **kwargs)
+
+
+class ObjectEventsUnreadAPIView(ObjectEventsAPIMixin, View):
+    """Returns the amount of unread events of the user."""
+
+    @method_decorator(condition(etag_func=get_etag))
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'unread': get_storage().get_unread_count(self.user),
+        })
+
+
+class ObjectEventsAPIView(ObjectEventsAPIMixin, View):
+    """
+    Returns the latest events of the user.
+
+    ``since`` only returns events with a higher pk, ``limit`` sets the
+    amount of events, which is at most ``OBJECT_EVENTS_PAGINATION_ITEMS``.
+    The ``since`` value of the response can be used for the next poll.
+
+    """
+    @method_decorator(condition(etag_func=get_etag))
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET.get('since') or 0)
+            limit = min(int(request.GET.get('limit') or PAGINATION_ITEMS),
+                        PAGINATION_ITEMS)
+        except ValueError:
+            return JsonResponse(
+                {'error': 'since and limit must be integers'}, status=400)
+        return JsonResponse(get_events_data(self.user, since, limit))
+
+
+class ObjectEventsStreamView(ObjectEventsAPIMixin, View):
+    """
+    Streams the changes of the notifications as server-sent events.
+
+    Every time the broker announces a change, the new events and the unread
+    amount are sent in the same format as by ``ObjectEventsAPIView``. The
+    ``Last-Event-ID`` header or the ``since`` parameter tell the stream,
+    which events the client knows already.
+
+    The connection is closed after ``timeout`` seconds and the browser
+    reconnects a second later. While it is idle, a comment is sent every
+    ``heartbeat`` seconds and the stream doesn't hold a database connection.
+
+    """
+    timeout = STREAM_TIMEOUT
+    heartbeat = STREAM_HEARTBEAT
+
+    def get(self, request, *args, **kwargs):
+        since = is_integer(request.META.get('HTTP_LAST_EVENT_ID') or
+                           request.GET.get('since') or '0')
+        if since is False:
+            return JsonResponse({'error': 'since must be an integer'},
+                                status=400)
+        response = StreamingHttpResponse(
+            self.stream(since), content_type='text/event-stream')
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def get_messages(self, since):
+        """
+        Returns the new ``since`` and the messages with all events after
+        ``since``, one per chunk of ``OBJECT_EVENTS_PAGINATION_ITEMS``.
+
+        """
+        messages = []
+        while True:
+            data = get_events_data(self.user, since)
+            since = data['since']
+            messages.append(u'id: {0}\ndata: {1}\n\n'.format(
+                since, json.dumps(data, separators=(',', ':'))))
+            if not data['more']:
+                return since, messages
+
+    def stream(self, since):
+        subscription = get_broker().subscribe(self.user.pk)
+        try:
+            deadline = time.time() + self.timeout
+            yield 'retry: 1000\n\n'
+            since, messages = self.get_messages(since)
+            for message in messages:
+                yield message
+            while time.time() < deadline:
+                if not connection.in_atomic_block:
+                    connection.close()
+                if subscription.get(max(min(
+                        self.heartbeat, deadline - time.time()), 0)) is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                # Changes that were announced in the meantime are part of
+                # this message.
+                while subscription.get(0) is not None:
+                    pass
+                since, messages = self.get_messages(since)
+                for message in messages:
+                    yield message
+        finally:
+            subscription.close()
+
+
+class ObjectEventsMarkAPIView(ObjectEventsAPIMixin, View):
+    """
+    Marks events of the user as read.
+
+    Expects ``ids`` as a comma separated list of pks or ``all``. If
+    ``unread`` is given, the listed events are marked as unread instead.
+
+    """
+    def post(self, request, *args, **kwargs):
+        storage = get_storage()
+        ids = request.POST.get('ids', '')
+        if ids == 'all' and not request.POST.get('unread'):
+            marked = storage.get_unread_count(self.user)
+            storage.mark_all_read(self.user)
+        else:
+            pks = parse_ids(ids)
+            if pks is None:
+                return JsonResponse(
+                    {'error': 'ids must be a list of integers or all'},
+                    status=400)
+            if request.POST.get('unread'):
+                marked = storage.mark_unread(self.user, pks)
+            else:
+                marked = storage.mark_read(self.user, pks)
+        return JsonResponse({
+            'marked': marked,
+            'unread': storage.get_unread_count(self.user),
+        })
+
+
 class ObjectEventsListView(ListView):
-    """View to display a defined amount of notifications."""
+    """
+    View to display a defined amount of notifications.
+
+    If ``cursor_pagination`` is ``True``, the pages are addressed by the
+    ``after`` and ``before`` cursors instead of page numbers and are loaded
+    from the storage backend. Numbered pages always query ``ObjectEvent``.
+
+    """
     paginate_by = PAGINATION_ITEMS
+    cursor_pagination = CURSOR_PAGINATION
 
     @method_decorator(login_required)
     def dispatch(self, request, *args, **kwargs):
@@ -29,32 +277,86 @@ class ObjectEventsListView(ListView):
                                                           **kwargs)
 
     def get_queryset(self):
-        return ObjectEvent.objects.filter(user=self.user)
+        return ObjectEvent.objects.recent().for_user(
+            self.user).with_related()
+
+    def get_paginate_by(self, queryset):
+        if self.cursor_pagination:
+            return None
+        return super(ObjectEventsListView, self).get_paginate_by(queryset)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super(
+            ObjectEventsListView, self).paginate_queryset(queryset, page_size)
+        page.object_list = load_read_state(list(object_list), self.user)
+        return paginator, page, page.object_list, is_paginated
+
+    def get_context_data(self, **kwargs):
+        if not self.cursor_pagination:
+            return super(ObjectEventsListView, self).get_context_data(
+                **kwargs)
+        try:
+            page = get_storage().paginate(
+                self.user, self.paginate_by,
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before'))
+        except ValueError:
+            raise Http404
+        kwargs['object_list'] = page.object_list
+        ctx = super(ObjectEventsListView, self).get_context_data(**kwargs)
+        ctx.update({
+            'cursor_pagination': True,
+            'is_paginated': bool(page.next_cursor or page.previous_cursor),
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+        })
+        return ctx
 
 
 class ObjectEventsMarkView(RedirectView):
-    """View to mark a set of object events as read."""
+    """
+    View to mark a set of object events as read.
+
+    ``single_mark`` marks one event, ``mark_ids`` a comma separated list of
+    events and ``bulk_mark`` all events of the user. If ``unread`` is given
+    along with ``mark_ids``, the events are marked as unread instead. If
+    ``beacon`` is given, ``204 No Content`` is returned instead of a redirect,
+    since ``navigator.sendBeacon`` would follow it.
+
+    """
     permanent = False
 
     @method_decorator(login_required)
     def dispatch(self, request, *args, **kwargs):
         if not request.method == 'POST':
             raise Http404
+        storage = get_storage()
         if request.POST.get('single_mark'):
             mark_id = is_integer(request.POST.get('single_mark'))
             if not mark_id:
                 raise Http404
-            try:
-                event = ObjectEvent.objects.get(user=request.user, pk=mark_id)
-            except ObjectEvent.DoesNotExist:
+            if not storage.mark_read(request.user, [mark_id]) and not (
+                    storage.has_event(request.user, mark_id)):
                 raise Http404
-            event.read_by_user = True
-            event.save()
             if request.is_ajax():
                 return HttpResponse('marked')
+        elif request.POST.get('mark_ids'):
+            pks = parse_ids(request.POST.get('mark_ids'))
+            if pks is None:
+                raise Http404
+            if request.POST.get('unread'):
+                marked = storage.mark_unread(request.user, pks)
+            else:
+                marked = storage.mark_read(request.user, pks)
+            if request.POST.get('beacon'):
+                return HttpResponse(status=204)
+            if request.is_ajax():
+                return JsonResponse({
+                    'marked': marked,
+                    'unread': storage.get_unread_count(request.user),
+                })
         elif request.POST.get('bulk_mark'):
-            events = ObjectEvent.objects.filter(user=request.user)
-            events.update(read_by_user=True)
+            storage.mark_all_read(request.user)
             if request.is_ajax():
                 return HttpResponse('marked')
         return super(ObjectEventsMarkView, self).dispatch(request, *args,
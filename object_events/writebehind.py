@@ -0,0 +1,174 @@
+"""
+Write-behind queue for the ``object_events`` app.
+
+Events that are passed to ``ObjectEvent.enqueue_event`` are collected in a
+bounded in-process queue. A background thread inserts them with
+``ObjectEvent.create_events`` every ``OBJECT_EVENTS_WRITE_BEHIND_INTERVAL``
+milliseconds or as soon as ``OBJECT_EVENTS_WRITE_BEHIND_FLUSH_SIZE`` events
+are waiting, whatever happens first. Events enqueued inside a transaction are
+only added to the queue once the transaction has been committed. The queue is
+flushed when the process exits.
+
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.db import connection, transaction
+from django.utils.six.moves import queue
+
+from . import app_settings, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue(object):
+    """
+    Bounded queue of events that are inserted by a background thread.
+
+    :param maxsize: Maximum amount of waiting events.
+    :param interval: Seconds between two flushes.
+    :param flush_size: Maximum amount of events inserted per flush.
+    :param block_timeout: Seconds to wait for a free slot, if the queue is
+      full. If there is still no free slot (or if it is ``0``), the event is
+      dropped.
+    :param autostart: Starts the background thread with the first event.
+
+    """
+    def __init__(self, maxsize, interval, flush_size, block_timeout=0,
+                 autostart=True):
+        self.queue = queue.Queue(maxsize)
+        self.interval = interval
+        self.flush_size = flush_size
+        self.block_timeout = block_timeout
+        self.autostart = autostart
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.enqueued = 0
+        self.flushed = 0
+        self.blocked = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, event):
+        """
+        Adds the event to the queue, once the current transaction commits.
+
+        :param event: Tuple of ``ObjectEvent.create_events`` arguments.
+
+        """
+        transaction.on_commit(lambda: self._put(event))
+
+    def _put(self, event):
+        if self.autostart and self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            if not self.block_timeout:
+                self._count('dropped')
+                return
+            self._count('blocked')
+            try:
+                self.queue.put(event, timeout=self.block_timeout)
+            except queue.Full:
+                self._count('dropped')
+                return
+        self._count('enqueued')
+
+    def _count(self, metric, amount=1):
+        with self.lock:
+            setattr(self, metric, getattr(self, metric) + amount)
+        metrics.incr('writebehind.{0}'.format(metric), amount)
+
+    def flush(self, wait=0):
+        """
+        Inserts up to ``flush_size`` waiting events.
+
+        :param wait: Seconds to wait for more events before inserting them.
+        :returns: Amount of events taken from the queue.
+
+        """
+        from .models import ObjectEvent
+        metrics.gauge('writebehind.depth', self.queue.qsize())
+        events = []
+        deadline = time.time() + wait
+        while len(events) < self.flush_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    events.append(self.queue.get(timeout=timeout))
+                else:
+                    events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if events:
+            try:
+                ObjectEvent.create_events(events)
+            except Exception:
+                logger.exception('Could not insert %s events.', len(events))
+                self._count('failed', len(events))
+            else:
+                self._count('flushed', len(events))
+        return len(events)
+
+    def run(self):
+        """Flushes the queue until ``stop`` is called."""
+        try:
+            while not self.stopped.is_set():
+                connection.close_if_unusable_or_obsolete()
+                self.flush(wait=self.interval)
+        finally:
+            connection.close()
+
+    def start(self):
+        """Starts the background thread."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the background thread and inserts all waiting events."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        while self.flush():
+            pass
+
+    def get_metrics(self):
+        """Returns a dict with the current depth and counters of the queue."""
+        with self.lock:
+            return {
+                'depth': self.queue.qsize(),
+                'enqueued': self.enqueued,
+                'flushed': self.flushed,
+                'blocked': self.blocked,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
+
+
+_event_queue = None
+_event_queue_lock = threading.Lock()
+
+
+def get_event_queue():
+    """Returns the queue of this process, configured by the settings."""
+    global _event_queue
+    with _event_queue_lock:
+        if _event_queue is None:
+            _event_queue = EventQueue(
+                app_settings.WRITE_BEHIND_QUEUE_SIZE,
+                app_settings.WRITE_BEHIND_INTERVAL / 1000.0,
+                app_settings.WRITE_BEHIND_FLUSH_SIZE,
+                app_settings.WRITE_BEHIND_BLOCK_TIMEOUT,
+            )
+        return _event_queue